@@ -24,12 +24,17 @@ class SqliteDB(object):
         I/O.
     """
 
-    def __init__(self, fileName=":memory:"):
+    def __init__(self, fileName=":memory:", checkSameThread=True):
         """
-            Register the file with "fileName" as the database file.
+            Register the file with "fileName" as the database file. When
+            "checkSameThread" is False the connection can be used by threads
+            other than the one that opened it; the caller must then make sure
+            that only one thread uses it at a time.
         """
         self._registeredDatabase = None # stores the filename for the database
         self._dbCon = None # reference to the database connection
+        self._checkSameThread = checkSameThread
+        self._functions = [] # user functions registered with createFunction
         self.registerDatabase(fileName)
 
     def getRegisteredDatabase(self):
@@ -55,7 +60,21 @@ class SqliteDB(object):
             raise self.SqliteDBError("database not registerd")
         # check if database already open
         if not self._dbCon:
-            self._dbCon = sqlite3.connect(self._registeredDatabase)
+            self._dbCon = sqlite3.connect(self._registeredDatabase,
+                                          check_same_thread=self._checkSameThread)
+            for name, numberOfArguments, function in self._functions:
+                self._dbCon.create_function(name, numberOfArguments, function)
+
+    def createFunction(self, name, numberOfArguments, function):
+        """
+            Make the python function "function", which takes
+            "numberOfArguments" arguments, available in SQL commands under the
+            name "name". The function stays available after the connection is
+            closed and opened again.
+        """
+        self._functions.append((name, numberOfArguments, function))
+        if self._dbCon:
+            self._dbCon.create_function(name, numberOfArguments, function)
 
     def closeConnection(self, discardChanges=False):
         """
@@ -181,6 +200,42 @@ class SqliteDB(object):
         returnValue = self._executeSQL(sqlCommand).fetchall()
         return returnValue
 
+    def selectFromTableInBatches(self, tableName, columnNameList="*", whereClause="", orderByClause="", numberOfRowsPerBatch=100000):
+        """
+            Same as selectFromTable but return a generator that yields the
+            results as lists of at most "numberOfRowsPerBatch" rows, so that
+            large tables can be processed without reading them into memory
+            at once.
+        """
+        if not ListRNew.isIterable(columnNameList):
+            columnNameList = [columnNameList]
+        sqlCommand = "select %s from %s" % (",".join(columnNameList), tableName)
+        if whereClause:
+            sqlCommand += " where " + whereClause
+        if orderByClause:
+            sqlCommand += " order by " + orderByClause
+        cursor = self._executeSQL(sqlCommand)
+        while True:
+            rows = cursor.fetchmany(numberOfRowsPerBatch)
+            if not rows: break
+            yield rows
+
+    def createIndexIfNotExists(self, tableName, columnNameList):
+        """
+            Create an index on the columns with names given in columnNameList
+            for the table with name tableName, if it does not exist already.
+            The index is named by joining the table name and the column names
+            with "_", followed by "_index". Returns False if the index already
+            exists.
+        """
+        if not ListRNew.isIterable(columnNameList):
+            columnNameList = [columnNameList]
+        indexName = "_".join([tableName] + list(columnNameList) + ["index"])
+        existingIndexNames = [item[1] for item in self._executeSQL("select * from sqlite_master") if item[0]=="index"]
+        if indexName in existingIndexNames:
+            return False
+        return self._executeSQL("create index %s on %s (%s)" % (indexName, tableName, ",".join(columnNameList)))
+
     def dropTable(self, tableName):
         """
             Delete the table with name "tableName". Return True upon success; return False
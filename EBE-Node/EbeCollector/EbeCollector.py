@@ -6,16 +6,26 @@
 """
 
 import math
+try:
+    from math import gcd
+except ImportError: # python 2
+    from fractions import gcd
 from sys import exit
+from collections import OrderedDict
 from os import path, listdir
 from subprocess import call
 import re
+import sqlite3
+import time
 import numpy as np
 from numpy import * # used by EbeDBReader.evaluateExpression function to support all math operations
 from DBR import SqliteDB
 from assignmentFormat import assignmentExprStream2IndexDict
 from ListRNew import isIterable
 from StringSubstitution import StringSubstitution
+from ExpressionParser import ExpressionParser
+from MomentAccumulator import MomentAccumulator
+import TableExport
 
 
 
@@ -27,6 +37,12 @@ class EbeCollector(object):
         calculations into databases. For the structure of the database see the 
         documentation in the EbeCollector_readme.txt.
     """
+    # charged hadrons list, also used by the QCumulantReader
+    charged_hadron_list = [
+        "pion_p", "pion_m", "kaon_p", "kaon_m", "proton", "anti_proton",
+        "sigma_p", "sigma_m", "anti_sigma_p", "anti_sigma_m",
+        "xi_m", "anti_xi_m"]
+
     def __init__(self):
         """
             Define class-wise constants and tables.
@@ -82,7 +98,7 @@ class EbeCollector(object):
             "etap"              :   72,
         }
 
-        for aParticle in self.pidDict.keys():
+        for aParticle in list(self.pidDict.keys()):
             if self.pidDict[aParticle]>=0:
                 self.pidDict[aParticle+"_hydro"] = self.pidDict[aParticle]+1000
             else:
@@ -262,16 +278,10 @@ class EbeCollector(object):
             "eta_prime"         :   0.95778,
             "gamma"             :   0.0,
         }
-        for aParticle in self.masspidDict.keys():
+        for aParticle in list(self.masspidDict.keys()):
             self.masspidDict[aParticle+"_hydro"] = self.masspidDict[aParticle]
             self.masspidDict[aParticle+"_thermal"] = self.masspidDict[aParticle]
 
-        # charged hadrons list
-        self.charged_hadron_list = [ 
-            "pion_p", "pion_m", "kaon_p", "kaon_m", "proton", "anti_proton",
-            "sigma_p", "sigma_m", "anti_sigma_p", "anti_sigma_m",
-            "xi_m", "anti_xi_m"]
-
     def collectEccentricitiesAndRIntegrals(self, folder, event_id, db, 
                                            oldStyleStorage=False):
         """
@@ -1213,7 +1223,7 @@ class EbeCollector(object):
     def createDatabaseFromEventFolders(
         self, folder, subfolderPattern="event-\d+", 
         databaseFilename="CollectedResults.db", collectMode="fromUrQMD", 
-        multiplicityFactor=1.0):
+        multiplicityFactor=1.0, createAggregateTables=False):
         """
             This function collect all results (ecc+flow) from subfolders
             whose name have pattern "subfolderPattern" to a database
@@ -1254,6 +1264,9 @@ class EbeCollector(object):
             
             -- "fromPureHydro11P5N":
                collect data from old 11P5N format
+
+            When "createAggregateTables" is True, the aggregate tables (see
+            updateAggregateTables) are also created.
         """
         # the data collection loop
         db = SqliteDB(path.join(folder, databaseFilename))
@@ -1356,6 +1369,11 @@ class EbeCollector(object):
             print("!"*60)
             exit(1)
 
+        # catalog the collected events
+        self.updateEventCatalog(db)
+        if createAggregateTables:
+            self.updateAggregateTables(db)
+
     def collectParticleinfo(
         self, folder, subfolderPattern="event-(\d*)", 
         resultFilename="particle_list.dat", databaseFilename="particles.db", 
@@ -1415,33 +1433,279 @@ class EbeCollector(object):
                                           deformed) 
 
 
+    catalogTables = ("event_catalog", "pid_catalog")
+
+    def _scanEventCatalog(self, db):
+        """
+            Scan all tables with an "event_id" field in the database "db" and
+            return the tuple (set of event ids, pid catalog), where the pid
+            catalog is a dictionary {(table name, pid): [number of events,
+            number of rows]} for all tables that also have a "pid" field.
+        """
+        eventIds = set()
+        pidCatalog = {}
+        for aTable in db.getAllTableNames():
+            if aTable in self.catalogTables or "lookup" in aTable:
+                continue
+            fields = [item[0] for item in db.getTableInfo(aTable)]
+            if "event_id" not in fields:
+                continue
+            eventIds.update(item[0] for item in
+                            db.selectFromTable(aTable, "distinct event_id"))
+            if "pid" in fields:
+                for pid, numberOfEvents, numberOfRows in db.selectFromTable(
+                        aTable, ("pid", "count(distinct event_id)", "count()"),
+                        groupByClause="pid"):
+                    pidCatalog[(aTable, pid)] = [numberOfEvents, numberOfRows]
+        return eventIds, pidCatalog
+
+    def _readEventCatalog(self, db):
+        """
+            Return the tuple (set of event ids, pid catalog) stored in the
+            catalog tables of the database "db", in the same format as
+            returned by _scanEventCatalog; return None if the database has no
+            catalog.
+        """
+        if not db.doesTableExist("pid_catalog"):
+            return None
+        eventIds = set(item[0] for item in
+                       db.selectFromTable("event_catalog", "event_id"))
+        pidCatalog = dict(((aTable, pid), [numberOfEvents, numberOfRows])
+                          for aTable, pid, numberOfEvents, numberOfRows
+                          in db.selectFromTable("pid_catalog"))
+        return eventIds, pidCatalog
+
+    def _writeEventCatalog(self, db, eventIds, pidCatalog):
+        """
+            Replace the catalog tables in the database "db" by the given set of
+            event ids and pid catalog.
+        """
+        for aTable in self.catalogTables:
+            db.dropTable(aTable)
+        db.createTableIfNotExists("event_catalog", ("event_id", "integer"))
+        db.createTableIfNotExists("pid_catalog", (("table_name", "text"),
+            ("pid", "integer"), ("number_of_events", "integer"),
+            ("number_of_rows", "integer")))
+        if eventIds:
+            db.insertIntoTable("event_catalog",
+                               [(eid,) for eid in sorted(eventIds)])
+        if pidCatalog:
+            db.insertIntoTable("pid_catalog",
+                [(aTable, pid) + tuple(counts) for (aTable, pid), counts
+                 in sorted(pidCatalog.items())])
+
+    def updateEventCatalog(self, db):
+        """
+            Rebuild the "event_catalog" and "pid_catalog" tables of the
+            database "db" from its contents. The "event_catalog" table lists
+            the event ids of all the events in the database, and the
+            "pid_catalog" table records for each table with a "pid" field and
+            each pid the number of events and the number of rows.
+        """
+        eventIds, pidCatalog = self._scanEventCatalog(db)
+        self._writeEventCatalog(db, eventIds, pidCatalog)
+        self.createEventIdIndices(db)
+        db.closeConnection() # commit
+
+    def createEventIdIndices(self, db):
+        """
+            Create an index on the "event_id" field for all tables in the
+            database "db" that have this field, so that queries restricted to
+            a selection of events read only the selected rows.
+        """
+        for aTable in db.getAllTableNames():
+            if "event_id" in [item[0] for item in db.getTableInfo(aTable)]:
+                db.createIndexIfNotExists(aTable, "event_id")
+
+    # aggregate tables: (name, source table, key fields, real part, imaginary
+    # part, additional (name, field) to be summed)
+    aggregateTables = (
+        ("aggregate_inte_vn", "inte_vn", ("pid", "n"), "vn_real", "vn_imag",
+            ()),
+        ("aggregate_eccentricities", "eccentricities",
+            ("ecc_id", "r_power", "n"), "ecc_real", "ecc_imag", ()),
+        ("aggregate_multiplicities", "multiplicities", ("pid",), "N", "0", ()),
+        ("aggregate_diff_vn", "diff_vn", ("pid", "n", "pT_index"), "vn_real",
+            "vn_imag", (("sum_pT", "pT"),)),
+    )
+    aggregateValueFields = ("count", "sum_real", "sum_imag", "sum_abs",
+                            "sum_abs2", "sum_abs4")
+
+    def _computeAggregates(self, db):
+        """
+            Compute the aggregates for the database "db" and return them as a
+            dictionary {aggregate table name: {key: list of sums}}, where the
+            sums are in the order of aggregateValueFields followed by the
+            additional sums. The "diff_vn" table is aggregated per pT bin,
+            with the bins numbered by increasing pT within each event; this
+            needs SQLite 3.25 or later.
+        """
+        db.createFunction("sqrt", 1, math.sqrt)
+        existingTables = db.getAllTableNames()
+        aggregates = {}
+        for (aggregateTable, sourceTable, keyFields, realField, imagField,
+             additionalSums) in self.aggregateTables:
+            if sourceTable not in existingTables:
+                continue
+            if aggregateTable == "aggregate_diff_vn":
+                if sqlite3.sqlite_version_info < (3, 25, 0):
+                    continue
+                sourceTable = ("(select *, row_number() over (partition by "
+                    + "event_id, pid, n order by pT)-1 as pT_index "
+                    + "from diff_vn)")
+            abs2 = "(%s*%s+%s*%s)" % (realField, realField, imagField,
+                                      imagField)
+            sums = ["count()", "sum(%s)" % realField, "sum(%s)" % imagField,
+                    "sum(sqrt(%s))" % abs2, "sum(%s)" % abs2,
+                    "sum(%s*%s)" % (abs2, abs2)]
+            sums.extend("sum(%s)" % field for name, field in additionalSums)
+            numberOfKeys = len(keyFields)
+            aggregates[aggregateTable] = dict(
+                (tuple(row[:numberOfKeys]), list(row[numberOfKeys:]))
+                for row in db.selectFromTable(sourceTable,
+                    list(keyFields) + sums, groupByClause=",".join(keyFields)))
+        return aggregates
+
+    @classmethod
+    def _readAggregates(cls, db):
+        """
+            Return the aggregates stored in the database "db" in the same format
+            as returned by _computeAggregates, or None if the database has no
+            aggregate tables.
+        """
+        existingTables = db.getAllTableNames()
+        aggregates = {}
+        for aggregateTable, sourceTable, keyFields, realField, imagField, \
+                additionalSums in cls.aggregateTables:
+            if aggregateTable not in existingTables:
+                continue
+            numberOfKeys = len(keyFields)
+            aggregates[aggregateTable] = dict(
+                (tuple(row[:numberOfKeys]), list(row[numberOfKeys:]))
+                for row in db.selectFromTable(aggregateTable))
+        return aggregates or None
+
+    def _writeAggregates(self, db, aggregates):
+        """
+            Replace the aggregate tables in the database "db" by the given
+            aggregates; aggregate tables not in "aggregates" are dropped.
+        """
+        for aggregateTable, sourceTable, keyFields, realField, imagField, \
+                additionalSums in self.aggregateTables:
+            db.dropTable(aggregateTable)
+            if aggregateTable not in aggregates:
+                continue
+            db.createTableIfNotExists(aggregateTable,
+                [(aField, "integer") for aField in keyFields]
+                + [("count", "integer")]
+                + [(aField, "real") for aField in
+                   self.aggregateValueFields[1:]]
+                + [(name, "real") for name, field in additionalSums])
+            if aggregates[aggregateTable]:
+                db.insertIntoTable(aggregateTable,
+                    [tuple(key) + tuple(sums) for key, sums
+                     in sorted(aggregates[aggregateTable].items())])
+
+    def updateAggregateTables(self, db):
+        """
+            Rebuild the aggregate tables of the database "db" from its contents.
+            For each pid and harmonic order in "inte_vn", each (ecc_id,
+            r_power, n) in "eccentricities", each pid in "multiplicities", and
+            each pid, harmonic order and pT bin in "diff_vn", the aggregate
+            tables store the number of events and the sums of the real part,
+            the imaginary part, and the first, second and fourth powers of the
+            absolute value, so that the event averages used in most analyses
+            can be read without scanning the event tables.
+        """
+        self._writeAggregates(db, self._computeAggregates(db))
+        db.closeConnection() # commit
+
     def mergeDatabases(self, toDB, fromDB):
         """
             Merge the database "fromDB" to "toDB"; both are assumed to be
             databases created from ebe calculations, meaning that they only
             contain tables specified in EbeCollector_readme.
+
+            The catalog tables are merged from the catalogs of the two
+            databases; a database without the catalog tables is scanned
+            instead. The aggregate tables are kept up to date in the same way
+            if "toDB" has them, or if "toDB" is empty and "fromDB" has them.
         """
+        # catalogs before merging
+        if toDB.getAllTableNames():
+            toCatalog = (self._readEventCatalog(toDB)
+                         or self._scanEventCatalog(toDB))
+        else:
+            toCatalog = (set(), {})
+        fromCatalog = (self._readEventCatalog(fromDB)
+                       or self._scanEventCatalog(fromDB))
+        # aggregates before merging
+        toAggregates = self._readAggregates(toDB)
+        if toAggregates is None and not toDB.getAllTableNames():
+            toAggregates = self._readAggregates(fromDB)
+            fromAggregates = {}
+        elif toAggregates is not None:
+            fromAggregates = (self._readAggregates(fromDB)
+                              or self._computeAggregates(fromDB))
+        # event_id of "fromDB" are shifted up by the largest existing one in
+        # any table of "toDB", the same for all tables and the catalog
+        eventIdShift = int(max(list(toCatalog[0]) + [0]))
+        for aTable in toDB.getAllTableNames():
+            if (aTable in self.catalogTables or aTable.startswith("aggregate_")
+                or "lookup" in aTable):
+                continue
+            currentEventIdMax = (
+                toDB.selectFromTable(aTable, "max(event_id)")[0][0])
+            if currentEventIdMax is not None:
+                eventIdShift = int(max([eventIdShift, currentEventIdMax]))
         for aTable in fromDB.getAllTableNames():
+            if aTable in self.catalogTables or aTable.startswith("aggregate_"):
+                continue       # merged below
             # first copy table structure
             firstCreation = toDB.createTableIfNotExists(
                                 aTable, fromDB.getTableInfo(aTable))
-            if firstCreation:
-                # just copy
-                toDB.insertIntoTable(aTable, fromDB.selectFromTable(aTable))
-            else: # treatment depends on table type
-                if "lookup" in aTable:
-                    continue       # if it's a lookup table, nothing to be done
-
-                # not a lookup table: 
-                # shift up event_id by the current existing max
-                currentEventIdMax = (
-                    toDB.selectFromTable(aTable, "max(event_id)")[0][0])
-                def shiftEID(row):
-                    newRow = list(row)
-                    newRow[0] += currentEventIdMax
-                    return newRow
-                toDB.insertIntoTable(aTable, 
-                    list(map(shiftEID, fromDB.selectFromTable(aTable))))
+            if "lookup" in aTable:
+                # a lookup table is copied once, then nothing to be done
+                if firstCreation:
+                    toDB.insertIntoTable(aTable, fromDB.selectFromTable(aTable))
+                continue
+
+            # not a lookup table: shift up event_id by the current existing
+            # max, also for a table that is new to "toDB" (the shift is 0
+            # when "toDB" is empty), so that it agrees with the catalog
+            def shiftEID(row):
+                newRow = list(row)
+                newRow[0] += eventIdShift
+                return newRow
+            toDB.insertIntoTable(aTable,
+                list(map(shiftEID, fromDB.selectFromTable(aTable))))
+        # merge catalogs, with event_id shifted in the same way
+        eventIds, pidCatalog = toCatalog
+        eventIds.update(eid + eventIdShift for eid in fromCatalog[0])
+        for key, counts in fromCatalog[1].items():
+            if key in pidCatalog:
+                pidCatalog[key] = [pidCatalog[key][0] + counts[0],
+                                   pidCatalog[key][1] + counts[1]]
+            else:
+                pidCatalog[key] = counts
+        self._writeEventCatalog(toDB, eventIds, pidCatalog)
+        self.createEventIdIndices(toDB)
+        # merge aggregates by adding up the sums
+        if toAggregates is not None:
+            for aggregateTable, fromSums in fromAggregates.items():
+                if aggregateTable not in toAggregates:
+                    continue
+                toSums = toAggregates[aggregateTable]
+                for key, sums in fromSums.items():
+                    if key in toSums:
+                        toSums[key] = [x+y for x, y in zip(toSums[key], sums)]
+                    else:
+                        toSums[key] = sums
+            # tables that cannot be merged are dropped
+            for aggregateTable in list(toAggregates.keys()):
+                if fromAggregates and aggregateTable not in fromAggregates:
+                    del toAggregates[aggregateTable]
+            self._writeAggregates(toDB, toAggregates)
         toDB.closeConnection() # commit
 
     def mergeparticleDatabases(self, toDB, fromDB):
@@ -1515,6 +1779,28 @@ class EbeDBReader(object):
 
         # set self.hasInitializedStringSubstitution to none for lazy initialization in evaluateExpression function
         self.hasInitializedStringSubstitution = False
+        # expressions are translated by the ExpressionParser unless
+        # useExpressionParser is set to False
+        self.useExpressionParser = True
+
+        # query results are cached only after enableQueryCache is called
+        self.queryCache = None
+
+        # the catalog tables allow counting events without scanning tables
+        self.hasEventCatalog = self.db.doesTableExist("pid_catalog")
+
+        # event selections, set by setEventSelection, apply to the tables with
+        # the "event_id" field
+        self.eventTables = set(aTable for aTable in self.db.getAllTableNames()
+            if "event_id" in [item[0] for item in self.db.getTableInfo(aTable)])
+        self.eventSelection = None
+
+        # means are read from the aggregate tables when they exist, unless
+        # useAggregateTables is set to False
+        self.hasAggregateTables = any([self.db.doesTableExist(item[0])
+                                      for item in EbeCollector.aggregateTables])
+        self.useAggregateTables = True
+        self.aggregates = None # lazy loading in _getAggregates
 
     def _ecc_id(self, ecc_type_name):
         """
@@ -1528,6 +1814,129 @@ class EbeDBReader(object):
         """
         return self.pid_lookup[name]
 
+    def enableQueryCache(self, enable=True, maximumNumberOfRows=None):
+        """
+            Turn on (or off when "enable" is False) the caching of query
+            results, so that evaluating several expressions that use the same
+            data reads the database only once. Turning it off also empties the
+            cache. When "maximumNumberOfRows" is given, the least recently
+            used results are dropped to keep the cache within that many rows
+            (each result counting one row more than it has); larger results
+            are not cached.
+        """
+        self.queryCache = OrderedDict() if enable else None
+        self.queryCacheRowLimit = maximumNumberOfRows
+        self.queryCacheNumberOfRows = 0
+
+    def _addEventSelection(self, tableName, whereClause=""):
+        """
+            Return "whereClause" with the current event selection added when
+            the table "tableName" has the "event_id" field.
+        """
+        if self.eventSelection and tableName in self.eventTables:
+            if whereClause:
+                return "(%s) and %s" % (whereClause, self.eventSelection)
+            return self.eventSelection
+        return whereClause
+
+    def _selectFromTable(self, tableName, columns="*", whereClause="",
+                         groupByClause="", orderByClause=""):
+        """
+            Wraps the selectFromTable function of the database; the current
+            event selection is added to the where clause for tables with the
+            "event_id" field, and the results are taken from and stored into
+            the query cache when it is enabled.
+        """
+        whereClause = self._addEventSelection(tableName, whereClause)
+        if self.queryCache is None:
+            return self.db.selectFromTable(tableName, columns, whereClause,
+                                           groupByClause, orderByClause)
+        if isIterable(columns): columns = tuple(columns)
+        key = (tableName, columns, whereClause, groupByClause, orderByClause)
+        if key in self.queryCache:
+            rows = self.queryCache.pop(key)
+            self.queryCache[key] = rows # now the most recently used
+            return rows
+        rows = self.db.selectFromTable(tableName, columns, whereClause,
+                                       groupByClause, orderByClause)
+        limit = self.queryCacheRowLimit
+        if limit is None or len(rows) + 1 <= limit:
+            self.queryCache[key] = rows
+            self.queryCacheNumberOfRows += len(rows) + 1
+            while limit is not None and self.queryCacheNumberOfRows > limit:
+                droppedRows = self.queryCache.popitem(last=False)[1]
+                self.queryCacheNumberOfRows -= len(droppedRows) + 1
+        return rows
+
+    def compileEventSelection(self, predicate):
+        """
+            Compile the event selection "predicate" into a SQL condition on the
+            "event_id" field, which selects the events in the database before
+            their data are read. The predicate is a SQL condition that can use
+            the fields of the "collisionParameters" table ("b", "Npart",
+            "Ncoll", "total_entropy"), the multiplicity of a particle written
+            as "dN/dy(name)" or "N(name)", and "event_id". For example:
+
+            "Npart>=300 and Npart<350"
+            "b<2.5 and dN/dy(charged)>1000"
+            "event_id<=100"
+
+            Multiplicities are joined from the "multiplicities" table and the
+            condition is applied in an "in" subquery.
+        """
+        # multiplicities become joined copies of the multiplicities table
+        multiplicityJoins = []
+        def replaceMultiplicity(match):
+            name = match.group(1)
+            if name not in self.pid_lookup:
+                raise ValueError("EbeDBReader.compileEventSelection: unknown "
+                                 + "particle %s in %s." % (name, predicate))
+            alias = "m%d" % len(multiplicityJoins)
+            multiplicityJoins.append((alias, self.pid_lookup[name]))
+            return alias + ".N"
+        condition = re.sub(r"(?:dN/dy|\bN)\((\w+)\)", replaceMultiplicity,
+                           predicate)
+        # fields from the collisionParameters table
+        usesCollisionParameters = False
+        if "collisionParameters" in self.eventTables:
+            for aField, aType in self.db.getTableInfo("collisionParameters"):
+                if aField != "event_id" and re.search(r"\b%s\b" % aField,
+                                                      condition):
+                    usesCollisionParameters = True
+        if not usesCollisionParameters and not multiplicityJoins:
+            return "(%s)" % condition # only event_id is used
+        # join all sources on event_id
+        fromList = []
+        joinConditions = []
+        base = None
+        if usesCollisionParameters:
+            fromList.append("collisionParameters")
+            base = "collisionParameters"
+        for alias, pid in multiplicityJoins:
+            fromList.append("multiplicities as %s" % alias)
+            joinConditions.append("%s.pid=%d" % (alias, pid))
+            if base:
+                joinConditions.append("%s.event_id=%s.event_id"
+                                      % (alias, base))
+            else:
+                base = alias
+        condition = re.sub(r"(?<!\.)\bevent_id\b", base + ".event_id",
+                           condition)
+        return ("event_id in (select %s.event_id from %s where %s)"
+                % (base, ",".join(fromList),
+                   " and ".join(joinConditions + ["(%s)" % condition])))
+
+    def setEventSelection(self, predicate=None):
+        """
+            Restrict all the following queries to the events satisfying the
+            event selection "predicate" (see compileEventSelection); the
+            restriction is removed if "predicate" is None or empty.
+        """
+        if predicate:
+            self.eventSelection = self.compileEventSelection(predicate)
+        else:
+            self.eventSelection = None
+
     def getEccentricities(self, eccType="ed", r_power=2, order=2, where="", 
                           orderBy="event_id"):
         """
@@ -1547,7 +1956,7 @@ class EbeDBReader(object):
                        % (self._ecc_id(eccType), r_power, order))
         if where:
             whereClause += " and " + where
-        return np.asarray(self.db.selectFromTable("eccentricities", 
+        return np.asarray(self._selectFromTable("eccentricities", 
             ("ecc_real, ecc_imag"), whereClause=whereClause, 
             orderByClause=orderBy))
 
@@ -1578,7 +1987,7 @@ class EbeDBReader(object):
                        % (self._ecc_id(eccType), r_power))
         if where:
             whereClause += " and " + where
-        return np.asarray(self.db.selectFromTable("r_integrals", "r_inte", 
+        return np.asarray(self._selectFromTable("r_integrals", "r_inte", 
             whereClause=whereClause, orderByClause=orderBy))
 
     def getLifetimes(self, orderBy="event_id"):
@@ -1587,7 +1996,7 @@ class EbeDBReader(object):
 
             -- orderBy: the "order by" clause.
         """
-        return np.asarray(self.db.selectFromTable("scalars", "lifetime", 
+        return np.asarray(self._selectFromTable("scalars", "lifetime", 
                                                   orderByClause=orderBy))
 
     def getIntegratedFlows(self, particleName="pion", order=2, where="", 
@@ -1607,7 +2016,7 @@ class EbeDBReader(object):
         whereClause = "pid=%d and n=%d" % (self._pid(particleName), order)
         if where:
             whereClause += " and " + where
-        return np.asarray(self.db.selectFromTable("inte_vn", 
+        return np.asarray(self._selectFromTable("inte_vn", 
             ("vn_real, vn_imag"), whereClause=whereClause, 
             orderByClause=orderBy))
 
@@ -1634,7 +2043,7 @@ class EbeDBReader(object):
         whereClause = "pid=%d" % self._pid(particleName)
         if where:
             whereClause += " and " + where
-        tmp = np.asarray(self.db.selectFromTable("multiplicities", "N", 
+        tmp = np.asarray(self._selectFromTable("multiplicities", "N", 
                                                  whereClause=whereClause, 
                                                  orderByClause=orderBy))
         return tmp.reshape(tmp.size)
@@ -1658,7 +2067,7 @@ class EbeDBReader(object):
                             % (pT_range[0], pT_range[1]))
         if where:
             whereClause += " and " + where
-        return np.asarray(self.db.selectFromTable("diff_vn", 
+        return np.asarray(self._selectFromTable("diff_vn", 
                                                   ("pT", "vn_real", "vn_imag"), 
                                                   whereClause=whereClause, 
                                                   orderByClause=orderBy))
@@ -1686,9 +2095,9 @@ class EbeDBReader(object):
             whereClause += " and %g<=pT and pT<=%g" % (pT_range[0], pT_range[1])
         if where:
             whereClause += " and " + where
-        RawdiffvnData = np.asarray(self.db.selectFromTable("diff_vn", ("pT", "vn_real", "vn_imag"), whereClause=whereClause, orderByClause=orderBy))
+        RawdiffvnData = np.asarray(self._selectFromTable("diff_vn", ("pT", "vn_real", "vn_imag"), whereClause=whereClause, orderByClause=orderBy))
         nevent = self.getNumberOfEvents()
-        npT = len(RawdiffvnData[:,0])/nevent
+        npT = len(RawdiffvnData[:,0])//nevent
         diffvnData = RawdiffvnData.reshape(nevent, npT, 3)
         return diffvnData
     
@@ -1722,7 +2131,7 @@ class EbeDBReader(object):
             whereClause += " and %g<=pT and pT<=%g" % (pT_range[0], pT_range[1])
         if where:
             whereClause += " and " + where
-        return np.asarray(self.db.selectFromTable("spectra", ("pT", "N"), whereClause=whereClause, orderByClause=orderBy))
+        return np.asarray(self._selectFromTable("spectra", ("pT", "N"), whereClause=whereClause, orderByClause=orderBy))
 
     def getInterpretedSpectraForOneEvent(self, event_id=1, particleName="pion", pTs=np.linspace(0,2.5,10)):
         """
@@ -1746,9 +2155,9 @@ class EbeDBReader(object):
             whereClause += " and %g<=pT and pT<=%g" % (pT_range[0], pT_range[1])
         if where:
             whereClause += " and " + where
-        RawdNdyData = np.asarray(self.db.selectFromTable("spectra", ("pT", "N"), whereClause=whereClause, orderByClause=orderBy))
+        RawdNdyData = np.asarray(self._selectFromTable("spectra", ("pT", "N"), whereClause=whereClause, orderByClause=orderBy))
         nevent = self.getNumberOfEvents()
-        npT = len(RawdNdyData[:,0])/nevent
+        npT = len(RawdNdyData[:,0])//nevent
         dNdyData = RawdNdyData.reshape(nevent, npT, 2)
         return dNdyData
 
@@ -1773,41 +2182,381 @@ class EbeDBReader(object):
     
     get_dNdydpT = getInterpretedSpectraForAllEvents
 
+    def getEccentricitiesAndFlows(self, particleName="pion", eccType="ed",
+                                  orders=(2, 3, 4, 5, 6), r_power=None):
+        """
+            Return the complex eccentricities and integrated flows of the
+            harmonic "orders" for the events that have all of them, read in a
+            single query joining the "eccentricities" and "inte_vn" tables on
+            "event_id" and "n". The eccentricities are of type "eccType" with
+            power of r "r_power", which is taken to be the harmonic order n if
+            it is None. The current event selection is respected.
+
+            It returns the tuple
+            (event ids, eccentricity matrix, flow matrix)
+            where the matrices have one row per event and one column per order.
+        """
+        orders = np.asarray(orders, dtype=int)
+        whereClause = ("ecc_id=%d and pid=%d and n in (%s)"
+                       % (self._ecc_id(eccType), self._pid(particleName),
+                          ",".join(map(str, orders))))
+        if r_power is None:
+            whereClause += " and r_power=n"
+        else:
+            whereClause += " and r_power=%d" % r_power
+        if self.eventSelection:
+            whereClause += " and " + self.eventSelection
+        rows = np.asarray(self._selectFromTable(
+            "eccentricities join inte_vn using (event_id, n)",
+            ("event_id", "n", "ecc_real", "ecc_imag", "vn_real", "vn_imag"),
+            whereClause, orderByClause="event_id, n"), dtype=float)
+        if rows.size == 0:
+            return (np.zeros(0, dtype=int),
+                    np.zeros((0, orders.size), dtype=complex),
+                    np.zeros((0, orders.size), dtype=complex))
+        # arrange into (event, order) matrices
+        eventIds, eventIndices = np.unique(rows[:,0].astype(int),
+                                           return_inverse=True)
+        orderIndices = np.searchsorted(np.sort(orders), rows[:,1])
+        orderIndices = np.argsort(orders)[orderIndices]
+        eccentricities = np.zeros((eventIds.size, orders.size), dtype=complex)
+        flows = np.zeros((eventIds.size, orders.size), dtype=complex)
+        counts = np.zeros((eventIds.size, orders.size), dtype=int)
+        eccentricities[eventIndices, orderIndices] = rows[:,2] + 1j*rows[:,3]
+        flows[eventIndices, orderIndices] = rows[:,4] + 1j*rows[:,5]
+        counts[eventIndices, orderIndices] = 1
+        isComplete = counts.sum(axis=1) == orders.size
+        return (eventIds[isComplete], eccentricities[isComplete],
+                flows[isComplete])
+
+    @staticmethod
+    def getResponseFromArrays(orders, eccentricities, flows):
+        """
+            Return a dictionary with the response of the flows to the
+            eccentricities and their correlations, for the complex
+            "eccentricities" and "flows" matrices with one row per event and
+            one column for each harmonic order in "orders" (see the
+            getEccentricitiesAndFlows function). The orders and the columns
+            are first sorted in increasing order. With <...> the event average:
+
+            -- "orders": the harmonic orders, sorted.
+            -- "numberOfEvents": the number of events.
+            -- "k_n": the linear response coefficients <V_n conj(E_n)>/<|E_n|^2>
+                (complex).
+            -- "k_n_rms": the ratios v_n{2}/e_n{2}.
+            -- "r_n": the correlations between V_n and E_n,
+                Re<V_n conj(E_n)>/sqrt(<|V_n|^2> <|E_n|^2>).
+            -- "labels", "correlationMatrix": the Pearson correlation matrix
+                between all |E_n| and |V_n|, with rows and columns labelled
+                by "labels" ("e_n" and "v_n").
+            -- "eventPlaneCorrelators": a dictionary of the event-plane
+                correlators for the flows ("V") and for the eccentricities
+                ("E"); for two orders m<n the key "V_m,V_n" gives
+                Re<V_m^a conj(V_n)^b>/sqrt(<|V_m|^2a> <|V_n|^2b>) with a*m=b*n
+                the least common multiple, i.e. <cos(a*m(Psi_m-Psi_n))>
+                weighted by the flow magnitudes; for three orders with l+m=n
+                the key "V_l,V_m,V_n" gives
+                Re<V_l V_m conj(V_n)>/sqrt(<|V_l V_m|^2> <|V_n|^2>).
+            -- "nonlinearResponse": for each order n that is the sum of two
+                orders l<=m in "orders", the least squares solution of
+                V_n = k_n E_n + sum over (l,m) chi_nlm V_l V_m,
+                as a dictionary {n: (k_n, {(l, m): chi_nlm})}.
+        """
+        sortedColumns = np.argsort(orders, kind="stable")
+        orders = [int(orders[i]) for i in sortedColumns]
+        eccentricities = np.asarray(eccentricities,
+                                    dtype=complex)[:,sortedColumns]
+        flows = np.asarray(flows, dtype=complex)[:,sortedColumns]
+        numberOfOrders = len(orders)
+        results = {"orders": orders, "numberOfEvents": flows.shape[0]}
+        # linear response and correlations, all orders at once
+        meanE2 = np.mean(abs(eccentricities)**2, 0)
+        meanV2 = np.mean(abs(flows)**2, 0)
+        meanVE = np.mean(flows*eccentricities.conj(), 0)
+        results["k_n"] = meanVE/meanE2
+        results["k_n_rms"] = np.sqrt(meanV2/meanE2)
+        results["r_n"] = meanVE.real/np.sqrt(meanV2*meanE2)
+        results["labels"] = (["e_%d" % n for n in orders]
+                             + ["v_%d" % n for n in orders])
+        results["correlationMatrix"] = np.corrcoef(np.hstack(
+            (abs(eccentricities), abs(flows))), rowvar=False)
+        # event-plane correlators
+        correlators = {}
+        for symbol, vectors in (("V", flows), ("E", eccentricities)):
+            for i in range(numberOfOrders):
+                for j in range(i+1, numberOfOrders):
+                    m, n = orders[i], orders[j]
+                    a = n//gcd(m, n)
+                    b = m//gcd(m, n)
+                    correlators["%s_%d,%s_%d" % (symbol, m, symbol, n)] = (
+                        np.mean(vectors[:,i]**a*vectors[:,j].conj()**b).real
+                        / np.sqrt(np.mean(abs(vectors[:,i])**(2*a))
+                                  * np.mean(abs(vectors[:,j])**(2*b))))
+            for i in range(numberOfOrders):
+                for j in range(i, numberOfOrders):
+                    if orders[i]+orders[j] not in orders: continue
+                    k = orders.index(orders[i]+orders[j])
+                    product = vectors[:,i]*vectors[:,j]
+                    correlators["%s_%d,%s_%d,%s_%d" % (symbol, orders[i],
+                        symbol, orders[j], symbol, orders[k])] = (
+                        np.mean(product*vectors[:,k].conj()).real
+                        / np.sqrt(np.mean(abs(product)**2)
+                                  * np.mean(abs(vectors[:,k])**2)))
+        results["eventPlaneCorrelators"] = correlators
+        # nonlinear response
+        nonlinearResponse = {}
+        for k, n in enumerate(orders):
+            pairs = [(i, j) for i in range(numberOfOrders)
+                     for j in range(i, numberOfOrders)
+                     if orders[i]+orders[j] == n]
+            if not pairs: continue
+            designMatrix = np.column_stack([eccentricities[:,k]]
+                + [flows[:,i]*flows[:,j] for i, j in pairs])
+            coefficients = np.linalg.lstsq(designMatrix, flows[:,k],
+                                           rcond=-1)[0]
+            nonlinearResponse[n] = (coefficients[0], dict(
+                ((orders[i], orders[j]), chi) for (i, j), chi
+                in zip(pairs, coefficients[1:])))
+        results["nonlinearResponse"] = nonlinearResponse
+        return results
+
+    def getResponseAndCorrelations(self, particleName="pion", eccType="ed",
+                                   orders=(2, 3, 4, 5, 6), r_power=None):
+        """
+            Return the response of the integrated flows of the particle with
+            name "particleName" to the eccentricities of type "eccType", and
+            the correlations between them, for all the harmonic "orders" at
+            once. The data are read by the getEccentricitiesAndFlows function
+            and the returned dictionary is described in the
+            getResponseFromArrays function.
+        """
+        eventIds, eccentricities, flows = self.getEccentricitiesAndFlows(
+            particleName, eccType, orders, r_power)
+        return self.getResponseFromArrays(orders, eccentricities, flows)
+
     def getAttendance(self):
         """
             Return a list of tuple (name for particle, number of events) for all
             particles in the pid table in the order of increase |pid|. Harmonic
             order 2 will be used to probe all particles.
         """
-        probes = []
-        allParticles = self.pid_lookup.items()
-        allParticles.sort(key=lambda x: abs(x[1]))
-        for aParticle, pid in allParticles:
-            numberOfEvents = self.db.selectFromTable("multiplicities", "count()", "pid = %d" % pid)[0][0]
-            probes.append((aParticle, numberOfEvents))
-        return probes
+        allParticles = sorted(self.pid_lookup.items(), key=lambda x: abs(x[1]))
+        # one query for all particles
+        if self.hasEventCatalog and not self.eventSelection:
+            numberOfRows = dict(self._selectFromTable("pid_catalog",
+                ("pid", "number_of_rows"), "table_name = 'multiplicities'"))
+        else:
+            numberOfRows = dict(self._selectFromTable("multiplicities",
+                ("pid", "count()"), groupByClause="pid"))
+        return [(aParticle, numberOfRows.get(pid, 0))
+                for aParticle, pid in allParticles]
 
     def getNumberOfEvents(self):
         """
             Return total number of events.
         """
-        numberOfEvents = self.db.selectFromTable(
+        if self.hasEventCatalog and not self.eventSelection:
+            numberOfEvents = self._selectFromTable("pid_catalog",
+                "number_of_rows", "table_name = 'multiplicities' and pid = 1001")
+            return numberOfEvents[0][0] if numberOfEvents else 0
+        numberOfEvents = self._selectFromTable(
                         "multiplicities", "count()", "pid = 1001")[0][0]
         return numberOfEvents
 
-    def evaluateExpression(self, expression):
+    def getEventIds(self):
         """
-            Evaluate an expression by first applying substitution rules using
-            the StringSubstitution.
+            Return the list of event ids of all events in increasing order.
+        """
+        if self.hasEventCatalog:
+            return [item[0] for item in self._selectFromTable(
+                    "event_catalog", "event_id", orderByClause="event_id")]
+        return [item[0] for item in self._selectFromTable("multiplicities",
+                "event_id", "pid = 1001", orderByClause="event_id")]
+
+    def _getColumnNamesAndTypes(self, tableName, columns="*"):
+        """
+            Return the list of names and the list of numpy dtypes of the
+            "columns" selected from the table "tableName"; the list of dtypes
+            is None when some columns are not fields of the table, so that
+            their types have to be inferred from their values.
+        """
+        tableInfo = self.db.getTableInfo(tableName)
+        if columns == "*":
+            names = [item[0] for item in tableInfo]
+        else:
+            names = list(columns) if isIterable(columns) else [columns]
+        declaredTypes = dict(tableInfo)
+        if [aName for aName in names if aName not in declaredTypes]:
+            return names, None
+        return names, [TableExport.dtypeFromDeclaredType(declaredTypes[aName])
+                       for aName in names]
+
+    def iterateTableColumns(self, tableName, columns="*", whereClause="",
+                            orderByClause="", numberOfRowsPerBatch=100000):
+        """
+            Return a generator that reads the table "tableName" in batches of
+            at most "numberOfRowsPerBatch" rows and yields (list of column
+            names, list of numpy arrays) for each batch. Rows are converted to
+            arrays by numpy in one pass using the declared types of the
+            fields. The arguments "columns", "whereClause" and "orderByClause"
+            are as for the selectFromTable function of the database, and the
+            current event selection applies.
+        """
+        names, dtypes = self._getColumnNamesAndTypes(tableName, columns)
+        for rows in self.db.selectFromTableInBatches(tableName, names,
+                self._addEventSelection(tableName, whereClause),
+                orderByClause, numberOfRowsPerBatch):
+            yield names, TableExport.rowsToColumns(rows, dtypes)
+
+    def getTableColumns(self, tableName, columns="*", whereClause="",
+                        orderByClause=""):
+        """
+            Return (list of column names, list of numpy arrays) for the whole
+            selection from the table "tableName"; see iterateTableColumns.
+        """
+        names, dtypes = self._getColumnNamesAndTypes(tableName, columns)
+        batches = [batchColumns for batchNames, batchColumns in
+            self.iterateTableColumns(tableName, columns, whereClause,
+                                     orderByClause)]
+        if not batches:
+            return names, TableExport.rowsToColumns([],
+                                        dtypes or [float]*len(names))
+        if len(batches) == 1:
+            return names, batches[0]
+        return names, [np.concatenate(aColumn) for aColumn in zip(*batches)]
+
+    def getTableAsArrowTable(self, tableName, columns="*", whereClause="",
+                             orderByClause=""):
+        """
+            Return the selection from the table "tableName" as a pyarrow
+            Table; see iterateTableColumns. Needs the pyarrow package.
+        """
+        return TableExport.columnsToArrowTable(*self.getTableColumns(
+                        tableName, columns, whereClause, orderByClause))
+
+    def getTableAsDataFrame(self, tableName, columns="*", whereClause="",
+                            orderByClause=""):
+        """
+            Return the selection from the table "tableName" as a pandas
+            DataFrame; see iterateTableColumns. Needs the pandas package.
+        """
+        return TableExport.columnsToDataFrame(*self.getTableColumns(
+                        tableName, columns, whereClause, orderByClause))
+
+    def exportTable(self, tableName, filename, whereClause="",
+                    numberOfRowsPerBatch=100000):
+        """
+            Write the table "tableName" into the Parquet (".parquet") or
+            Feather (".feather") file "filename", reading and writing
+            "numberOfRowsPerBatch" rows at a time so that the table never has
+            to fit in memory. The current event selection applies. Integer
+            fields that hold real values somewhere in the table (sqlite allows
+            this) are written as floats. Return the number of rows written.
+            Needs the pyarrow package.
+        """
+        names, dtypes = self._getColumnNamesAndTypes(tableName)
+        integerFields = [idx for idx, aType in enumerate(dtypes)
+                         if aType.kind in "iu"]
+        if integerFields:
+            # the schema is fixed before the first batch is read, so all
+            # batches have to be checked at once
+            hasRealValues = self.db.selectFromTable(tableName,
+                ["max(typeof(%s)='real')" % names[idx]
+                 for idx in integerFields])[0]
+            for idx, hasReal in zip(integerFields, hasRealValues):
+                if hasReal: dtypes[idx] = np.dtype(np.float64)
+        schema = TableExport.arrowSchemaFromDtypes(names, dtypes)
+        with TableExport.TableWriter(filename, schema) as writer:
+            for names, columns in self.iterateTableColumns(tableName, "*",
+                    whereClause, numberOfRowsPerBatch=numberOfRowsPerBatch):
+                writer.write(names, columns)
+        return writer.numberOfRows
+
+    def exportDatabase(self, writeToFolder=".", ext=".parquet",
+                       numberOfRowsPerBatch=100000):
+        """
+            Write all tables in the database into files in the folder
+            "writeToFolder", each named by its table and "ext" (".parquet" or
+            ".feather"), using exportTable. This is the columnar counterpart
+            of the unpackDatabase function of the database. Return a list of
+            (table name, number of rows written).
+        """
+        return [(aTable, self.exportTable(aTable,
+                    path.join(writeToFolder, aTable+ext),
+                    numberOfRowsPerBatch=numberOfRowsPerBatch))
+                for aTable in self.db.getAllTableNames()]
+
+    def getExpressionColumns(self, namedExpressions):
+        """
+            Evaluate a list of (name, expression), or of expressions used as
+            their own names, that give one value per event, and return (list
+            of column names, list of numpy arrays) with the "event_id" column
+            first. Complex values and values with more than one entry per
+            event are split into several columns; see
+            TableExport.arraysToColumns.
+        """
+        names = []
+        arrays = []
+        for anItem in namedExpressions:
+            name, expression = ((anItem, anItem) if isinstance(anItem, str)
+                                else anItem)
+            value = self.evaluateExpression(expression)[0]
+            names.append(name)
+            arrays.append(value)
+        eventIds = np.array(self.getEventIds(), dtype=np.int64)
+        for name, value in zip(names, arrays):
+            if np.ndim(value) == 0 or np.shape(value)[0] != len(eventIds):
+                raise ValueError("EbeDBReader.getExpressionColumns: %s " % name
+                    + "does not give one value for each of the %d events."
+                    % len(eventIds))
+        columnNames, columns = TableExport.arraysToColumns(names, arrays)
+        return ["event_id"] + columnNames, [eventIds] + columns
+
+    def getExpressionsAsArrowTable(self, namedExpressions):
+        """
+            Return the per-event values of a list of (name, expression) as a
+            pyarrow Table; see getExpressionColumns. Needs the pyarrow
+            package.
+        """
+        return TableExport.columnsToArrowTable(
+                        *self.getExpressionColumns(namedExpressions))
+
+    def getExpressionsAsDataFrame(self, namedExpressions):
+        """
+            Return the per-event values of a list of (name, expression) as a
+            pandas DataFrame; see getExpressionColumns. Needs the pandas
+            package.
+        """
+        return TableExport.columnsToDataFrame(
+                        *self.getExpressionColumns(namedExpressions))
+
+    def _translateExpression(self, expression):
+        """
+            Translate an expression into the tuple
+            (string after normalization, string after functionization)
+            using the ExpressionParser, which reads the expression once. When
+            "useExpressionParser" is False, or when the expression cannot be
+            parsed, the substitution rules (see _translateExpressionWithRules)
+            are used instead.
+        """
+        if self.useExpressionParser:
+            try:
+                return ExpressionParser().translate(expression)
+            except ExpressionParser.ExpressionParserError:
+                pass # leave it to the substitution rules
+        return self._translateExpressionWithRules(expression)
+
+    def _translateExpressionWithRules(self, expression):
+        """
+            Translate an expression by applying substitution rules using the
+            StringSubstitution.
 
             The passed expression will first be converted in to a normalized
             form, then the normalized expression will be replaced by
-            corresponding function calls, after this the functionized expression
-            will be evaluated.
-
-            It returns the typle
-            (value of the expression, string after normalization, string after functionization)
+            corresponding function calls.
 
+            It returns the tuple
+            (string after normalization, string after functionization)
         """
         # remove spaces
         expression = expression.replace(" ", "")
@@ -1945,6 +2694,7 @@ class EbeDBReader(object):
                 ("dN/\(dydpT\)\((.*?)\)\(([\w_]+)\)", 'self.get_dNdydpT(particleName="{0[1]}", pTs={0[0]}, verbose=True)'),
 
             ))
+            self.hasInitializedStringSubstitution = True
 
 
         # perform normalization, should repeat until there is no more changes
@@ -1957,22 +2707,476 @@ class EbeDBReader(object):
                 if numberOfScans>0: needMoreChanges = True
         # perform functionization, should do only once
         exprAfterFunctionization, numberOfScans = self.useStringSubstitution_functionization.applyAllRules(exprAfterNormalization)
+        return (exprAfterNormalization, exprAfterFunctionization)
+
+    def _getAggregates(self):
+        """
+            Return the aggregates stored in the database as a dictionary
+            {aggregate table name: {key: list of sums}}; see the
+            updateAggregateTables function of the EbeCollector class.
+        """
+        if self.aggregates is None:
+            self.aggregates = EbeCollector._readAggregates(self.db) or {}
+        return self.aggregates
+
+    def _substituteAggregates(self, expression):
+        """
+            Replace the means in the functionized "expression" that can be
+            obtained from the aggregate tables by "_aggregateMeans[i]". The
+            supported means are those of V_n, |V_n|, |V_n|**2 and |V_n|**4
+            for integrated flows and eccentricities, and those of dN/dy and
+            dN/dy**2 for multiplicities.
+
+            It returns the tuple
+            (expression after substitution, list of means)
+        """
+        aggregates = self._getAggregates()
+        fieldIndex = dict((name, index) for index, name in
+                          enumerate(EbeCollector.aggregateValueFields))
+        getters = {
+            "get_V_n": ("aggregate_inte_vn", ("particleName", "order")),
+            "get_Ecc_n": ("aggregate_eccentricities",
+                          ("eccType", "r_power", "order")),
+            "get_dNdy": ("aggregate_multiplicities", ("particleName",)),
+        }
+        aggregateMeans = []
+        def replaceMean(match):
+            hasAbs, getter, arguments, closingAbs, power = match.groups()
+            if bool(hasAbs) != bool(closingAbs):
+                return match.group(0)
+            aggregateTable, argumentNames = getters[getter]
+            arguments = dict(re.findall(r'(\w+)="?([^",]*)"?', arguments))
+            if (aggregateTable not in aggregates
+                or sorted(arguments.keys()) != sorted(argumentNames)):
+                return match.group(0)
+            try:
+                if getter == "get_V_n":
+                    key = (self._pid(arguments["particleName"]),
+                           int(arguments["order"]))
+                elif getter == "get_Ecc_n":
+                    key = (self._ecc_id(arguments["eccType"]),
+                           int(arguments["r_power"]), int(arguments["order"]))
+                else:
+                    key = (self._pid(arguments["particleName"]),)
+            except (KeyError, ValueError):
+                return match.group(0)
+            if key not in aggregates[aggregateTable]:
+                return match.group(0)
+            sums = aggregates[aggregateTable][key]
+            if hasAbs and power in (None, "2", "4"):
+                field = {None: "sum_abs", "2": "sum_abs2", "4": "sum_abs4"}[power]
+                mean = np.float64(sums[fieldIndex[field]]) / sums[0]
+            elif not hasAbs and power is None and getter == "get_dNdy":
+                mean = np.float64(sums[fieldIndex["sum_real"]]) / sums[0]
+            elif not hasAbs and power is None:
+                mean = (np.complex128(sums[fieldIndex["sum_real"]]
+                        + 1j*sums[fieldIndex["sum_imag"]]) / sums[0])
+            elif not hasAbs and power == "2" and getter == "get_dNdy":
+                mean = np.float64(sums[fieldIndex["sum_abs2"]]) / sums[0]
+            else:
+                return match.group(0)
+            aggregateMeans.append(mean)
+            return "_aggregateMeans[%d]" % (len(aggregateMeans)-1)
+        expression = re.sub(r"\bmean\((abs\()?self\.(get_V_n|get_Ecc_n|"
+                            r"get_dNdy)\(([^()]*)\)(\))?(?:\*\*(\d+))?,0\)",
+                            replaceMean, expression)
+        return expression, aggregateMeans
+
+    def getAggregatedDifferentialFlows(self, particleName="pion", order=2):
+        """
+            Return the event averaged differential flow for the particle with
+            name "particleName" and harmonic order "order" from the
+            "aggregate_diff_vn" table, one value for each pT bin, as the tuple
+            (mean pT, <V_n(pT)>, v_n{2}(pT)=sqrt(<|V_n(pT)|**2>)).
+        """
+        aggregates = self._getAggregates()
+        if "aggregate_diff_vn" not in aggregates:
+            raise ValueError("EbeDBReader.getAggregatedDifferentialFlows: the "
+                             + "database has no aggregate_diff_vn table.")
+        pid = self._pid(particleName)
+        sums = np.asarray([sums for key, sums in
+                           sorted(aggregates["aggregate_diff_vn"].items())
+                           if key[0] == pid and key[1] == order], dtype=float)
+        if sums.size == 0:
+            return np.zeros(0), np.zeros(0, dtype=complex), np.zeros(0)
+        fieldIndex = dict((name, index) for index, name in
+                          enumerate(EbeCollector.aggregateValueFields))
+        count = sums[:,0]
+        return (sums[:,len(EbeCollector.aggregateValueFields)]/count,
+                (sums[:,fieldIndex["sum_real"]]
+                 + 1j*sums[:,fieldIndex["sum_imag"]])/count,
+                np.sqrt(sums[:,fieldIndex["sum_abs2"]]/count))
+
+    def evaluateExpression(self, expression, eventSelection=None):
+        """
+            Evaluate an expression by first applying substitution rules using
+            the StringSubstitution.
+
+            The passed expression will first be converted in to a normalized
+            form, then the normalized expression will be replaced by
+            corresponding function calls, after this the functionized expression
+            will be evaluated.
+
+            When "eventSelection" is given, only the events satisfying this
+            predicate (see compileEventSelection) are used; it replaces the
+            selection set by setEventSelection during the evaluation.
+
+            It returns the typle
+            (value of the expression, string after normalization, string after functionization)
+
+        """
+        if eventSelection:
+            previousEventSelection = self.eventSelection
+            self.setEventSelection(eventSelection)
+            try:
+                return self.evaluateExpression(expression)
+            finally:
+                self.eventSelection = previousEventSelection
+        exprAfterNormalization, exprAfterFunctionization = (
+                                        self._translateExpression(expression))
+        # means available in the aggregate tables are not recomputed
+        exprToEvaluate = exprAfterFunctionization
+        evaluationLocals = {"self": self}
+        if (self.hasAggregateTables and self.useAggregateTables
+            and not self.eventSelection):
+            exprToEvaluate, evaluationLocals["_aggregateMeans"] = (
+                self._substituteAggregates(exprAfterFunctionization))
         # try to evaluate it
         try:
-            value = eval(exprAfterFunctionization)
+            value = eval(exprToEvaluate, globals(), evaluationLocals)
             return (value, exprAfterNormalization, exprAfterFunctionization)
         except:
             print("Error encounterred evaluating {}:".format(expression))
             print("-> {}\n-> {}".format(exprAfterNormalization, exprAfterFunctionization))
             raise
 
-    def evaluateExpressionOnly(self, expression):
+    def getEventBinIndices(self, binBy="Npart", binEdges=(0, 500)):
+        """
+            Return an array of bin indices, one for each event in the order of
+            "event_id", by assigning the values of the binning variable "binBy"
+            to the bins given by "binEdges". The "binEdges" should be
+            increasing, and n+1 edges define n bins; each bin includes its
+            lower edge, and the last bin also includes its upper edge. Events
+            that fall outside of all bins are given the index -1.
+
+            -- binBy: either a field in the "collisionParameters" table
+                ("Npart", "Ncoll", "b", "total_entropy"), or an expression
+                understood by evaluateExpression that gives one value per
+                event, for example "dN/dy(charged)".
+            -- binEdges: the edges of the bins.
+        """
+        binEdges = np.asarray(binEdges, dtype=float)
+        if binEdges.ndim != 1 or binEdges.size < 2:
+            raise ValueError("EbeDBReader.getEventBinIndices: at least two "
+                             + "bin edges are needed.")
+        if np.any(np.diff(binEdges) <= 0):
+            raise ValueError("EbeDBReader.getEventBinIndices: bin edges must "
+                             + "be strictly increasing.")
+        # get the values of the binning variable
+        if (self.db.doesTableExist("collisionParameters") and binBy in
+            [item[0] for item in self.db.getTableInfo("collisionParameters")]):
+            values = np.asarray(self._selectFromTable("collisionParameters",
+                                binBy, orderByClause="event_id"), dtype=float)
+        else:
+            values = np.asarray(self.evaluateExpression(binBy)[0])
+        values = values.reshape(values.size)
+        # assign the bins
+        numberOfBins = binEdges.size - 1
+        binIndices = np.searchsorted(binEdges, values, side="right") - 1
+        binIndices[values == binEdges[-1]] = numberOfBins - 1
+        binIndices[(binIndices < 0) | (binIndices >= numberOfBins)] = -1
+        return binIndices
+
+    def evaluateExpressionInBins(self, expression, binBy="Npart",
+                                 binEdges=(0, 500)):
+        """
+            Evaluate an expression for all the bins of the binning variable
+            "binBy" at once. The events are assigned to the bins given by
+            "binEdges" only once using the getEventBinIndices function, then
+            the expression is evaluated once over all events with every mean
+            "<...>" taken within each bin, so that all the per-bin means are
+            obtained in a single pass over the event arrays. Means, cumulants
+            like v_2[4](pion), and ratios like <v_2(pion)>/<e_2(ed)> are all
+            supported this way.
+
+            The expression must contain at least one mean. The per-event arrays
+            in the expression are assumed to be ordered by "event_id" and to
+            cover the same events as the binning variable.
+
+            It returns the tuple
+            (value for each bin, number of events in each bin)
+        """
+        binIndices = self.getEventBinIndices(binBy, binEdges)
+        numberOfBins = len(binEdges) - 1
+        selected = binIndices >= 0
+        selectedBinIndices = binIndices[selected]
+        numberOfEventsInBins = np.bincount(selectedBinIndices,
+                                           minlength=numberOfBins)
+
+        def meanInBins(values, axis=0):
+            """
+                Replacement for the mean function that averages the per-event
+                "values" along the event axis within each bin.
+            """
+            if axis != 0:
+                raise ValueError("EbeDBReader.evaluateExpressionInBins: only "
+                                 + "means along the event axis are supported.")
+            values = np.asarray(values)
+            if values.ndim == 0 or values.shape[0] != binIndices.size:
+                raise ValueError("EbeDBReader.evaluateExpressionInBins: the "
+                                 + "number of events does not match that of "
+                                 + "the binning variable.")
+            values = values[selected]
+            flatValues = values.reshape(values.shape[0], -1)
+            sums = np.zeros((numberOfBins, flatValues.shape[1]),
+                            dtype=np.result_type(flatValues.dtype, float))
+            for column in range(flatValues.shape[1]):
+                sums[:,column] = np.bincount(selectedBinIndices,
+                    weights=flatValues[:,column].real, minlength=numberOfBins)
+                if np.iscomplexobj(flatValues):
+                    sums[:,column] += 1j*np.bincount(selectedBinIndices,
+                        weights=flatValues[:,column].imag,
+                        minlength=numberOfBins)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = sums / numberOfEventsInBins[:,np.newaxis]
+            return means.reshape((numberOfBins,) + values.shape[1:])
+
+        exprAfterNormalization, exprAfterFunctionization = (
+                                        self._translateExpression(expression))
+        if "mean(" not in exprAfterFunctionization:
+            raise ValueError("EbeDBReader.evaluateExpressionInBins: the "
+                             + "expression %s contains no mean." % expression)
+        try:
+            value = eval(exprAfterFunctionization, globals(),
+                         {"self": self, "mean": meanInBins})
+            return (value, numberOfEventsInBins)
+        except:
+            print("Error encounterred evaluating {} in bins:".format(expression))
+            print("-> {}\n-> {}".format(exprAfterNormalization, exprAfterFunctionization))
+            raise
+
+    def _splitMeans(self, expression):
+        """
+            Split the functionized "expression" into the per-event quantities
+            averaged by the outermost "mean(...,0)" calls, and the remaining
+            expression in which these means are replaced by "_means[i]".
+
+            It returns the tuple
+            (remaining expression, list of per-event quantities)
+        """
+        meanPattern = re.compile(r"\bmean\(")
+        pieces = []
+        quantities = []
+        position = 0
+        while True:
+            match = meanPattern.search(expression, position)
+            if not match:
+                pieces.append(expression[position:])
+                break
+            pieces.append(expression[position:match.start()])
+            # find the arguments of this mean by matching parentheses
+            arguments = []
+            argumentStart = index = match.end()
+            depth = 1
+            while depth > 0:
+                if index >= len(expression):
+                    raise ValueError("EbeDBReader._splitMeans: unbalanced "
+                                     + "parentheses in %s." % expression)
+                if expression[index] in "([{":
+                    depth += 1
+                elif expression[index] in ")]}":
+                    depth -= 1
+                elif expression[index] == "," and depth == 1:
+                    arguments.append(expression[argumentStart:index])
+                    argumentStart = index + 1
+                index += 1
+            arguments.append(expression[argumentStart:index-1])
+            if len(arguments) > 2 or (len(arguments) == 2
+                                      and arguments[1].strip() != "0"):
+                raise ValueError("EbeDBReader._splitMeans: only means along "
+                                 + "the event axis are supported.")
+            if meanPattern.search(arguments[0]):
+                raise ValueError("EbeDBReader._splitMeans: nested means are "
+                                 + "not supported.")
+            pieces.append("_means[%d]" % len(quantities))
+            quantities.append(arguments[0])
+            position = index
+        remainingExpression = "".join(pieces)
+        if "self." in remainingExpression:
+            raise ValueError("EbeDBReader._splitMeans: all per-event "
+                             + "quantities must be averaged by means.")
+        return remainingExpression, quantities
+
+    def evaluateExpressionChunked(self, expression, numberOfEventsPerChunk=1000):
+        """
+            Evaluate an expression like evaluateExpression, but read the events
+            "numberOfEventsPerChunk" at a time, so that the memory used is set
+            by the chunk size instead of the total number of events. The
+            per-event quantity inside each mean "<...>" is evaluated for one
+            chunk of events at a time and accumulated in a MomentAccumulator;
+            the rest of the expression is evaluated using the accumulated
+            means at the end. Means, cumulants like v_2[4](pion), and ratios
+            like <v_2(pion)>/<e_2(ed)> are all supported this way, but every
+            per-event quantity in the expression must be inside a mean, and
+            means cannot be nested.
+
+            The current event selection (see setEventSelection) is respected;
+            the query cache is not used for the chunks.
+
+            It returns the typle
+            (value of the expression, string after normalization, string after functionization)
+        """
+        exprAfterNormalization, exprAfterFunctionization = (
+                                        self._translateExpression(expression))
+        remainingExpression, quantities = self._splitMeans(
+                                                    exprAfterFunctionization)
+        accumulators = [MomentAccumulator() for aQuantity in quantities]
+        eventIds = self.getEventIds()
+        previousEventSelection = self.eventSelection
+        previousQueryCache = self.queryCache
+        self.queryCache = None
+        try:
+            for chunkStart in range(0, len(eventIds), numberOfEventsPerChunk):
+                chunk = eventIds[chunkStart:chunkStart+numberOfEventsPerChunk]
+                self.eventSelection = ("event_id>=%d and event_id<=%d"
+                                       % (chunk[0], chunk[-1]))
+                if previousEventSelection:
+                    self.eventSelection += " and " + previousEventSelection
+                for aQuantity, anAccumulator in zip(quantities, accumulators):
+                    anAccumulator.add(eval(aQuantity, globals(),
+                                           {"self": self}))
+            self.eventSelection = previousEventSelection
+            value = eval(remainingExpression, globals(),
+                         {"_means": [anAccumulator.mean()
+                                     for anAccumulator in accumulators]})
+            return (value, exprAfterNormalization, exprAfterFunctionization)
+        except:
+            print("Error encounterred evaluating {} in chunks:".format(expression))
+            print("-> {}\n-> {}".format(exprAfterNormalization, exprAfterFunctionization))
+            raise
+        finally:
+            self.eventSelection = previousEventSelection
+            self.queryCache = previousQueryCache
+
+    def evaluateExpressionSampled(self, expression, relativePrecision=0.01,
+                                  timeBudget=60.0, initialSampleSize=1000,
+                                  growthFactor=2.0, numberOfGroups=10,
+                                  randomSeed=0, verbose=True):
+        """
+            Evaluate an expression approximately on a random sample of events
+            that grows progressively, for a quick look at very large
+            databases. The events are taken in the order of a random
+            permutation fixed by "randomSeed", so the samples are
+            reproducible; the first step uses "initialSampleSize" events and
+            each further step multiplies the sample size by "growthFactor".
+
+            After each step the current estimate and its statistical error
+            are obtained: the sampled events are divided into
+            "numberOfGroups" groups and the error is given by the jackknife
+            method, leaving out one group at a time. The evaluation stops when
+            the error relative to the estimate is below "relativePrecision"
+            (for array values, for every element), when more than
+            "timeBudget" seconds have been used, or when all events are used.
+            With "verbose" set to True the estimate is printed after each step.
+
+            As for evaluateExpressionChunked, every per-event quantity in the
+            expression must be inside a mean, and means cannot be nested.
+
+            It returns the tuple
+            (estimated value, statistical error, number of events used)
+        """
+        startTime = time.time()
+        exprAfterNormalization, exprAfterFunctionization = (
+                                        self._translateExpression(expression))
+        remainingExpression, quantities = self._splitMeans(
+                                                    exprAfterFunctionization)
+        eventIds = np.asarray(self.getEventIds())
+        if eventIds.size == 0:
+            raise ValueError("EbeDBReader.evaluateExpressionSampled: there "
+                             + "are no events to sample.")
+        permutedEventIds = np.random.RandomState(randomSeed).permutation(
+                                                                    eventIds)
+        # the group of an event is set by its position in the permutation
+        groupOfEvent = dict((eventId, index % numberOfGroups) for index, eventId
+                            in enumerate(permutedEventIds))
+        accumulators = [[MomentAccumulator() for aQuantity in quantities]
+                        for aGroup in range(numberOfGroups)]
+
+        def evaluateMeans(groups):
+            """
+                Evaluate the remaining expression using the means accumulated
+                in the given groups.
+            """
+            means = []
+            for quantityIndex in range(len(quantities)):
+                merged = MomentAccumulator()
+                for aGroup in groups:
+                    merged.merge(accumulators[aGroup][quantityIndex])
+                means.append(merged.mean())
+            return np.asarray(eval(remainingExpression, globals(),
+                                   {"_means": means}))
+
+        previousEventSelection = self.eventSelection
+        previousQueryCache = self.queryCache
+        self.queryCache = None
+        numberOfSampledEvents = 0
+        sampleSize = int(np.minimum(initialSampleSize, eventIds.size))
+        try:
+            while True:
+                # evaluate the per-event quantities for the new events
+                newEventIds = np.sort(
+                    permutedEventIds[numberOfSampledEvents:sampleSize])
+                self.eventSelection = ("event_id in (%s)"
+                                       % ",".join(map(str, newEventIds)))
+                if previousEventSelection:
+                    self.eventSelection += " and " + previousEventSelection
+                groups = np.array([groupOfEvent[eventId]
+                                   for eventId in newEventIds])
+                for quantityIndex, aQuantity in enumerate(quantities):
+                    values = np.asarray(eval(aQuantity, globals(),
+                                             {"self": self}))
+                    for aGroup in range(numberOfGroups):
+                        accumulators[aGroup][quantityIndex].add(
+                                                    values[groups == aGroup])
+                self.eventSelection = previousEventSelection
+                numberOfSampledEvents = sampleSize
+                # estimate and its jackknife error
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    value = evaluateMeans(range(numberOfGroups))
+                    leaveOneOutValues = np.asarray([evaluateMeans(
+                        [aGroup for aGroup in range(numberOfGroups)
+                         if aGroup != leftOutGroup])
+                        for leftOutGroup in range(numberOfGroups)])
+                    error = np.sqrt((numberOfGroups-1.0)/numberOfGroups
+                        * np.sum(abs(leaveOneOutValues
+                                     - leaveOneOutValues.mean(axis=0))**2,
+                                 axis=0))
+                    relativeError = np.max(error/abs(value))
+                if verbose:
+                    print("{} of {} events: {} +- {}".format(
+                        numberOfSampledEvents, eventIds.size, value, error))
+                if (relativeError <= relativePrecision
+                    or time.time()-startTime >= timeBudget
+                    or numberOfSampledEvents >= eventIds.size):
+                    return (value[()], error[()], numberOfSampledEvents)
+                sampleSize = int(np.minimum(sampleSize*growthFactor,
+                                            eventIds.size))
+        except:
+            print("Error encounterred evaluating {} on samples:".format(expression))
+            print("-> {}\n-> {}".format(exprAfterNormalization, exprAfterFunctionization))
+            raise
+        finally:
+            self.eventSelection = previousEventSelection
+            self.queryCache = previousQueryCache
+
+    def evaluateExpressionOnly(self, expression, eventSelection=None):
         """
             Wraps evaluateExpression function; returns only the result, not
             expressions for checking.
         """
         try:
-            value, expr1, expr2 = self.evaluateExpression(expression)
+            value, expr1, expr2 = self.evaluateExpression(expression,
+                                                          eventSelection)
             return value
         except:
             pass # ignore
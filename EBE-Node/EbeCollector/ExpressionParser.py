@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+"""
+    This module implements an ExpressionParser class, which translates the
+    expressions understood by EbeDBReader.evaluateExpression (see section 2 of
+    EbeCollector_readme.txt) into python code in one pass.
+"""
+
+import re
+
+class Node(object):
+    """
+        Base class of the nodes of the syntax tree. Each node gives its
+        normalized form with the normalized function, and the python code
+        that evaluates it with the code function.
+    """
+    children = ()
+
+    def normalized(self):
+        return "".join(aChild.normalized() for aChild in self.children)
+
+    def code(self):
+        return "".join(aChild.code() for aChild in self.children)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, self.normalized())
+
+class Text(Node):
+    """
+        Python code passed through unchanged.
+    """
+    def __init__(self, text):
+        self.text = text
+
+    def normalized(self):
+        return self.text
+
+    def code(self):
+        return self.text
+
+class Sequence(Node):
+    """
+        A list of nodes written one after another.
+    """
+    def __init__(self, children):
+        self.children = children
+
+class Mean(Node):
+    """
+        The mean over events: <...>.
+    """
+    def __init__(self, child):
+        self.children = (child,)
+
+    def normalized(self):
+        return "<%s>" % self.children[0].normalized()
+
+    def code(self):
+        return "mean(%s,0)" % self.children[0].code()
+
+class Abs(Node):
+    """
+        The absolute value: |...|.
+    """
+    def __init__(self, child):
+        self.children = (child,)
+
+    def normalized(self):
+        return "|%s|" % self.children[0].normalized()
+
+    def code(self):
+        return "abs(%s)" % self.children[0].code()
+
+class Angle(Node):
+    """
+        The plane angle of an eccentricity or a flow vector of the given
+        harmonic order: $...$.
+    """
+    def __init__(self, child, order):
+        self.children = (child,)
+        self.order = order
+
+    def normalized(self):
+        return "$%s$" % self.children[0].normalized()
+
+    def code(self):
+        return "angle(%s)/%s" % (self.children[0].code(), self.order)
+
+class Cumulant(Node):
+    """
+        The 2- or 4-particle cumulant of a quantity: ...[2] or ...[4].
+    """
+    def __init__(self, child, numberOfParticles):
+        self.children = (child,)
+        self.numberOfParticles = numberOfParticles
+
+    def normalized(self):
+        return self._format(self.children[0].normalized(), "<%s>")
+
+    def code(self):
+        return self._format(self.children[0].code(), "mean(%s,0)")
+
+    def _format(self, quantity, meanFormat):
+        if self.numberOfParticles == "2":
+            return "sqrt(%s)" % (meanFormat % (quantity+"**2"))
+        return "((2*%s**2-%s)**0.25)" % (meanFormat % (quantity+"**2"),
+                                        meanFormat % (quantity+"**4"))
+
+class Eccentricity(Node):
+    """
+        The complex eccentricity vector: Ecc_{m,n}(ed).
+    """
+    def __init__(self, r_power, order, eccType):
+        self.r_power, self.order, self.eccType = r_power, order, eccType
+
+    def normalized(self):
+        return "Ecc_{%s,%s}(%s)" % (self.r_power, self.order, self.eccType)
+
+    def code(self):
+        return 'self.get_Ecc_n(eccType="%s", r_power=%s, order=%s)' % (
+                                    self.eccType, self.r_power, self.order)
+
+class RAverage(Node):
+    """
+        The r-average: {r^m}(ed).
+    """
+    def __init__(self, r_power, eccType):
+        self.r_power, self.eccType = r_power, eccType
+
+    def normalized(self):
+        return "{r^%s}(%s)" % (self.r_power, self.eccType)
+
+    def code(self):
+        return ('self.getRIntegrals(eccType="%s", r_power=%s) / '
+                'self.getRIntegrals(eccType="%s", r_power=0)') % (
+                                self.eccType, self.r_power, self.eccType)
+
+class RIntegral(Node):
+    """
+        The r-integral: [r^m](ed).
+    """
+    def __init__(self, r_power, eccType):
+        self.r_power, self.eccType = r_power, eccType
+
+    def normalized(self):
+        return "[r^%s](%s)" % (self.r_power, self.eccType)
+
+    def code(self):
+        return 'self.getRIntegrals(eccType="%s", r_power=%s)' % (
+                                                self.eccType, self.r_power)
+
+class Lifetime(Node):
+    """
+        The lifetimes: lifetime.
+    """
+    def normalized(self):
+        return "lifetime"
+
+    def code(self):
+        return "self.getLifetimes()"
+
+class Flow(Node):
+    """
+        The complex integrated flow vector V_{n}(pion), or the differential
+        flow vector V_{n}(pTs)(pion) when "pTs" is given.
+    """
+    def __init__(self, order, particleName, pTs=None):
+        self.order, self.particleName, self.pTs = order, particleName, pTs
+        self.children = (pTs,) if pTs else ()
+
+    def normalized(self):
+        if self.pTs is None:
+            return "V_{%s}(%s)" % (self.order, self.particleName)
+        return "V_{%s}(%s)(%s)" % (self.order, self.pTs.normalized(),
+                                   self.particleName)
+
+    def code(self):
+        if self.pTs is None:
+            return 'self.get_V_n(particleName="%s", order=%s)' % (
+                                            self.particleName, self.order)
+        return ('self.get_diff_V_n(particleName="%s", order=%s, pTs=%s, '
+                'verbose=True)') % (self.particleName, self.order,
+                                    self.pTs.code())
+
+class Multiplicity(Node):
+    """
+        The multiplicity: dN/dy(pion).
+    """
+    def __init__(self, particleName):
+        self.particleName = particleName
+
+    def normalized(self):
+        return "dN/dy(%s)" % self.particleName
+
+    def code(self):
+        return 'self.get_dNdy(particleName="%s")' % self.particleName
+
+class Spectrum(Node):
+    """
+        The spectrum at given pT values: dN/(dydpT)(pTs)(pion).
+    """
+    def __init__(self, particleName, pTs):
+        self.particleName, self.pTs = particleName, pTs
+        self.children = (pTs,)
+
+    def normalized(self):
+        return "dN/(dydpT)(%s)(%s)" % (self.pTs.normalized(),
+                                       self.particleName)
+
+    def code(self):
+        return 'self.get_dNdydpT(particleName="%s", pTs=%s, verbose=True)' % (
+                                        self.particleName, self.pTs.code())
+
+class ExpressionParser(object):
+    """
+        This class parses an expression into a syntax tree made of the Node
+        classes above and translates it into the normalized form and the
+        python code used by EbeDBReader.evaluateExpression. For example:
+        >>> parser = ExpressionParser()
+        >>> parser.translate("v_2[2](pion)")[0]
+        'sqrt(<|V_{2}(pion)|**2>)'
+        >>> parser.translate("<e_3(ed)>")[1]
+        'mean(abs(self.get_Ecc_n(eccType="ed", r_power=3, order=3)),0)'
+        >>> parser.parse("dN/dydpT(0.5)(pion)")
+        Sequence(dN/(dydpT)(0.5)(pion))
+
+        The expression is split into tokens by a single regular expression,
+        and the tokens are read once from left to right. Parts of the
+        expression that are not uhg symbols are kept as they are. Expressions
+        that cannot be parsed raise ExpressionParserError.
+    """
+
+    class ExpressionParserError(ValueError):
+        """
+            Error raised when an expression cannot be parsed.
+        """
+        pass
+
+    tokenPattern = re.compile(r"""
+        (?P<multiplicity>dN/\(dydpT\)|dN/dydpT|dN/dpT|dN/dy|dN(?=\())
+        | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?j?)
+        | (?P<name>[A-Za-z_]\w*)
+        | (?P<operator>\*\*|.)
+        """, re.VERBOSE | re.DOTALL)
+
+    # symbol name -> (kind of symbol, function applied to it)
+    symbolNames = {
+        "Ecc": ("Ecc", None), "E": ("Ecc", None),
+        "Eccentricity": ("Ecc", None), "Epsilon": ("Ecc", None),
+        "ecc": ("Ecc", Abs), "e": ("Ecc", Abs),
+        "eccentricity": ("Ecc", Abs), "epsilon": ("Ecc", Abs),
+        "Phi": ("Ecc", Angle),
+        "V": ("V", None), "v": ("V", Abs), "Psi": ("V", Angle),
+    }
+
+    # symbols written with a function around the name, like |V|_2(pion)
+    wrappers = {"|": Abs, "<": Mean, "$": Angle}
+
+    # short names of the weight functions
+    eccTypes = {"e": "ed", "s": "sd"}
+
+    def parse(self, expression):
+        """
+            Return the syntax tree (a Sequence) of "expression"; spaces are
+            ignored.
+        """
+        expression = expression.replace(" ", "")
+        self._tokens = [(match.lastgroup, match.group())
+                        for match in self.tokenPattern.finditer(expression)]
+        self._position = 0
+        tree = self._parseSequence(None, len(self._tokens))
+        if self._position != len(self._tokens):
+            self._fail("unexpected %s" % self._tokens[self._position][1])
+        return tree
+
+    def translate(self, expression):
+        """
+            Return the tuple
+            (string after normalization, string after functionization)
+            for "expression", the same as given by the substitution rules in
+            EbeDBReader._translateExpression.
+        """
+        tree = self.parse(expression)
+        return tree.normalized(), tree.code()
+
+    def _fail(self, reason):
+        raise self.ExpressionParserError("ExpressionParser: %s in %s." % (
+            reason, "".join(aToken[1] for aToken in self._tokens)))
+
+    def _peek(self, offset=0):
+        """
+            Return the text of the token at "offset" from the current one, or
+            None at the end.
+        """
+        position = self._position + offset
+        if position < len(self._tokens):
+            return self._tokens[position][1]
+        return None
+
+    def _expect(self, text):
+        """
+            Skip the current token, which has to be "text".
+        """
+        if self._peek() != text:
+            self._fail("expecting %s" % text)
+        self._position += 1
+
+    def _readName(self):
+        """
+            Return the current token, which has to be a name, and skip it.
+        """
+        if (self._position >= len(self._tokens)
+            or self._tokens[self._position][0] != "name"):
+            self._fail("expecting a name")
+        self._position += 1
+        return self._tokens[self._position-1][1]
+
+    def _readInteger(self):
+        """
+            Return the current token, which has to be an integer, and skip it.
+        """
+        text = self._peek()
+        if text is None or not text.isdigit():
+            self._fail("expecting an integer")
+        self._position += 1
+        return text
+
+    def _readParenthesizedName(self):
+        """
+            Read "(name)" and return the name.
+        """
+        self._expect("(")
+        name = self._readName()
+        self._expect(")")
+        return name
+
+    def _isParenthesizedName(self):
+        """
+            Return True if the next tokens are "(name)".
+        """
+        return (self._peek() == "(" and self._peek(2) == ")"
+                and self._tokens[self._position+1][0] == "name")
+
+    def _readParenthesized(self):
+        """
+            Read a parenthesized expression and return its syntax tree.
+        """
+        self._expect("(")
+        depth = 1
+        end = self._position
+        while depth:
+            if end >= len(self._tokens):
+                self._fail("unbalanced parentheses")
+            if self._tokens[end][1] == "(":
+                depth += 1
+            elif self._tokens[end][1] == ")":
+                depth -= 1
+            end += 1
+        tree = self._parseSequence(None, end-1)
+        self._expect(")")
+        return tree
+
+    def _parseSequence(self, closing, end):
+        """
+            Parse tokens until the token "closing" (not skipped) or the
+            position "end", and return them as a Sequence.
+        """
+        children = []
+        while self._position < end:
+            kind, text = self._tokens[self._position]
+            if text == closing:
+                return Sequence(children)
+            if text in self.wrappers and self._isWrappedSymbol():
+                children.append(self._parseSymbol())
+            elif text in ("<", "|", "$"):
+                self._position += 1
+                closingText = ">" if text == "<" else text
+                child = self._parseSequence(closingText, end)
+                self._expect(closingText)
+                if text == "<":
+                    children.append(Mean(child))
+                elif text == "|":
+                    children.append(Abs(child))
+                else:
+                    children.append(self._makeAngle(child))
+            elif kind == "name" and self._isSymbol(text):
+                children.append(self._parseSymbol())
+            elif kind == "name" and text == "lifetime":
+                self._position += 1
+                children.append(Lifetime())
+            elif kind == "name" and text == "N" and self._peek(1) == "(":
+                self._position += 1
+                children.append(Multiplicity(self._readParenthesizedName()))
+            elif kind == "multiplicity":
+                self._position += 1
+                if text in ("dN/dy", "dN"):
+                    children.append(Multiplicity(
+                        self._readParenthesizedName()))
+                else:
+                    pTs = self._readParenthesized()
+                    children.append(Spectrum(self._readParenthesizedName(),
+                                             pTs))
+            elif text == "{":
+                children.append(self._parseRIntegral("{", "}", RAverage))
+            elif (text == "[" and self._peek(1) in ("r", "R")
+                  and self._peek(2) == "^"):
+                children.append(self._parseRIntegral("[", "]", RIntegral))
+            else:
+                self._position += 1
+                children.append(Text(text))
+        if closing is not None:
+            self._fail("missing %s" % closing)
+        return Sequence(children)
+
+    def _makeAngle(self, child):
+        """
+            Return the plane angle of "child", which has to start with an
+            eccentricity or a flow vector.
+        """
+        first = child.children[0] if child.children else None
+        if not isinstance(first, (Eccentricity, Flow)):
+            self._fail("$...$ needs an eccentricity or a flow vector")
+        return Angle(child, first.order)
+
+    def _isSymbol(self, name):
+        """
+            Return True if the name token "name" starts a uhg symbol like
+            "v_2" or "Ecc_".
+        """
+        match = re.match(r"([A-Za-z]+)_(\d*)$", name)
+        return bool(match) and match.group(1) in self.symbolNames
+
+    def _isWrappedSymbol(self):
+        """
+            Return True if the next tokens start a symbol with a function
+            around the name, like "|V|_2".
+        """
+        opening = self._peek()
+        closing = ">" if opening == "<" else opening
+        name = self._peek(3)
+        return (self._peek(1) in self.symbolNames and self._peek(2) == closing
+                and name is not None and re.match(r"_\d*$", name) is not None)
+
+    def _parseSymbol(self):
+        """
+            Parse an eccentricity or flow symbol, with its subscript,
+            cumulant and arguments.
+        """
+        wrapper = None
+        if self._peek() in self.wrappers:
+            wrapper = self.wrappers[self._peek()]
+            self._position += 1
+            baseName = self._readName()
+            self._position += 1 # the closing wrapper
+            subscript = self._readName()[1:]
+        else:
+            baseName, subscript = self._readName().split("_", 1)
+        kind, function = self.symbolNames[baseName]
+        # subscript
+        if subscript:
+            indices = [subscript]
+        else:
+            self._expect("{")
+            indices = [self._readInteger()]
+            while self._peek() == ",":
+                self._position += 1
+                indices.append(self._readInteger())
+            self._expect("}")
+        # cumulant
+        numberOfParticles = None
+        if self._peek() == "[":
+            self._position += 1
+            numberOfParticles = self._readInteger()
+            if numberOfParticles not in ("2", "4"):
+                self._fail("only [2] and [4] cumulants are supported")
+            self._expect("]")
+        # arguments
+        if kind == "Ecc":
+            if len(indices) > 2:
+                self._fail("eccentricities need one or two indices")
+            node = Eccentricity(indices[0], indices[-1],
+                                self._readEccType())
+        else:
+            if len(indices) != 1:
+                self._fail("flows need one index")
+            if self._isParenthesizedName() and self._peek(3) != "(":
+                node = Flow(indices[0], self._readParenthesizedName())
+            else:
+                pTs = self._readParenthesized()
+                node = Flow(indices[0], self._readParenthesizedName(), pTs)
+        if function is Angle:
+            node = Angle(node, node.order)
+        elif function:
+            node = function(node)
+        if numberOfParticles:
+            node = Cumulant(node, numberOfParticles)
+        if wrapper is Angle:
+            node = self._makeAngle(Sequence([node]))
+        elif wrapper:
+            node = wrapper(node)
+        return node
+
+    def _readEccType(self):
+        """
+            Read "(ed)" or "(e)" and return the weight function "ed".
+        """
+        eccType = self._readParenthesizedName()
+        eccType = self.eccTypes.get(eccType, eccType)
+        if len(eccType) != 2:
+            self._fail("unknown weight function %s" % eccType)
+        return eccType
+
+    def _parseRIntegral(self, opening, closing, nodeClass):
+        """
+            Parse "{r^m}(ed)" or "[r^m](ed)".
+        """
+        self._expect(opening)
+        if self._readName() not in ("r", "R"):
+            self._fail("expecting r^m after %s" % opening)
+        self._expect("^")
+        r_power = self._readInteger()
+        self._expect(closing)
+        return nodeClass(r_power, self._readEccType())
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
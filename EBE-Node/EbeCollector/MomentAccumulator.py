@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+    This module implements a MomentAccumulator class.
+"""
+
+import numpy as np
+
+class MomentAccumulator(object):
+    """
+        This class accumulates the number of events, the sum and the sum of
+        squared absolute values of per-event quantities, so that their mean and
+        variance can be obtained without keeping the quantities of all events
+        in memory. Accumulators filled from different parts of the events can
+        be merged. For example:
+        >>> a = MomentAccumulator()
+        >>> a.add(np.array([1.0, 2.0]))
+        >>> b = MomentAccumulator()
+        >>> b.add(np.array([3.0, 4.0, 5.0]))
+        >>> a.merge(b)
+        >>> (a.count, float(a.mean()), float(a.variance()))
+        (5, 3.0, 2.0)
+    """
+
+    def __init__(self):
+        """
+            Start with no events.
+        """
+        self.count = 0
+        self.sum = 0.0
+        self.sumOfSquares = 0.0
+
+    def add(self, values):
+        """
+            Add the quantities of a group of events; the first axis of "values"
+            runs over the events, and the remaining axes are kept.
+        """
+        values = np.asarray(values)
+        self.count += values.shape[0]
+        self.sum = self.sum + values.sum(axis=0)
+        self.sumOfSquares = self.sumOfSquares + (abs(values)**2).sum(axis=0)
+
+    def merge(self, other):
+        """
+            Add the events accumulated in another MomentAccumulator "other".
+        """
+        self.count += other.count
+        self.sum = self.sum + other.sum
+        self.sumOfSquares = self.sumOfSquares + other.sumOfSquares
+
+    def mean(self):
+        """
+            Return the mean over all the accumulated events.
+        """
+        return self.sum/float(self.count)
+
+    def variance(self):
+        """
+            Return the variance of the absolute value over all the accumulated
+            events: <|x|^2> - |<x>|^2.
+        """
+        return self.sumOfSquares/float(self.count) - abs(self.mean())**2
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+    This module implements the QCumulantReader class, which calculates
+    multi-particle correlations using the Q-cumulant method directly from the
+    "particle_list" table in a particle database generated by the
+    collectParticleinfo function of the EbeCollector class.
+
+    For the Q-cumulant method see A. Bilandzic, R. Snellings and S. Voloshin,
+    Phys. Rev. C 83, 044913 (2011).
+"""
+
+import numpy as np
+from os import path
+from DBR import SqliteDB
+from EbeCollector import EbeCollector
+from ListRNew import isIterable
+
+class QCumulantReader(object):
+    """
+        This class calculates two-, four- and six-particle cumulants and the
+        differential v_n{2}(pT) from the particles stored in the
+        "particle_list" table. An event is identified by the pair
+        (hydroEvent_id, UrQMDEvent_id).
+
+        The particle data are read in chunks of hydro events, each chunk in one
+        query, and the per-event Q_n vectors and weights are obtained for all
+        events in a chunk at once using numpy.bincount, so that the cost is
+        linear in the number of particles and the memory usage is set by the
+        chunk size. The per-chunk results are accumulated as sums of
+        numerators and weights of the event-wise correlations, which are then
+        combined into cumulants at the end.
+    """
+    # the particles that "charged" stands for, as collected by EbeCollector
+    chargedHadrons = EbeCollector.charged_hadron_list
+
+    def __init__(self, database):
+        """
+            Register a SqliteDB database; it should contain the
+            "particle_list" and the "pid_lookup" tables.
+        """
+        # setup database
+        if isinstance(database, str):
+            if path.exists(database):
+                database = SqliteDB(database)
+            else:
+                raise ValueError("QCumulantReader.__init__: the input argument "
+                                 + "must be an existing database file.")
+        if isinstance(database, SqliteDB):
+            self.db = database
+        else:
+            raise TypeError("QCumulantReader.__init__: the input argument "
+                            + "must be a string or a SqliteDB database.")
+        # setup lookup tables
+        self.pid_lookup = dict(self.db.selectFromTable("pid_lookup"))
+
+    def _pids(self, particleNames):
+        """
+            Return the list of pids for the given list of particle names;
+            "charged" is expanded to all the charged hadrons.
+        """
+        if not isIterable(particleNames):
+            particleNames = [particleNames]
+        pids = []
+        for aParticle in particleNames:
+            if aParticle == "charged":
+                pids.extend(self.pid_lookup[x] for x in self.chargedHadrons)
+            else:
+                pids.append(self.pid_lookup[aParticle])
+        return sorted(set(pids))
+
+    def getHydroEventIds(self):
+        """
+            Return the sorted list of hydro event ids in the database.
+        """
+        return [item[0] for item in self.db.selectFromTable("particle_list",
+                    "distinct hydroEvent_id", orderByClause="hydroEvent_id")]
+
+    def iterateParticleChunks(self, pids, pT_range, eta_range, etaName,
+                              numberOfHydroEventsPerChunk):
+        """
+            Yield (event index, pT, phi, eta, number of events) for the
+            particles with pid in "pids" inside the given "pT_range" and
+            "eta_range", reading "numberOfHydroEventsPerChunk" hydro events at a
+            time. The event index is 0-based and counts the (hydroEvent_id,
+            UrQMDEvent_id) pairs within the chunk. The cuts are applied in the
+            query so that only the selected particles are read.
+        """
+        hydroEventIds = self.getHydroEventIds()
+        whereClause = ("pid in (%s) and %g<=pT and pT<=%g and %g<=%s and %s<=%g"
+                       % (",".join(map(str, pids)), pT_range[0], pT_range[1],
+                          eta_range[0], etaName, etaName, eta_range[1]))
+        for chunkStart in range(0, len(hydroEventIds),
+                                numberOfHydroEventsPerChunk):
+            chunk = hydroEventIds[
+                        chunkStart:chunkStart+numberOfHydroEventsPerChunk]
+            data = np.asarray(self.db.selectFromTable("particle_list",
+                ("hydroEvent_id", "UrQMDEvent_id", "pT", "phi_p", etaName),
+                whereClause=(whereClause + " and %d<=hydroEvent_id and "
+                             "hydroEvent_id<=%d" % (chunk[0], chunk[-1]))),
+                dtype=float)
+            if data.size == 0:
+                continue
+            eventKeys = data[:,0]*(data[:,1].max()+1) + data[:,1]
+            eventKeys, eventIndices = np.unique(eventKeys, return_inverse=True)
+            yield (eventIndices, data[:,2], data[:,3], data[:,4],
+                   eventKeys.size)
+
+    @staticmethod
+    def getQVectors(eventIndices, phi, harmonics, numberOfEvents,
+                    selection=None):
+        """
+            Return the per-event multiplicities M and the per-event Q vectors
+            Q_k = sum(exp(i k phi)) for each k in "harmonics", for the
+            particles given by the boolean array "selection" (all if None).
+        """
+        if selection is not None:
+            eventIndices = eventIndices[selection]
+            phi = phi[selection]
+        M = np.bincount(eventIndices, minlength=numberOfEvents).astype(float)
+        Q = {}
+        for k in harmonics:
+            Q[k] = (np.bincount(eventIndices, weights=np.cos(k*phi),
+                                minlength=numberOfEvents)
+                    + 1j*np.bincount(eventIndices, weights=np.sin(k*phi),
+                                     minlength=numberOfEvents))
+        return M, Q
+
+    @staticmethod
+    def getCorrelationNumerators(M, Qn, Q2n, Q3n):
+        """
+            Return the numerators and weights of the event-wise two-, four- and
+            six-particle correlations:
+            ((N2, W2), (N4, W4), (N6, W6)), each being per-event arrays.
+        """
+        absQn2 = abs(Qn)**2
+        absQ2n2 = abs(Q2n)**2
+        absQ3n2 = abs(Q3n)**2
+        W2 = M*(M-1)
+        W4 = W2*(M-2)*(M-3)
+        W6 = W4*(M-4)*(M-5)
+        N2 = absQn2 - M
+        N4 = (absQn2**2 + absQ2n2 - 2*(Q2n*Qn.conj()**2).real
+              - 4*(M-2)*absQn2 + 2*M*(M-3))
+        N6 = (absQn2**3 + 9*absQ2n2*absQn2 - 6*(Q2n*Qn*Qn.conj()**3).real
+              + 4*(Q3n*Qn.conj()**3).real - 12*(Q3n*Q2n.conj()*Qn.conj()).real
+              + 18*(M-4)*(Q2n*Qn.conj()**2).real + 4*absQ3n2
+              - 9*(M-4)*(absQn2**2 + absQ2n2)
+              + 18*(M-2)*(M-5)*absQn2 - 6*M*(M-4)*(M-5))
+        # events with too few particles do not contribute
+        results = []
+        for N, W in ((N2, W2), (N4, W4), (N6, W6)):
+            tooFew = W <= 0
+            N[tooFew] = 0
+            W[tooFew] = 0
+            results.append((N, W))
+        return results
+
+    def getCumulants(self, order=2, particleNames="charged",
+                     pT_range=(0.2, 3.0), eta_range=(-1.0, 1.0), etaGap=None,
+                     pTBins=None, useRapidity=False,
+                     numberOfHydroEventsPerChunk=100):
+        """
+            Return a dictionary with the multi-particle cumulants of harmonic
+            order "order" for the reference particles with names
+            "particleNames" (a name or a list of names; "charged" for all
+            charged hadrons) within "pT_range" and "eta_range". The
+            pseudorapidity is used for the eta cuts unless "useRapidity" is set
+            to True. The returned dictionary contains:
+
+            -- "c2", "c4", "c6": the two-, four- and six-particle cumulants
+                c_n{2}, c_n{4} and c_n{6}.
+            -- "v2", "v4", "v6": v_n{2}, v_n{4} and v_n{6}; nan when the
+                corresponding cumulant has the wrong sign.
+            -- "numberOfEvents": number of events with particles selected.
+
+            When "etaGap" is given, two subevents are formed with eta<-etaGap/2
+            and eta>etaGap/2, and the dictionary contains in addition:
+
+            -- "c2_gap", "v2_gap": two-particle cumulant and v_n{2} with the eta
+                gap.
+            -- "c4_2sub", "v4_2sub": two-subevent four-particle cumulant and
+                v_n{4}.
+
+            When the pT bin edges "pTBins" are given, the dictionary contains
+            in addition "pT" (mean pT in each bin) and "vn2_pT", the
+            differential v_n{2}(pT) for the same particle species within
+            "eta_range", using the reference flow with the eta gap (particles
+            of interest and reference particles taken from opposite
+            subevents) if "etaGap" is given, or the one without otherwise.
+
+            Particles are read "numberOfHydroEventsPerChunk" hydro events at a
+            time.
+        """
+        n = order
+        etaName = "rapidity" if useRapidity else "pseudorapidity"
+        pids = self._pids(particleNames)
+        if pTBins is not None:
+            pTBins = np.asarray(pTBins, dtype=float)
+            numberOfPTBins = pTBins.size - 1
+            queryPTRange = (min(pT_range[0], pTBins[0]),
+                            max(pT_range[1], pTBins[-1]))
+        else:
+            queryPTRange = pT_range
+
+        # accumulated numerators and weights
+        sums = dict((key, np.float64(0)) for key in ("N2", "W2", "N4", "W4",
+                    "N6", "W6", "N2gap", "W2gap", "N4sub", "W4sub"))
+        if pTBins is not None:
+            sumsDiff = dict((key, np.zeros(numberOfPTBins))
+                            for key in ("N2", "W2", "pT", "count"))
+        numberOfEvents = 0
+
+        for eventIndices, pT, phi, eta, numberOfEventsInChunk in (
+                self.iterateParticleChunks(pids, queryPTRange, eta_range,
+                                etaName, numberOfHydroEventsPerChunk)):
+            isRFP = (pT_range[0]<=pT) & (pT<=pT_range[1])
+            # integrated correlations
+            M, Q = self.getQVectors(eventIndices, phi, (n, 2*n, 3*n),
+                                    numberOfEventsInChunk, isRFP)
+            numberOfEvents += np.count_nonzero(M)
+            for k, (N, W) in zip((2, 4, 6), self.getCorrelationNumerators(
+                                                    M, Q[n], Q[2*n], Q[3*n])):
+                sums["N%d" % k] += N.sum()
+                sums["W%d" % k] += W.sum()
+            # subevents
+            if etaGap is not None:
+                isA = isRFP & (eta < -0.5*etaGap)
+                isB = isRFP & (eta > 0.5*etaGap)
+                MA, QA = self.getQVectors(eventIndices, phi, (n, 2*n),
+                                          numberOfEventsInChunk, isA)
+                MB, QB = self.getQVectors(eventIndices, phi, (n, 2*n),
+                                          numberOfEventsInChunk, isB)
+                sums["N2gap"] += (QA[n]*QB[n].conj()).real.sum()
+                sums["W2gap"] += (MA*MB).sum()
+                W4sub = MA*(MA-1)*MB*(MB-1)
+                N4sub = ((QA[n]**2 - QA[2*n])
+                         * (QB[n]**2 - QB[2*n]).conj()).real
+                N4sub[W4sub <= 0] = 0
+                sums["N4sub"] += N4sub.sum()
+                sums["W4sub"] += W4sub[W4sub > 0].sum()
+            # differential correlations
+            if pTBins is not None:
+                binIndices = np.searchsorted(pTBins, pT, side="right") - 1
+                isPOI = (binIndices >= 0) & (binIndices < numberOfPTBins)
+                numberOfCells = numberOfEventsInChunk*numberOfPTBins
+                if etaGap is None:
+                    poiGroups = [(isPOI, Q[n], M, isRFP)]
+                else:
+                    poiGroups = [(isPOI & (eta < -0.5*etaGap), QB[n], MB, None),
+                                 (isPOI & (eta > 0.5*etaGap), QA[n], MA, None)]
+                for isThisPOI, QRef, MRef, isOverlap in poiGroups:
+                    cells = (eventIndices[isThisPOI]*numberOfPTBins
+                             + binIndices[isThisPOI])
+                    thisPhi = phi[isThisPOI]
+                    mp = np.bincount(cells, minlength=numberOfCells)
+                    pn = (np.bincount(cells, weights=np.cos(n*thisPhi),
+                                      minlength=numberOfCells)
+                          + 1j*np.bincount(cells, weights=np.sin(n*thisPhi),
+                                           minlength=numberOfCells))
+                    mp = mp.reshape(numberOfEventsInChunk, numberOfPTBins)
+                    pn = pn.reshape(numberOfEventsInChunk, numberOfPTBins)
+                    N2diff = (pn*QRef.conj()[:,np.newaxis]).real
+                    W2diff = mp*MRef[:,np.newaxis]
+                    if isOverlap is not None:
+                        # remove autocorrelations from particles that are both
+                        # particles of interest and reference particles
+                        mq = np.bincount(cells[isOverlap[isThisPOI]],
+                            minlength=numberOfCells).reshape(
+                                numberOfEventsInChunk, numberOfPTBins)
+                        N2diff -= mq
+                        W2diff -= mq
+                    sumsDiff["N2"] += N2diff.sum(axis=0)
+                    sumsDiff["W2"] += W2diff.sum(axis=0)
+                    sumsDiff["pT"] += np.bincount(binIndices[isThisPOI],
+                        weights=pT[isThisPOI], minlength=numberOfPTBins)
+                    sumsDiff["count"] += mp.sum(axis=0)
+
+        # combine into cumulants
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr2 = sums["N2"]/sums["W2"]
+            corr4 = sums["N4"]/sums["W4"]
+            corr6 = sums["N6"]/sums["W6"]
+            results = {"numberOfEvents": numberOfEvents}
+            results["c2"] = corr2
+            results["c4"] = corr4 - 2*corr2**2
+            results["c6"] = corr6 - 9*corr4*corr2 + 12*corr2**3
+            results["v2"] = np.sqrt(results["c2"])
+            results["v4"] = (-results["c4"])**0.25
+            results["v6"] = (results["c6"]/4.0)**(1.0/6)
+            referenceFlow = results["v2"]
+            if etaGap is not None:
+                corr2gap = sums["N2gap"]/sums["W2gap"]
+                corr4sub = sums["N4sub"]/sums["W4sub"]
+                results["c2_gap"] = corr2gap
+                results["v2_gap"] = np.sqrt(corr2gap)
+                results["c4_2sub"] = corr4sub - 2*corr2gap**2
+                results["v4_2sub"] = (-results["c4_2sub"])**0.25
+                referenceFlow = results["v2_gap"]
+            if pTBins is not None:
+                results["pT"] = sumsDiff["pT"]/sumsDiff["count"]
+                results["vn2_pT"] = (sumsDiff["N2"]/sumsDiff["W2"]
+                                     / referenceFlow)
+        return results
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+    This module implements a ReaderPool class, which keeps EbeDBReader objects
+    open between queries.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from DBR import SqliteDB
+from EbeCollector import EbeDBReader
+
+def getFileIdentity(filename):
+    """
+        Return a tuple that changes when the file "filename" is modified or
+        replaced: (device, inode, size, modification time).
+    """
+    status = os.stat(filename)
+    return (status.st_dev, status.st_ino, status.st_size, status.st_mtime)
+
+class ReaderPool(object):
+    """
+        This class keeps at most "maximumNumberOfReaders" EbeDBReader objects
+        for the most recently used databases, so that the database connection,
+        the lookup tables, the substitution rules and (when
+        "enableQueryCache" is True) the cached query results are reused by
+        later queries; the cache of each reader is limited to
+        "maximumQueryCacheRows" rows (see EbeDBReader.enableQueryCache). A
+        reader is created again when its database file has been modified or
+        replaced since the reader was created. All functions can be called
+        from several threads. For example:
+
+        pool = ReaderPool(4)
+        reader = pool.getReader("collected.db")
+        reader.evaluateExpressionOnly("v_2{2}(pion)")
+
+        A sqlite connection can only be used by the thread that opened it,
+        unless "shareBetweenThreads" is True; the readers must then be used
+        through useReader, which lets one thread at a time use a reader:
+
+        pool = ReaderPool(4, shareBetweenThreads=True)
+        with pool.useReader("collected.db") as reader:
+            reader.evaluateExpressionOnly("v_2{2}(pion)")
+    """
+
+    def __init__(self, maximumNumberOfReaders=8, enableQueryCache=False,
+                 shareBetweenThreads=False, maximumQueryCacheRows=1000000):
+        """
+            Start with an empty pool.
+        """
+        self.maximumNumberOfReaders = maximumNumberOfReaders
+        self.enableQueryCache = enableQueryCache
+        self.maximumQueryCacheRows = maximumQueryCacheRows
+        self.shareBetweenThreads = shareBetweenThreads
+        self._readers = OrderedDict() # path -> (file identity, reader, lock)
+        self._lock = threading.Lock()
+        self.statistics = {"hits": 0, "misses": 0, "reloads": 0,
+                           "evictions": 0}
+
+    def getReader(self, databaseFilename):
+        """
+            Return the EbeDBReader for the database file "databaseFilename",
+            creating it when it is not in the pool or when the file has
+            changed.
+        """
+        return self._getReaderAndLock(databaseFilename)[0]
+
+    @contextmanager
+    def useReader(self, databaseFilename):
+        """
+            Return a context manager giving the EbeDBReader for
+            "databaseFilename" (like getReader) and holding the lock of the
+            reader while it is used.
+        """
+        reader, lock = self._getReaderAndLock(databaseFilename)
+        with lock:
+            yield reader
+
+    def _getReaderAndLock(self, databaseFilename):
+        """
+            Return the EbeDBReader for "databaseFilename" and its lock.
+        """
+        databaseFilename = os.path.abspath(databaseFilename)
+        if not os.path.exists(databaseFilename):
+            raise ValueError("ReaderPool.getReader: %s " % databaseFilename
+                             + "is not an existing database file.")
+        fileIdentity = getFileIdentity(databaseFilename)
+        with self._lock:
+            if databaseFilename in self._readers:
+                entry = self._readers.pop(databaseFilename)
+                if entry[0] == fileIdentity:
+                    self.statistics["hits"] += 1
+                    self._readers[databaseFilename] = entry
+                    return entry[1:]
+                self.statistics["reloads"] += 1
+            else:
+                self.statistics["misses"] += 1
+            reader = EbeDBReader(SqliteDB(databaseFilename,
+                checkSameThread=not self.shareBetweenThreads))
+            if self.enableQueryCache:
+                reader.enableQueryCache(
+                    maximumNumberOfRows=self.maximumQueryCacheRows)
+            entry = (fileIdentity, reader, threading.Lock())
+            self._readers[databaseFilename] = entry
+            # readers that are dropped are closed when no longer used
+            while len(self._readers) > self.maximumNumberOfReaders:
+                self._readers.popitem(last=False)
+                self.statistics["evictions"] += 1
+            return entry[1:]
+
+    def discard(self, databaseFilename):
+        """
+            Remove the reader for "databaseFilename" from the pool; return
+            False if there is none.
+        """
+        with self._lock:
+            return self._readers.pop(os.path.abspath(databaseFilename),
+                                     None) is not None
+
+    def clear(self):
+        """
+            Remove all readers from the pool.
+        """
+        with self._lock:
+            self._readers.clear()
+
+    def getDatabaseFilenames(self):
+        """
+            Return the list of databases in the pool, from the least to the
+            most recently used.
+        """
+        with self._lock:
+            return list(self._readers.keys())
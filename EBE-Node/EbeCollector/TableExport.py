@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+    This module converts rows read from databases and arrays evaluated by the
+    EbeDBReader class into numpy columns, and from there into Arrow tables,
+    pandas DataFrames, and Parquet or Feather files.
+
+    The pyarrow and pandas packages are only imported when a function that
+    needs them is called, so the rest of the module (and the EbeCollector
+    module) can be used without them.
+"""
+
+import numpy as np
+
+def _requirePyarrow():
+    """
+        Import and return pyarrow, with a readable error if it is missing.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("TableExport: the pyarrow package is needed for "
+                          + "Arrow tables and Parquet/Feather files.")
+    return pyarrow
+
+def _requirePandas():
+    """
+        Import and return pandas, with a readable error if it is missing.
+    """
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("TableExport: the pandas package is needed for "
+                          + "DataFrames.")
+    return pandas
+
+def dtypeFromDeclaredType(declaredType):
+    """
+        Return the numpy dtype for a column declared with the SQL type
+        "declaredType", following the type affinity rules of sqlite; columns
+        without numerical affinity are stored as python objects.
+    """
+    declaredType = (declaredType or "").upper()
+    if "INT" in declaredType:
+        return np.dtype(np.int64)
+    if "REAL" in declaredType or "FLOA" in declaredType or "DOUB" in declaredType:
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+def rowsToColumns(rows, dtypes=None):
+    """
+        Convert a list of rows (tuples) into a list of contiguous numpy
+        arrays, one for each column. When "dtypes" is given the rows are
+        converted by numpy in one pass using a record array with these types;
+        when the conversion fails (e.g. for NULL values in an integer column)
+        or loses information (e.g. for REAL values stored in an integer
+        column, which sqlite allows), or when "dtypes" is not given, the type
+        of each column is inferred from its values instead.
+    """
+    if not rows:
+        return [np.zeros(0, aType) for aType in (dtypes or [])]
+    if dtypes:
+        recordType = [("f%d" % idx, aType) for idx, aType in enumerate(dtypes)]
+        try:
+            records = np.array(rows, dtype=recordType)
+            for idx, (aField, aType) in enumerate(recordType):
+                if np.dtype(aType).kind not in "iu": continue
+                asFloats = np.fromiter((aRow[idx] for aRow in rows),
+                                       np.float64, len(rows))
+                if not np.array_equal(records[aField], asFloats):
+                    raise ValueError("lossy conversion to integers")
+            return [np.ascontiguousarray(records[aField])
+                    for aField, _ in recordType]
+        except (TypeError, ValueError, OverflowError):
+            pass # fall back to inferring the types
+    columns = []
+    for aColumn in zip(*rows):
+        aColumn = np.array(aColumn)
+        if aColumn.dtype.kind in "US": aColumn = aColumn.astype(object)
+        columns.append(aColumn)
+    return columns
+
+def arraysToColumns(names, arrays):
+    """
+        Flatten per-event arrays into columns that Arrow and pandas can hold.
+        The first axis of each array in "arrays" runs over the events; complex
+        arrays are split into "name_real" and "name_imag" columns, and arrays
+        with more than one value per event are split into "name[i]" columns
+        (with i running over the flattened remaining axes). Return the list of
+        column names and the list of columns.
+    """
+    columnNames = []
+    columns = []
+    for name, anArray in zip(names, arrays):
+        anArray = np.asarray(anArray)
+        if anArray.ndim == 0:
+            raise ValueError("TableExport.arraysToColumns: %s does not have "
+                             % name + "one value per event.")
+        if np.iscomplexobj(anArray):
+            parts = [(name+"_real", anArray.real), (name+"_imag", anArray.imag)]
+        else:
+            parts = [(name, anArray)]
+        for partName, aPart in parts:
+            aPart = aPart.reshape(aPart.shape[0], -1)
+            if aPart.shape[1] == 1:
+                columnNames.append(partName)
+                columns.append(np.ascontiguousarray(aPart[:, 0]))
+            else:
+                for idx in range(aPart.shape[1]):
+                    columnNames.append("%s[%d]" % (partName, idx))
+                    columns.append(np.ascontiguousarray(aPart[:, idx]))
+    return columnNames, columns
+
+def columnsToArrowTable(names, columns, schema=None):
+    """
+        Return an Arrow table with the given column names and numpy columns.
+        Numerical columns are shared with numpy without copying. When
+        "schema" is given the columns are converted to its types.
+    """
+    pyarrow = _requirePyarrow()
+    if schema is None:
+        return pyarrow.Table.from_arrays(
+            [pyarrow.array(aColumn) for aColumn in columns], names=list(names))
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(aColumn, type=aField.type)
+         for aColumn, aField in zip(columns, schema)], schema=schema)
+
+def columnsToDataFrame(names, columns):
+    """
+        Return a pandas DataFrame with the given column names and numpy
+        columns.
+    """
+    pandas = _requirePandas()
+    return pandas.DataFrame(dict(zip(names, columns)), columns=list(names))
+
+def arrowSchemaFromDtypes(names, dtypes):
+    """
+        Return an Arrow schema for columns with the given names and numpy
+        dtypes; columns of python objects are taken to be strings.
+    """
+    pyarrow = _requirePyarrow()
+    fields = []
+    for name, aType in zip(names, dtypes):
+        if np.dtype(aType) == np.dtype(object):
+            fields.append(pyarrow.field(name, pyarrow.string()))
+        else:
+            fields.append(pyarrow.field(name, pyarrow.from_numpy_dtype(aType)))
+    return pyarrow.schema(fields)
+
+class TableWriter(object):
+    """
+        This class writes columns batch by batch into a Parquet file (when
+        the filename ends with ".parquet" or ".pq") or a Feather (Arrow IPC)
+        file (when the filename ends with ".feather" or ".arrow"), so that
+        tables larger than the memory can be written. The schema is fixed by
+        the first batch written, or by the "schema" argument. For example:
+
+        with TableWriter("spectra.parquet") as writer:
+            for names, columns in reader.iterateTableColumns("spectra"):
+                writer.write(names, columns)
+    """
+    fileFormats = {
+        ".parquet": "parquet", ".pq": "parquet",
+        ".feather": "feather", ".arrow": "feather",
+    }
+
+    def __init__(self, filename, schema=None):
+        """
+            Register the output file "filename"; the file is created when the
+            first batch is written.
+        """
+        self.filename = filename
+        self.fileFormat = None
+        for anExtension, aFormat in self.fileFormats.items():
+            if filename.lower().endswith(anExtension):
+                self.fileFormat = aFormat
+        if not self.fileFormat:
+            raise ValueError("TableWriter.__init__: the filename must end "
+                             + "with one of %s." % ", ".join(
+                                 sorted(self.fileFormats.keys())))
+        self.pyarrow = _requirePyarrow()
+        self.schema = schema
+        self._writer = None
+        self.numberOfRows = 0
+
+    def _openWriter(self):
+        """
+            Create the output file with the current schema.
+        """
+        if self.fileFormat == "parquet":
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(self.filename,
+                                                         self.schema)
+        else:
+            self._writer = self.pyarrow.ipc.new_file(self.filename,
+                                                     self.schema)
+
+    def write(self, names, columns):
+        """
+            Append the numpy "columns" with names "names" to the file. Before
+            the file is created, integer fields of the schema are changed to
+            float64 when their column holds floats (see rowsToColumns).
+        """
+        if self._writer is None and self.schema is not None:
+            for idx, aColumn in enumerate(columns):
+                if (self.pyarrow.types.is_integer(self.schema.field(idx).type)
+                    and np.asarray(aColumn).dtype.kind == "f"):
+                    self.schema = self.schema.set(idx, self.pyarrow.field(
+                        self.schema.field(idx).name, self.pyarrow.float64()))
+        table = columnsToArrowTable(names, columns, self.schema)
+        if self._writer is None:
+            self.schema = table.schema
+            self._openWriter()
+        self._writer.write_table(table)
+        self.numberOfRows += table.num_rows
+
+    def close(self):
+        """
+            Finish the file. A file with no rows written is still created when
+            the schema is known.
+        """
+        if self._writer is None and self.schema is not None:
+            self._openWriter()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+    Compare the time used to evaluate expressions for a narrow selection of
+    events, by either reading all the events and masking the results, or by
+    passing the selection to EbeDBReader so that only the selected events are
+    read from the database.
+
+    Usage:
+    benchmarkEventSelection.py database_filename "predicate" "expression" ...
+    For example:
+    benchmarkEventSelection.py collected.db "Npart>=350" "v_2(pion)" "e_2(ed)"
+
+    Each expression should give one value per event. The database should have
+    the event_id indices (see EbeCollector.createEventIdIndices) for the
+    selection to be effective.
+"""
+
+from sys import argv, exit
+from time import time
+import numpy as np
+from EbeCollector import EbeDBReader
+
+if __name__ == '__main__':
+    try:
+        databaseFilename = argv[1]
+        predicate = argv[2]
+        expressions = argv[3:]
+        if not expressions: raise ValueError()
+    except:
+        print("Usage: benchmarkEventSelection.py database_filename \"predicate\" \"expression\" ...")
+        exit(-1)
+
+    reader = EbeDBReader(databaseFilename)
+    reader.setEventSelection(predicate)
+    selectedEventIds = set(reader.getEventIds())
+    reader.setEventSelection()
+    print("Selected {} events out of {} with: {}".format(
+        len(selectedEventIds), reader.getNumberOfEvents(), predicate))
+    print("{:<30}{:>15}{:>15}{:>10}".format(
+        "Expression", "Masked (s)", "Selected (s)", "Speedup"))
+
+    for expression in expressions:
+        # read all events, then mask
+        startTime = time()
+        isSelected = np.array([eventId in selectedEventIds
+                               for eventId in reader.getEventIds()])
+        maskedValues = reader.evaluateExpressionOnly(expression)[isSelected]
+        maskedTime = time() - startTime
+        # read only the selected events
+        startTime = time()
+        selectedValues = reader.evaluateExpressionOnly(expression, predicate)
+        selectedTime = time() - startTime
+        if not np.allclose(maskedValues, selectedValues):
+            print("Results differ for {}!".format(expression))
+        print("{:<30}{:>15.4f}{:>15.4f}{:>10.1f}".format(
+            expression, maskedTime, selectedTime, maskedTime/selectedTime))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+    Compare the time used to write out all tables of a database as text files
+    with the unpackDatabase function of SqliteDB, and as Parquet and Feather
+    files with the exportDatabase function of EbeDBReader, and the time used to
+    read each of them back into columns.
+
+    Usage:
+    benchmarkExport.py database_filename [output_folder]
+
+    The files are written into sub-folders "text", "parquet" and "feather" of
+    the output folder (a temporary folder by default), which are removed at
+    the end. The pyarrow package is needed.
+"""
+
+from sys import argv, exit
+from os import path, mkdir, listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+import numpy as np
+from DBR import SqliteDB
+from EbeCollector import EbeDBReader
+
+def folderSize(folder):
+    """
+        Return the total size of the files in "folder" in MB.
+    """
+    return sum([path.getsize(path.join(folder, aFile))
+                for aFile in listdir(folder)])/1024.0**2
+
+if __name__ == '__main__':
+    try:
+        databaseFilename = argv[1]
+        outputFolder = argv[2] if len(argv) > 2 else mkdtemp()
+    except:
+        print("Usage: benchmarkExport.py database_filename [output_folder]")
+        exit(-1)
+
+    import pyarrow.parquet
+    import pyarrow.feather
+    reader = EbeDBReader(databaseFilename)
+    tableNames = reader.db.getAllTableNames()
+    numberOfRows = sum([reader.db.selectFromTable(aTable, "count()")[0][0]
+                        for aTable in tableNames])
+    print("{} tables with {} rows in total".format(len(tableNames),
+                                                   numberOfRows))
+    print("{:<10}{:>12}{:>12}{:>15}{:>12}".format(
+        "Format", "Write (s)", "Size (MB)", "Rows/s", "Read (s)"))
+
+    folders = {}
+    for aFormat in ("text", "parquet", "feather"):
+        folders[aFormat] = path.join(outputFolder, aFormat)
+        if not path.exists(folders[aFormat]): mkdir(folders[aFormat])
+
+    # write
+    writeTimes = {}
+    startTime = time()
+    SqliteDB(databaseFilename).unpackDatabase(writeToFolder=folders["text"])
+    writeTimes["text"] = time() - startTime
+    for aFormat in ("parquet", "feather"):
+        startTime = time()
+        reader.exportDatabase(folders[aFormat], "."+aFormat)
+        writeTimes[aFormat] = time() - startTime
+
+    # read back as columns
+    readTimes = {}
+    startTime = time()
+    for aTable in tableNames:
+        textFile = path.join(folders["text"], aTable+".dat")
+        if path.getsize(textFile) > len(open(textFile).readline()):
+            np.genfromtxt(textFile, dtype=None, encoding=None)
+    readTimes["text"] = time() - startTime
+    startTime = time()
+    for aTable in tableNames:
+        pyarrow.parquet.read_table(path.join(folders["parquet"],
+                                             aTable+".parquet"))
+    readTimes["parquet"] = time() - startTime
+    startTime = time()
+    for aTable in tableNames:
+        pyarrow.feather.read_table(path.join(folders["feather"],
+                                             aTable+".feather"))
+    readTimes["feather"] = time() - startTime
+
+    for aFormat in ("text", "parquet", "feather"):
+        print("{:<10}{:>12.3f}{:>12.1f}{:>15.0f}{:>12.3f}".format(aFormat,
+            writeTimes[aFormat], folderSize(folders[aFormat]),
+            numberOfRows/writeTimes[aFormat], readTimes[aFormat]))
+
+    for aFolder in folders.values():
+        rmtree(aFolder)
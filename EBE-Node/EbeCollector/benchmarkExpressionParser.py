@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+    Compare the time used to translate expressions by the ExpressionParser
+    and by the substitution rules of EbeDBReader, for generated expressions of
+    increasing length, and check that both give the same translations.
+
+    Usage:
+    benchmarkExpressionParser.py database_filename [maximum_number_of_terms]
+
+    The database is only used to create the EbeDBReader; nothing is read from
+    it. Each expression is a sum of means and cumulants of randomly chosen uhg
+    symbols.
+"""
+
+from sys import argv, exit
+from time import time
+import random
+from EbeCollector import EbeDBReader
+from ExpressionParser import ExpressionParser
+
+# symbol templates; "{n}", "{m}" and "{p}" are replaced by random harmonic
+# orders, powers of r and pT values so that the terms are mostly distinct
+complexSymbols = [
+    "V_{n}(pion)", "E_{{{m},{n}}}(e)", "Psi_{n}(total)", "Phi_{n}(s)",
+    "dN/dy(pion)", "dN(kaon)", "{{R^{m}}}(e)", "[r^{m}](sd)",
+    "V_{n}(linspace(0,{p},5))(kaon)", "dN/dydpT([0,{p}])(total)",
+]
+symbols = complexSymbols + [
+    "lifetime", "v_{n}(kaon)", "ecc_{n}(ed)", "v_{n}({p})(pion)",
+    "|V|_{n}(pion)", "epsilon_{{{n}}}(s)",
+]
+cumulants = ["v_{n}[2](pion)", "e_{n}[4](ed)", "v_{n}[2]({p})(kaon)",
+             "e_{n}[2](e)"]
+
+def generateExpression(numberOfTerms, randomGenerator):
+    """
+        Return an expression with "numberOfTerms" terms.
+    """
+    def choose(templates):
+        return randomGenerator.choice(templates).format(
+            n=randomGenerator.randint(1, 9), m=randomGenerator.randint(0, 9),
+            p=round(randomGenerator.uniform(0.1, 3), 2))
+    terms = []
+    for idx in range(numberOfTerms):
+        choice = randomGenerator.random()
+        if choice < 0.2:
+            terms.append(choose(cumulants))
+        elif choice < 0.6:
+            terms.append("<%s*%s>" % (choose(symbols), choose(symbols)))
+        else:
+            # the substitution rules do not understand |v_n|, |lifetime|, etc.
+            terms.append("sqrt(<|%s|**2>)" % choose(complexSymbols))
+    return "+".join(terms)
+
+if __name__ == '__main__':
+    try:
+        reader = EbeDBReader(argv[1])
+        maximumNumberOfTerms = int(argv[2]) if len(argv) > 2 else 100
+    except:
+        print("Usage: benchmarkExpressionParser.py database_filename [maximum_number_of_terms]")
+        exit(-1)
+
+    randomGenerator = random.Random(0)
+    parser = ExpressionParser()
+    print("{:>8}{:>12}{:>15}{:>15}{:>10}".format("Terms", "Length",
+        "Rules (ms)", "Parser (ms)", "Speedup"))
+    numberOfTerms = 1
+    while numberOfTerms <= maximumNumberOfTerms:
+        expressions = [generateExpression(numberOfTerms, randomGenerator)
+                       for idx in range(5)]
+        startTime = time()
+        byRules = [reader._translateExpressionWithRules(anExpression)
+                   for anExpression in expressions]
+        rulesTime = (time() - startTime)/len(expressions)
+        startTime = time()
+        byParser = [parser.translate(anExpression)
+                    for anExpression in expressions]
+        parserTime = (time() - startTime)/len(expressions)
+        numberOfDifferences = 0
+        for anExpression, fromRules, fromParser in zip(expressions, byRules,
+                                                       byParser):
+            if fromRules != fromParser:
+                numberOfDifferences += 1
+                if numberOfDifferences == 1:
+                    print("Translations differ for {}:\n{}\n{}".format(
+                          anExpression, fromRules, fromParser))
+        print("{:>8}{:>12}{:>15.2f}{:>15.2f}{:>10.1f}".format(numberOfTerms,
+            sum([len(anExpression) for anExpression in expressions])
+            // len(expressions), 1000*rulesTime, 1000*parserTime,
+            rulesTime/parserTime))
+        if numberOfDifferences:
+            print("{} of {} translations differ".format(numberOfDifferences,
+                                                        len(expressions)))
+        numberOfTerms *= 2
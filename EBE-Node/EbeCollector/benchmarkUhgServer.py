@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+    Compare the time used per expression by cold uhg.py invocations, by
+    uhgClient.py invocations served by a running uhg server, and by queries
+    sent to the server from within python (without starting an interpreter).
+
+    Usage:
+    benchmarkUhgServer.py database_filename "expression" [repetitions]
+
+    A server is started on a temporary socket for the benchmark and stopped
+    at the end.
+"""
+
+from sys import argv, exit, executable
+from os import path, devnull
+from subprocess import call
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import uhgClient
+
+def timeCommand(command, repetitions):
+    """
+        Return the times used by running "command" "repetitions" times.
+    """
+    output = open(devnull, "w")
+    times = []
+    for idx in range(repetitions):
+        startTime = time()
+        call(command, stdout=output)
+        times.append(time() - startTime)
+    output.close()
+    return times
+
+if __name__ == '__main__':
+    try:
+        databaseFilename = path.abspath(argv[1])
+        expression = argv[2]
+        repetitions = int(argv[3]) if len(argv) > 3 else 10
+    except:
+        print("Usage: benchmarkUhgServer.py database_filename \"expression\" [repetitions]")
+        exit(-1)
+
+    here = path.dirname(path.abspath(__file__))
+    socketFolder = mkdtemp()
+    socketFilename = path.join(socketFolder, "uhg.sock")
+    try:
+        times = {}
+        times["uhg.py (cold)"] = timeCommand([executable,
+            path.join(here, "uhg.py"), databaseFilename, expression],
+            repetitions)
+        startTime = time()
+        uhgClient.startServer(socketFilename)
+        request = {"command": "evaluate", "database": databaseFilename,
+                   "expression": expression}
+        response = uhgClient.query(request, socketFilename)
+        times["first query to server"] = [time() - startTime]
+        if "error" in response: print("Error: " + response["error"])
+        times["uhgClient.py"] = timeCommand([executable,
+            path.join(here, "uhgClient.py"), "--socket=" + socketFilename,
+            databaseFilename, expression], repetitions)
+        queryTimes = []
+        for idx in range(repetitions):
+            startTime = time()
+            uhgClient.query(request, socketFilename)
+            queryTimes.append(time() - startTime)
+        times["uhgClient.query"] = queryTimes
+        uhgClient.query({"command": "stop"}, socketFilename)
+    finally:
+        rmtree(socketFolder)
+
+    print("Latency per expression for {} ({} repetitions)".format(
+        expression, repetitions))
+    print("{:<25}{:>12}{:>12}".format("", "Mean (ms)", "Min (ms)"))
+    for aName in ("uhg.py (cold)", "first query to server", "uhgClient.py",
+                  "uhgClient.query"):
+        print("{:<25}{:>12.1f}{:>12.1f}".format(aName,
+            1000*sum(times[aName])/len(times[aName]), 1000*min(times[aName])))
@@ -14,14 +14,41 @@
     In the interactive mode use the "use" function to connect to a database, use
     "h" function to print out a short help, and use the "e" function to evaluate
     an expression.
+
+    To evaluate many expressions in one run, put them in a file, one
+    "name = expression" per line, and use the batch mode, for example:
+    uhg.py database_filename --batch expressions.txt results.json
+    The results are written in the JSON format, or in the numpy NPZ format if
+    the output filename ends with ".npz".
+
+    To evaluate the same expressions on many databases in parallel, use the
+    sweep mode, for example:
+    uhg.py --sweep expressions.txt results.tsv run1/collected.db run2/collected.db
+    Each database is evaluated by a separate process; add "--processes=N" to
+    set the number of processes. The results are appended to a tab-separated
+    table as soon as each database is done.
+
+    For many single evaluations from scripts, use uhgClient.py instead of
+    uhg.py with the same arguments, for example:
+    uhgClient.py database_filename "e_2(ed)"
+    The expressions are then evaluated by a uhg server (see uhgServer.py)
+    which keeps recently used databases open between calls, so each call
+    avoids importing numpy and opening the database. The server is started
+    when needed and exits after being idle for 10 minutes.
     
 """
 from numpy import *
 from EbeCollector import EbeDBReader
+import json
+import re
+import time
+from os import path, getpid, kill
 
 _storedEbeDBReader = None
 
 e = lambda s: _storedEbeDBReader.evaluateExpressionOnly(s)
+ec = lambda s, numberOfEventsPerChunk=1000: _storedEbeDBReader.evaluateExpressionChunked(s, numberOfEventsPerChunk)[0]
+ea = lambda s, relativePrecision=0.01, timeBudget=60.0: _storedEbeDBReader.evaluateExpressionSampled(s, relativePrecision, timeBudget)
 
 def use(database):
     """
@@ -42,6 +69,235 @@ def info():
     for aParticle, numberOfEvents in _storedEbeDBReader.getAttendance():
         if numberOfEvents>0: print("\t{:<30}{:^20}".format(aParticle, numberOfEvents))
 
+_namedExpressionPattern = re.compile(r"^\s*([\w.\[\]{}]+)\s*=(?!=)")
+
+def readExpressionFile(filename):
+    """
+        Return a list of (name, expression) from the file "filename", in which
+        each line has the form "name = expression". Empty lines and strings
+        after "#" are ignored; a line that does not start with a plain name
+        followed by a single "=" (so "==", "<=" and ">=" in an expression do
+        not count) uses the expression itself as its name.
+    """
+    namedExpressions = []
+    for aLine in open(filename):
+        aLine = aLine.split("#")[0].strip()
+        if not aLine: continue
+        match = _namedExpressionPattern.match(aLine)
+        if match:
+            namedExpressions.append((match.group(1), aLine[match.end():].strip()))
+        else:
+            namedExpressions.append((aLine, aLine))
+    return namedExpressions
+
+def batch(namedExpressions):
+    """
+        Evaluate a list of (name, expression) using the database selected by
+        the "use" function, sharing the cached queries between the
+        expressions. Return a list of (name, expression, value, seconds used);
+        the value is None for expressions that fail to evaluate.
+    """
+    global _storedEbeDBReader
+    _storedEbeDBReader.enableQueryCache()
+    results = []
+    try:
+        for name, expression in namedExpressions:
+            startTime = time.time()
+            value = e(expression)
+            results.append((name, expression, value, time.time()-startTime))
+    finally:
+        _storedEbeDBReader.enableQueryCache(False)
+    return results
+
+def _toJSONValue(value):
+    """
+        Convert "value" to a form that can be written by json; complex numbers
+        are written as [real, imag].
+    """
+    if value is None: return None
+    value = asarray(value)
+    if iscomplexobj(value):
+        return dstack((value.real, value.imag)).reshape(
+                                                value.shape+(2,)).tolist()
+    return value.tolist()
+
+def writeBatchResults(results, filename):
+    """
+        Write the results from the "batch" function to the file "filename",
+        in the NPZ format if "filename" ends with ".npz", and in the JSON
+        format otherwise. In the NPZ file the value and the seconds used for
+        the expression with name "x" are stored as "x" and "x_seconds"; the
+        names are stored as "names" and the expressions as "expressions".
+    """
+    if filename.endswith(".npz"):
+        arrays = {"names": array([item[0] for item in results]),
+                  "expressions": array([item[1] for item in results])}
+        for name, expression, value, seconds in results:
+            arrays[name] = asarray(nan if value is None else value)
+            arrays[name+"_seconds"] = asarray(seconds)
+        savez(filename, **arrays)
+    else:
+        json.dump([{"name": name, "expression": expression,
+                    "value": _toJSONValue(value), "seconds": seconds}
+                   for name, expression, value, seconds in results],
+                  open(filename, "w"), indent=1)
+
+# set in the processes of the "sweep" pool, see _sweepOneDatabase
+_sweepStartQueue = None
+
+def _initializeSweepWorker(startQueue):
+    global _sweepStartQueue
+    _sweepStartQueue = startQueue
+
+def _isProcessAlive(pid):
+    try:
+        kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def _sweepOneDatabase(task):
+    """
+        Worker for the "sweep" function: evaluate the list of (name,
+        expression) on one database in the current process, after telling the
+        sweep which process evaluates it. Errors are caught and returned so
+        that a failing database does not stop the others.
+        Return (database filename, results from "batch", seconds used, error).
+    """
+    databaseFilename, namedExpressions = task
+    if _sweepStartQueue is not None:
+        _sweepStartQueue.put((databaseFilename, getpid()))
+    startTime = time.time()
+    try:
+        use(databaseFilename)
+        results = batch(namedExpressions)
+        error = ""
+    except Exception as anError:
+        results = []
+        error = "{}: {}".format(type(anError).__name__, anError)
+    return databaseFilename, results, time.time()-startTime, error
+
+def sweep(databaseFilenames, namedExpressions, outputFilename,
+          numberOfProcesses=None):
+    """
+        Evaluate a list of (name, expression) on every database in the list
+        "databaseFilenames" using a pool of "numberOfProcesses" processes (the
+        number of CPUs by default), each process with its own EbeDBReader.
+
+        The results are appended to the tab-separated table "outputFilename"
+        as soon as each database is done, one row per database and
+        expression, with the columns: database, name, expression, value (in
+        JSON), seconds, database_seconds, error. A database that fails as a
+        whole gets one row with an empty name and the error, also when the
+        process evaluating it dies (e.g. killed for using too much memory).
+        Databases that already have results for all the expressions in the
+        table are skipped, so an interrupted sweep can be continued by running
+        it again.
+
+        Return the list of databases that failed.
+    """
+    import multiprocessing
+    try:
+        from queue import Empty
+    except ImportError:
+        from Queue import Empty
+    names = set(name for name, expression in namedExpressions)
+    evaluatedNames = {}
+    if path.exists(outputFilename):
+        content = open(outputFilename).read()
+        completeContent = content[:content.rfind("\n")+1]
+        if len(completeContent) < len(content):
+            # drop the last line, written in part by an interrupted sweep
+            output = open(outputFilename, "r+")
+            output.truncate(len(completeContent))
+            output.close()
+        for aLine in completeContent.splitlines():
+            fields = aLine.split("\t")
+            if len(fields) < 7 or fields[0] == "database": continue
+            if fields[1]:
+                evaluatedNames.setdefault(fields[0], set()).add(fields[1])
+    else:
+        open(outputFilename, "w").write("\t".join(("database", "name",
+            "expression", "value", "seconds", "database_seconds",
+            "error")) + "\n")
+    finishedDatabases = set(aDatabase for aDatabase in evaluatedNames
+                            if names <= evaluatedNames[aDatabase])
+    tasks = [(aDatabase, namedExpressions) for aDatabase in databaseFilenames
+             if aDatabase not in finishedDatabases]
+    failedDatabases = []
+    startQueue = multiprocessing.Queue()
+    pool = multiprocessing.Pool(numberOfProcesses, _initializeSweepWorker,
+                                (startQueue,))
+    lostDatabases = False
+    try:
+        pending = [(aTask[0], pool.apply_async(_sweepOneDatabase, (aTask,)))
+                   for aTask in tasks]
+        workers = {}  # database -> process evaluating it
+        deathTimes = {}  # database -> time its process was found dead
+        while pending:
+            while True:
+                try:
+                    databaseFilename, pid = startQueue.get(False)
+                except Empty:
+                    break
+                workers[databaseFilename] = pid
+            stillPending = []
+            for databaseFilename, aResult in pending:
+                if aResult.ready():
+                    rows = _getSweepRows(aResult.get(), failedDatabases)
+                elif (databaseFilename in workers
+                      and not _isProcessAlive(workers[databaseFilename])):
+                    # the process was killed (e.g. out of memory); its result
+                    # never comes, so it is given up after a short grace
+                    # period in which a result sent just before can arrive
+                    deathTime = deathTimes.setdefault(databaseFilename,
+                                                      time.time())
+                    if time.time() - deathTime < 2.0:
+                        stillPending.append((databaseFilename, aResult))
+                        continue
+                    lostDatabases = True
+                    rows = _getSweepRows((databaseFilename, [], 0,
+                        "the process evaluating the database died"),
+                        failedDatabases)
+                else:
+                    stillPending.append((databaseFilename, aResult))
+                    continue
+                output = open(outputFilename, "a")
+                output.writelines("\t".join(map(str, aRow)) + "\n"
+                                  for aRow in rows)
+                output.close()
+            if len(stillPending) == len(pending):
+                time.sleep(0.2)
+            pending = stillPending
+        if lostDatabases:
+            pool.terminate()  # the pool still waits for the lost results
+        else:
+            pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failedDatabases
+
+def _getSweepRows(result, failedDatabases):
+    """
+        Return the rows of the sweep table for the result of
+        _sweepOneDatabase, adding the database to "failedDatabases" if it
+        failed as a whole.
+    """
+    databaseFilename, results, databaseSeconds, error = result
+    if error:
+        failedDatabases.append(databaseFilename)
+        print("Failed {}: {}".format(databaseFilename, error))
+        return [(databaseFilename, "", "", "null", 0, databaseSeconds, error)]
+    print("Finished {} in {:.2f} seconds".format(databaseFilename,
+                                                databaseSeconds))
+    return [(databaseFilename, name, expression,
+             json.dumps(_toJSONValue(value)), seconds, databaseSeconds,
+             "" if value is not None else "evaluation failed")
+            for name, expression, value, seconds in results]
+
 def h():
     """
         Display a short help message.
@@ -60,7 +316,9 @@ def h():
     V_{n}(pT)(pion), v_n([pT1, pT2, ...])(kaon), Psi_n(pT)(pion), dN/(dydpT)(total),
     v_n[2](pion), e_n[4](ed), <symbol>, |symbol|
     
-5) Some concrete examples:
+5) For large databases use "ec(expression)" instead, which reads 1000 events at a time; every per-event symbol must then be inside a mean "<...>".
+6) For a quick estimate use "ea(expression, relativePrecision=0.01, timeBudget=60)", which evaluates on a growing random sample of events until the requested relative precision or time budget is reached, and returns (estimate, error, number of events used).
+7) Some concrete examples:
     
     E_2(s), e_{3,1}(e), ecc_3(ed), Phi_2(e),
     V_2(pion), v_3(kaon), Psi_4(total), N(total),
@@ -72,14 +330,33 @@ Enjoy!
           """)
 
 if __name__ == '__main__':
-    from sys import argv
+    from sys import argv, exit
+    if len(argv) > 4 and argv[1] == "--sweep":
+        numberOfProcesses = None
+        databaseFilenames = []
+        for anArgument in argv[4:]:
+            if anArgument.startswith("--processes="):
+                numberOfProcesses = int(anArgument.split("=")[1])
+            else:
+                databaseFilenames.append(anArgument)
+        sweep(databaseFilenames, readExpressionFile(argv[2]), argv[3],
+              numberOfProcesses)
+        exit()
     try:
         databaseFilename = argv[1]
         use(databaseFilename)
-        expr = " ".join(argv[2:])
-        if not expr: raise ValueError()
-        print(e(expr))
+        if argv[2] == "--batch":
+            results = batch(readExpressionFile(argv[3]))
+            writeBatchResults(results, argv[4])
+            for name, expression, value, seconds in results:
+                if value is None: print("Failed to evaluate {}: {}".format(name, expression))
+        else:
+            expr = " ".join(argv[2:])
+            if not expr: raise ValueError()
+            print(e(expr))
     except:
         print("Usage: uhg.py database_filename 'symbols to be evaluated'")
+        print("   or: uhg.py database_filename --batch expression_file output.json|output.npz")
+        print("   or: uhg.py --sweep expression_file output.tsv database_filename ... [--processes=N]")
 else:
     h()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+    This module is a thin client for the uhg query server (see uhgServer.py).
+    It has the same command line syntax as uhg.py, for example:
+    uhgClient.py database_filename "e_2(ed)"
+    uhgClient.py database_filename --batch expressions.txt results.json
+
+    The expressions are evaluated by a server process that keeps the readers
+    of recently used databases open, so only the first query of a database
+    pays for opening it; the server is started automatically when it is not
+    running, and exits by itself after being idle for a while. Use
+    uhgClient.py --status
+    to list the databases held by the server, and
+    uhgClient.py --stop
+    to stop it. Add "--socket=filename" to use a server listening on another
+    socket, and "--idle-timeout=seconds" to set the idle timeout of a server
+    that is started by the client.
+
+    This module does not import numpy so that it starts quickly.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+def getDefaultSocketFilename():
+    """
+        Return the socket used by default: the value of the UHG_SOCKET
+        environment variable, or "uhg-<user id>.sock" in the temporary folder.
+    """
+    return os.environ.get("UHG_SOCKET", path.join(tempfile.gettempdir(),
+                                                  "uhg-%d.sock" % os.getuid()))
+
+def query(request, socketFilename=None, timeout=None):
+    """
+        Send the dictionary "request" to the server listening on
+        "socketFilename" and return its response as a dictionary. Raise
+        socket.error when no server is listening.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socketFilename or getDefaultSocketFilename())
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        response = []
+        while True:
+            data = connection.recv(65536)
+            if not data: break
+            response.append(data)
+    finally:
+        connection.close()
+    return json.loads(b"".join(response).decode("utf-8"))
+
+def isServerRunning(socketFilename=None):
+    """
+        Return True if a server answers on "socketFilename".
+    """
+    try:
+        return "error" not in query({"command": "ping"}, socketFilename, 5.0)
+    except (socket.error, ValueError):
+        return False
+
+def startServer(socketFilename=None, idleTimeout=None, waitFor=30.0):
+    """
+        Start a server on "socketFilename" in the background, detached from
+        the current process, and wait up to "waitFor" seconds until it
+        answers. Return True when the server is running.
+    """
+    socketFilename = socketFilename or getDefaultSocketFilename()
+    command = [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+               "uhgServer.py"), "--socket=" + socketFilename]
+    if idleTimeout is not None:
+        command.append("--idle-timeout=%g" % idleTimeout)
+    devnull = open(os.devnull, "r+")
+    subprocess.Popen(command, stdin=devnull, stdout=devnull, stderr=devnull,
+                     close_fds=True, preexec_fn=os.setsid)
+    devnull.close()
+    startTime = time.time()
+    while time.time() - startTime < waitFor:
+        if isServerRunning(socketFilename): return True
+        time.sleep(0.05)
+    return False
+
+def queryOrStartServer(request, socketFilename=None, idleTimeout=None):
+    """
+        Send "request" to the server, starting the server first if it is not
+        running. Return the response.
+    """
+    try:
+        return query(request, socketFilename)
+    except socket.error:
+        if not startServer(socketFilename, idleTimeout):
+            raise RuntimeError("uhgClient: cannot start the uhg server.")
+        return query(request, socketFilename)
+
+if __name__ == '__main__':
+    socketFilename = None
+    idleTimeout = None
+    arguments = []
+    for anArgument in sys.argv[1:]:
+        if anArgument.startswith("--socket="):
+            socketFilename = anArgument.split("=", 1)[1]
+        elif anArgument.startswith("--idle-timeout="):
+            idleTimeout = float(anArgument.split("=", 1)[1])
+        else:
+            arguments.append(anArgument)
+
+    if arguments in (["--status"], ["--stop"]):
+        if not isServerRunning(socketFilename):
+            print("The uhg server is not running.")
+            sys.exit()
+        response = query({"command": arguments[0][2:]}, socketFilename)
+        print(response.get("output", ""))
+        sys.exit()
+
+    try:
+        databaseFilename = path.abspath(arguments[0])
+        if arguments[1] == "--batch":
+            request = {"command": "batch", "database": databaseFilename,
+                       "expressionFile": path.abspath(arguments[2]),
+                       "outputFile": path.abspath(arguments[3])}
+        else:
+            expression = " ".join(arguments[1:])
+            if not expression: raise ValueError()
+            request = {"command": "evaluate", "database": databaseFilename,
+                       "expression": expression}
+    except:
+        print("Usage: uhgClient.py database_filename 'symbols to be evaluated'")
+        print("   or: uhgClient.py database_filename --batch expression_file output.json|output.npz")
+        print("   or: uhgClient.py --status|--stop")
+        print("Options: --socket=filename --idle-timeout=seconds")
+        sys.exit(-1)
+
+    response = queryOrStartServer(request, socketFilename, idleTimeout)
+    if "error" in response:
+        print("Error: " + response["error"])
+        sys.exit(1)
+    if response.get("output"): print(response["output"])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+    This module implements a local query server for uhg, which keeps the
+    EbeDBReader objects of recently used databases (with their lookup tables,
+    substitution rules and cached queries) in memory between queries. It
+    listens on a Unix socket and is normally started by uhgClient.py when
+    needed, but it can also be started by hand, for example:
+    uhgServer.py --socket=/tmp/uhg.sock --idle-timeout=600
+
+    Options:
+    --socket=filename: the socket to listen on; see
+        uhgClient.getDefaultSocketFilename for the default.
+    --idle-timeout=seconds: exit after this many seconds without a query
+        (600 by default).
+    --readers=N: the number of databases kept open (8 by default).
+    --no-query-cache: do not cache query results in the readers.
+    --query-cache-rows=N: the number of rows of query results cached by each
+        reader; the least recently used results are dropped beyond it
+        (1000000 by default).
+
+    A database that is modified or replaced is opened again at its next query.
+
+    Each connection carries one request and one response, each a JSON object
+    on one line. A request has a "command", one of:
+    "evaluate" (with "database" and "expression"), "batch" (with "database",
+    "expressionFile" and "outputFile"), "status", "ping" and "stop". The
+    response has the printed output as "output", the value (for "evaluate")
+    in the JSON form used by uhg.py as "value", or the reason of a failure as
+    "error".
+"""
+
+import json
+import os
+import sys
+import time
+from os import path
+try:
+    import socketserver
+except ImportError: # python 2
+    import SocketServer as socketserver
+from ReaderPool import ReaderPool
+from uhgClient import getDefaultSocketFilename, isServerRunning
+
+_stdout = sys.stdout
+sys.stdout = open(os.devnull, "w") # uhg prints its help message when imported
+try:
+    import uhg
+finally:
+    sys.stdout.close()
+    sys.stdout = _stdout
+
+class UhgRequestHandler(socketserver.StreamRequestHandler):
+    """
+        Read one request from a connection and write back the response.
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.respond(request)
+        except Exception as anError:
+            response = {"error": "{}: {}".format(type(anError).__name__,
+                                                 anError)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+        self.server.lastRequestTime = time.time()
+
+class UhgServer(socketserver.UnixStreamServer):
+    """
+        This class serves uhg queries on a Unix socket until it has been idle
+        for "idleTimeout" seconds or is asked to stop. Requests are served one
+        at a time.
+    """
+    def __init__(self, socketFilename=None, idleTimeout=600.0,
+                 maximumNumberOfReaders=8, enableQueryCache=True,
+                 maximumQueryCacheRows=1000000):
+        """
+            Bind to "socketFilename"; a stale socket file left by a server
+            that did not exit cleanly is removed.
+        """
+        self.socketFilename = socketFilename or getDefaultSocketFilename()
+        if path.exists(self.socketFilename):
+            if isServerRunning(self.socketFilename):
+                raise ValueError("UhgServer.__init__: a server is already "
+                                 + "listening on %s." % self.socketFilename)
+            os.unlink(self.socketFilename)
+        socketserver.UnixStreamServer.__init__(self, self.socketFilename,
+                                               UhgRequestHandler)
+        os.chmod(self.socketFilename, 0o600)
+        self.idleTimeout = idleTimeout
+        self.readerPool = ReaderPool(maximumNumberOfReaders, enableQueryCache,
+            maximumQueryCacheRows=maximumQueryCacheRows)
+        self.startTime = self.lastRequestTime = time.time()
+        self.numberOfRequests = 0
+        self.stopRequested = False
+        self.timeout = 1.0 # seconds to wait in handle_request
+
+    def serveUntilIdle(self):
+        """
+            Serve requests until the server is idle for too long or a "stop"
+            command is received; then remove the socket file.
+        """
+        try:
+            while (not self.stopRequested and
+                   time.time() - self.lastRequestTime < self.idleTimeout):
+                self.handle_request()
+        finally:
+            self.server_close()
+            if path.exists(self.socketFilename):
+                os.unlink(self.socketFilename)
+
+    def respond(self, request):
+        """
+            Return the response to the dictionary "request".
+        """
+        self.numberOfRequests += 1
+        command = request.get("command", "evaluate")
+        if command == "ping":
+            return {"output": "pong"}
+        elif command == "evaluate":
+            reader = self.readerPool.getReader(request["database"])
+            value = reader.evaluateExpressionOnly(request["expression"])
+            return {"output": str(value), "value": uhg._toJSONValue(value)}
+        elif command == "batch":
+            reader = self.readerPool.getReader(request["database"])
+            hasQueryCache = reader.queryCache is not None
+            if not hasQueryCache: reader.enableQueryCache()
+            results = []
+            try:
+                for name, expression in uhg.readExpressionFile(
+                                                request["expressionFile"]):
+                    startTime = time.time()
+                    value = reader.evaluateExpressionOnly(expression)
+                    results.append((name, expression, value,
+                                    time.time()-startTime))
+            finally:
+                if not hasQueryCache: reader.enableQueryCache(False)
+            uhg.writeBatchResults(results, request["outputFile"])
+            return {"output": "\n".join(
+                "Failed to evaluate {}: {}".format(name, expression)
+                for name, expression, value, seconds in results
+                if value is None)}
+        elif command == "status":
+            lines = ["Serving {} requests in {:.0f} seconds on {}".format(
+                     self.numberOfRequests, time.time() - self.startTime,
+                     self.socketFilename),
+                     "Reader pool: {}".format(", ".join("{}={}".format(*item)
+                        for item in sorted(self.readerPool.statistics.items())))]
+            lines.extend("    " + aDatabase for aDatabase in
+                         self.readerPool.getDatabaseFilenames())
+            return {"output": "\n".join(lines)}
+        elif command == "stop":
+            self.stopRequested = True
+            return {"output": "The uhg server is stopped."}
+        raise ValueError("UhgServer.respond: unknown command %s." % command)
+
+if __name__ == '__main__':
+    options = {"socketFilename": None, "idleTimeout": 600.0,
+               "maximumNumberOfReaders": 8, "enableQueryCache": True,
+               "maximumQueryCacheRows": 1000000}
+    try:
+        for anArgument in sys.argv[1:]:
+            if anArgument.startswith("--socket="):
+                options["socketFilename"] = anArgument.split("=", 1)[1]
+            elif anArgument.startswith("--idle-timeout="):
+                options["idleTimeout"] = float(anArgument.split("=", 1)[1])
+            elif anArgument.startswith("--readers="):
+                options["maximumNumberOfReaders"] = int(anArgument.split("=", 1)[1])
+            elif anArgument == "--no-query-cache":
+                options["enableQueryCache"] = False
+            elif anArgument.startswith("--query-cache-rows="):
+                options["maximumQueryCacheRows"] = int(anArgument.split("=", 1)[1])
+            else:
+                raise ValueError()
+    except ValueError:
+        print("Usage: uhgServer.py [--socket=filename] [--idle-timeout=seconds] [--readers=N] [--no-query-cache] [--query-cache-rows=N]")
+        sys.exit(-1)
+    UhgServer(**options).serveUntilIdle()
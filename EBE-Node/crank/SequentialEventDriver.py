@@ -8,15 +8,54 @@
 # flexibilities.
 # The main entry is the sequentialEventDriverShell function.
 
-from os import path, getcwd, remove, makedirs
-from sys import stdout
-from shutil import move, copy, rmtree
+from os import path, getcwd, remove, makedirs, listdir, walk, symlink, dup2
+from os import environ, getpid, wait4, WIFSIGNALED, WTERMSIG, WEXITSTATUS
+from os import open as openFile, write, close, O_WRONLY, O_APPEND, O_CREAT
+from os import rename, lstat
+try:
+    from os import copy_file_range
+except ImportError:
+    copy_file_range = None
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+from sys import stdout, stderr
+from shutil import move, copy, copy2, copymode, copytree, copyfileobj, rmtree
 from glob import glob
-from subprocess import call
+from subprocess import call, Popen
+from socket import gethostname
+from json import dumps, load
+from hashlib import sha1
+from gzip import GzipFile
+import resource
+import errno
+try:
+    from multiprocessing import get_context
+    forkContext = get_context('fork')
+except ImportError: # python 2, where processes are always forked
+    import multiprocessing as forkContext
+from threading import Thread, local, Lock as ThreadLock
+from time import sleep, time
+from traceback import print_exc
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 import numpy as np
 
 class ExecutionError(Exception): pass # used to signal my own exception
 
+# the event whose stages the current thread performs, see getEventResultDir
+currentEvent = local()
+# serializes the appending to the combined UrQMD file when events run
+# concurrently, see runEventsConcurrently
+combinedUrqmdFileLock = None
+# the checkpoint of the job, see sequentialEventDriverShell; None when the job
+# is not checkpointed
+jobCheckpoint = None
+jobCheckpointLock = ThreadLock()
+
 # set global default parameters
 allParameterLists = [
     'controlParameterList',
@@ -50,6 +89,17 @@ controlParameterList = {
     'eventResultDirPattern' :   'event-%d', # %d->event_id, where event results are saved
     'eventResultDir'        :   None, # used to pass event result folder from sequentialEventDriverShell to others
     'combinedUrqmdFile'     :   'urqmdCombined.txt', # urqmd from all events will be combined into this file
+    'combinedUrqmdCompression'  :   None, # None or 'gzip', then '.gz' is added to the name of the combined file
+    'combinedUrqmdBufferSize'   :   1048576, # bytes, the urqmd output of an event is appended through a buffer of this size
+    'checkpointFile'        :   'checkpoint.json', # finished events and stages are recorded here, relative to resultDir, so that a restarted job resumes; None to disable
+    'telemetryFile'         :   'telemetry.jsonl', # resources used by each stage and command are recorded here, relative to resultDir; None to disable
+    'numberOfConcurrentEvents'  :   1, # events run at the same time, each in its own slot
+    'slotsDir'              :   path.abspath('../slots'), # working trees of the slots are created here, absolute
+    'slotCopySizeLimit'     :   1048576, # in slots, smaller files are copied and larger ones linked
+    'pipelineEvents'        :   False, # overlap the stages of consecutive events, each stage in its own thread; not with numberOfConcurrentEvents > 1
+    'pipelineQueueSize'     :   1, # events that can wait between two pipelined stages
+    'stageBufferDir'        :   path.abspath('../stageBuffers'), # outputs passed between stages are kept here, absolute
+    'fileTransferMethods'   :   ['rename', 'reflink', 'copy_file_range'], # tried in this order to move or copy stage files, before copying them
     'buildCMD'              :   'make build',
     'cleanCMD'              :   'make clean',
 }
@@ -465,11 +515,13 @@ def hydroWithInitialCondition(aFile):
 
     # storing initial condition file
     if hydroControl['saveICFile']:
-        copy(aFile, controlParameterList['eventResultDir'])
+        saveResultFile(aFile, keepSource=True)
 
-    # move initial condition to the designated folder
-    move(aFile, path.join(hydroICDirectory, 
-                          hydroControl['initialConditionFile']))
+    # copy initial condition to the designated folder; it is kept so that
+    # the event can be performed again when the job is resumed
+    transferFile(aFile, path.join(hydroICDirectory, 
+                                  hydroControl['initialConditionFile']),
+                 keepSource=True)
 
     # form assignment string
     assignments = formAssignmentStringFromDict(hydroParameters)
@@ -488,7 +540,7 @@ def hydroWithInitialCondition(aFile):
     for aFile in file_list:
         # check if this file worth storing, then copy to event result folder
         if aFile in worthStoring:
-            copy(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile, keepSource=True)
         # yield it
         yield path.join(hydroResultsDirectory, aFile)
 
@@ -539,11 +591,13 @@ def hydro_with_pre_equilbirium(aFile):
 
     # storing initial condition file
     if hydroControl['saveICFile']:
-        copy(aFile, controlParameterList['eventResultDir'])
+        saveResultFile(aFile, keepSource=True)
 
-    # first move initial condition to the pre-equilibrium folder
-    move(aFile, path.join(pre_equilibrium_ic_directory, 
-                          preEquilibriumControl['initialConditionFile']))
+    # first copy initial condition to the pre-equilibrium folder; it is kept
+    # so that the event can be performed again when the job is resumed
+    transferFile(aFile, path.join(pre_equilibrium_ic_directory, 
+                                  preEquilibriumControl['initialConditionFile']),
+                 keepSource=True)
 
     # form assignment string
     assignments = formAssignmentStringFromDict(preEquilibriumParameters)
@@ -557,7 +611,7 @@ def hydro_with_pre_equilbirium(aFile):
     for aFile in glob(path.join(pre_equilibrium_results_directory, 
                                 preEquilibriumControl['resultFiles'])):
         file_name = aFile.split('/')[-1].split('kln')[0] + 'kln.dat'
-        move(aFile, path.join(hydroICDirectory, file_name))
+        transferFile(aFile, path.join(hydroICDirectory, file_name))
     # form assignment string
     assignments = formAssignmentStringFromDict(hydroParameters)
     # form executable string
@@ -574,7 +628,7 @@ def hydro_with_pre_equilbirium(aFile):
                                 hydroControl['resultFiles'])):
         # check if this file worth storing, then copy to event result folder
         if aFile in worthStoring:
-            copy(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile, keepSource=True)
         # yield it
         yield path.join(hydroResultsDirectory, aFile)
 
@@ -602,7 +656,7 @@ def iSSWithHydroResultFiles(fileList):
         if not path.exists(aFile):
             raise ExecutionError("Hydro result file %s not found!" % aFile)
         else:
-            move(aFile, iSSOperationDirectory)
+            transferFile(aFile, iSSOperationDirectory)
     
     # make sure all hadrons up to 2 GeV are calculated
     copy(path.join(iSSDirectory, 'EOS', 'chosen_particles_urqmd_v3.3+.dat'), 
@@ -625,7 +679,7 @@ def iSSWithHydroResultFiles(fileList):
         worthStoring.extend(glob(path.join(iSSOperationDirectory, aGlob)))
     for aFile in glob(path.join(iSSOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
 
     # return OSCAR file path
     return iSSOSCARFilepath
@@ -656,7 +710,7 @@ def iSWithResonancesWithHydroResultFiles(fileList):
         if not path.exists(aFile):
             raise ExecutionError("Hydro result file %s not found!" % aFile)
         else:
-            move(aFile, iSOperationDirectory)
+            transferFile(aFile, iSOperationDirectory)
     copy(path.join(iSDirectory, 'EOS', 'chosen_particles_s95pv1.dat'), 
          path.join(iSDirectory, 'EOS', 'chosen_particles.dat'))
     copy(path.join(iSDirectory, 'EOS', 'pdg-s95pv1_withDecayPhotons.dat'), 
@@ -672,7 +726,7 @@ def iSWithResonancesWithHydroResultFiles(fileList):
         worthStoring.extend(glob(path.join(iSOperationDirectory, aGlob)))
     for aFile in glob(path.join(iSOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
 
 def iSSeventplaneAngleWithHydroResultFiles(fileList):
     """
@@ -699,7 +753,7 @@ def iSSeventplaneAngleWithHydroResultFiles(fileList):
         if not path.exists(aFile):
             raise ExecutionError("Hydro result file %s not found!" % aFile)
         else:
-            move(aFile, iSSOperationDirectory)
+            transferFile(aFile, iSSOperationDirectory)
     copy(path.join(iSSDirectory, 'EOS', 'chosen_particles_urqmd_v3.3+.dat'), 
          path.join(iSSDirectory, 'EOS', 'chosen_particles.dat'))
     copy(path.join(iSSDirectory, 'EOS', 'pdg-urqmd_v3.3+.dat'), 
@@ -719,7 +773,7 @@ def iSSeventplaneAngleWithHydroResultFiles(fileList):
         worthStoring.extend(glob(path.join(iSSOperationDirectory, aGlob)))
     for aFile in glob(path.join(iSSOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
 
     # return hydro h5 file path
     return (hydroH5Filepath,)
@@ -751,7 +805,7 @@ def iSWithResonancesWithdecayPhotonWithHydroResultFiles(fileList):
         if not path.exists(aFile):
             raise ExecutionError("Hydro result file %s not found!" % aFile)
         else:
-            copy(aFile, iSOperationDirectory)
+            transferFile(aFile, iSOperationDirectory, keepSource=True)
 
     simulationType = controlParameterList['simulation_type']
     if simulationType == "hydroEM_with_decaycocktail_with_urqmd":
@@ -780,7 +834,7 @@ def iSWithResonancesWithdecayPhotonWithHydroResultFiles(fileList):
         worthStoring.extend(glob(path.join(iSOperationDirectory, aGlob)))
     for aFile in glob(path.join(iSOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
     
     # return hydro h5 file path
     return (hydroH5Filepath,)
@@ -809,7 +863,7 @@ def photonEmissionWithHydroResultFiles(fileList):
         if not path.exists(aFile):
             raise ExecutionError("Hydro result file %s not found!" % aFile)
         else:
-            move(aFile, photonEmOperationDirectory)
+            transferFile(aFile, photonEmOperationDirectory)
 
     # form assignment string
     assignments = formAssignmentStringFromDict(photonEmissionParameters)
@@ -825,7 +879,7 @@ def photonEmissionWithHydroResultFiles(fileList):
         worthStoring.extend(glob(path.join(photonEmOperationDirectory, aGlob)))
     for aFile in glob(path.join(photonEmOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
 
 
 def osc2uFromOSCARFile(OSCARFilePath):
@@ -852,7 +906,7 @@ def osc2uFromOSCARFile(OSCARFilePath):
 
     # save OSCAR file
     if osc2uControl['saveOSCAR']:
-        move(OSCARFilePath, controlParameterList['eventResultDir'])
+        saveResultFile(OSCARFilePath)
 
     # return the output file path
     return osc2uOutputFilePath
@@ -884,12 +938,12 @@ def urqmdFromOsc2uOutputFile(osc2uFilePath):
 
     # check existence of the osc2u output, move it then execute urqmd
     if path.exists(osc2uFilePath):
-        move(osc2uFilePath, urqmdIC)
+        transferFile(osc2uFilePath, urqmdIC)
         run("nice -n %d bash ./" % (ProcessNiceness) + urqmdExecutionEntry, cwd=urqmdDirectory)
 
     # save output file
     if urqmdControl['saveOutputFile']:
-        copy(urqmdOutputFilePath, controlParameterList['eventResultDir'])
+        saveResultFile(urqmdOutputFilePath, keepSource=True)
 
     # return the output file path
     return urqmdOutputFilePath
@@ -923,7 +977,7 @@ def binUrqmdResultFiles(urqmdOutputFile):
         worthStoring.extend(glob(path.join(binUOperationDirectory, aGlob)))
     for aFile in glob(path.join(binUOperationDirectory, "*")):
         if aFile in worthStoring:
-            move(aFile, controlParameterList['eventResultDir'])
+            saveResultFile(aFile)
 
 def collectEbeResultsToDatabaseFrom(folder):
     """
@@ -1010,6 +1064,121 @@ def cleanUpFolder(aDir):
         makedirs(aDir)
 
 
+FICLONE = 0x40049409 # ioctl request of Linux to make a reflink
+
+
+def getPathSize(aPath):
+    """ Return the size in bytes of the given file, or of the files in it. """
+    if not path.isdir(aPath) or path.islink(aPath):
+        return lstat(aPath).st_size
+    size = 0
+    for dirPath, dirNames, fileNames in walk(aPath):
+        for aFile in fileNames:
+            size += lstat(path.join(dirPath, aFile)).st_size
+    return size
+
+
+def cloneFile(source, target):
+    """
+        Make "target" a reflink of "source", a copy-on-write copy sharing its
+        data blocks. Return False where the file systems do not support it.
+    """
+    if ioctl is None:
+        return False
+    sourceFile = open(source, 'rb')
+    targetFile = open(target, 'wb')
+    try:
+        ioctl(targetFile.fileno(), FICLONE, sourceFile.fileno())
+        cloned = True
+    except (IOError, OSError):
+        cloned = False
+    sourceFile.close()
+    targetFile.close()
+    if not cloned:
+        remove(target)
+        return False
+    copymode(source, target)
+    return True
+
+
+def copyFileInKernel(source, target):
+    """
+        Copy "source" to "target" with copy_file_range, which copies in the
+        kernel and lets file systems that can share or offload the copy do so.
+        Return False where it is not available.
+    """
+    if copy_file_range is None:
+        return False
+    sourceFile = open(source, 'rb')
+    targetFile = open(target, 'wb')
+    try:
+        copied = True
+        while copy_file_range(sourceFile.fileno(), targetFile.fileno(),
+                              1 << 30) > 0:
+            pass
+    except OSError:
+        copied = False
+    sourceFile.close()
+    targetFile.close()
+    if not copied:
+        remove(target)
+        return False
+    copymode(source, target)
+    return True
+
+
+def transferFile(source, target, keepSource=False):
+    """
+        Move the file "source" to "target", or copy it if "keepSource" is True;
+        if "target" is a folder, the file is put in it. The cheapest of the
+        fileTransferMethods the file systems allow is used: rename to move,
+        and reflink or copy_file_range to copy, before copying the data. A
+        copy is never a hard link, since the source can still be written to
+        (photonEmission opens JetData.h5 for writing, for example), and an
+        existing target is removed first, so that nothing is written through
+        a link. The bytes moved or cloned without copying and the bytes
+        copied are added to the telemetry of the stage.
+    """
+    if path.isdir(target) and not path.islink(target):
+        target = path.join(target, path.basename(source))
+    if path.isdir(target) and not path.islink(target):
+        rmtree(target)
+    elif path.lexists(target):
+        remove(target)
+    if keepSource:
+        source = path.realpath(source)
+    size = getPathSize(source)
+    methods = controlParameterList['fileTransferMethods']
+
+    if not keepSource:
+        if 'rename' in methods:
+            try:
+                rename(source, target)
+                addToStageTelemetry('movedBytes', size)
+                return
+            except OSError:
+                pass # e.g. on another file system
+        transferFile(source, target, keepSource=True)
+        if path.isdir(source):
+            rmtree(source)
+        else:
+            remove(source)
+        return
+
+    if path.isdir(source):
+        copytree(source, target)
+        addToStageTelemetry('copiedBytes', size)
+        return
+    if 'reflink' in methods and cloneFile(source, target):
+        addToStageTelemetry('clonedBytes', size)
+        return
+    if 'copy_file_range' in methods and copyFileInKernel(source, target):
+        addToStageTelemetry('copiedBytes', size)
+        return
+    copy(source, target)
+    addToStageTelemetry('copiedBytes', size)
+
+
 def checkExistenceOfExecutable(executableFilename):
     """ Check the existence of the executable file, and compile if not. """
     if not path.exists(executableFilename):
@@ -1031,14 +1200,826 @@ def checkExistenceOfExecutables(executableFilenames):
 
 
 def run(command, cwd=getcwd(), echo=True):
-    """ Invoke a command from terminal and wait for it to stop. """
+    """
+        Invoke a command from terminal and wait for it to stop. Its wall time,
+        CPU time, peak RSS and block I/O are recorded with recordTelemetry and
+        added to the telemetry of the current stage.
+    """
     if echo:
         print("-"*80)
         print("In "+cwd)
         print("Executing command: "+command)
         print("-"*80)
         stdout.flush()
-    return call(command, shell=True, cwd=cwd)
+    startTime = time()
+    process = Popen(command, shell=True, cwd=cwd)
+    while True:
+        try:
+            pid, status, usage = wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if WIFSIGNALED(status):
+        process.returncode = -WTERMSIG(status)
+    else:
+        process.returncode = WEXITSTATUS(status)
+
+    telemetry = {
+        'type'          :   'command',
+        'command'       :   command,
+        'folder'        :   path.basename(path.normpath(cwd)),
+        'exitCode'      :   process.returncode,
+        'wallTime'      :   time() - startTime,
+        'userTime'      :   usage.ru_utime,
+        'systemTime'    :   usage.ru_stime,
+        'peakRSS'       :   usage.ru_maxrss, # kB, at least that of the driver
+        'readBytes'     :   usage.ru_inblock*512,
+        'writtenBytes'  :   usage.ru_oublock*512,
+    }
+    stageTelemetry = getattr(currentEvent, 'stageTelemetry', None)
+    if stageTelemetry:
+        telemetry['event'] = stageTelemetry['event']
+        telemetry['stage'] = stageTelemetry['stage']
+        stageTelemetry['commands'] += 1
+        for aKey in ('userTime', 'systemTime', 'readBytes', 'writtenBytes'):
+            stageTelemetry[aKey] += telemetry[aKey]
+        stageTelemetry['peakRSS'] = max(stageTelemetry['peakRSS'],
+                                        telemetry['peakRSS'])
+    recordTelemetry(telemetry)
+    return process.returncode
+
+
+def recordTelemetry(telemetry):
+    """
+        Append the given record, with the host, job and time added, as one
+        JSON line to the telemetry file of the job in resultDir. Each record
+        is written with a single write, so that the records of concurrent
+        events are not mixed.
+    """
+    if not controlParameterList['telemetryFile']:
+        return
+    telemetry['host'] = gethostname()
+    telemetry['job'] = environ.get('PBS_JOBID',
+                                   environ.get('SLURM_JOB_ID', ''))
+    telemetry['pid'] = getpid()
+    telemetry['time'] = time()
+    telemetryFile = path.join(controlParameterList['resultDir'],
+                              controlParameterList['telemetryFile'])
+    if not path.exists(path.dirname(telemetryFile)):
+        return
+    line = (dumps(telemetry, sort_keys=True) + "\n").encode('utf-8')
+    fd = openFile(telemetryFile, O_WRONLY | O_APPEND | O_CREAT, 0o644)
+    try:
+        write(fd, line)
+    finally:
+        close(fd)
+
+
+def performStage(stageName, stageFunction, event_id, stageOutput):
+    """
+        Perform a stage of event "event_id" with the output of the previous
+        stage, and record its telemetry: the wall time of the stage, the CPU
+        time, largest peak RSS and block I/O of the commands it ran, the bytes
+        of the files it moved and copied, and the CPU time of the driver thread
+        itself where the system can measure it.
+    """
+    telemetry = {
+        'type'          :   'stage',
+        'event'         :   event_id,
+        'stage'         :   stageName,
+        'commands'      :   0,
+        'userTime'      :   0.0,
+        'systemTime'    :   0.0,
+        'peakRSS'       :   0,
+        'readBytes'     :   0,
+        'writtenBytes'  :   0,
+        'movedBytes'    :   0, # see transferFile
+        'clonedBytes'   :   0,
+        'copiedBytes'   :   0,
+    }
+    threadUsage = getThreadUsage()
+    currentEvent.stageTelemetry = telemetry
+    startTime = time()
+    try:
+        return stageFunction(event_id, stageOutput)
+    except:
+        telemetry['failed'] = True
+        raise
+    finally:
+        telemetry['wallTime'] = time() - startTime
+        currentEvent.stageTelemetry = None
+        if threadUsage:
+            usage = getThreadUsage()
+            telemetry['driverUserTime'] = usage.ru_utime - threadUsage.ru_utime
+            telemetry['driverSystemTime'] = (
+                                    usage.ru_stime - threadUsage.ru_stime)
+        recordTelemetry(telemetry)
+
+
+def addToStageTelemetry(key, amount):
+    """ Add "amount" to the quantity "key" of the current stage, if any. """
+    stageTelemetry = getattr(currentEvent, 'stageTelemetry', None)
+    if stageTelemetry:
+        stageTelemetry[key] += amount
+
+
+def getThreadUsage():
+    """
+        Return the resource usage of the calling thread, or None where the
+        system does not provide it.
+    """
+    if hasattr(resource, 'RUSAGE_THREAD'):
+        return resource.getrusage(resource.RUSAGE_THREAD)
+    return None
+
+
+def getEventResultDirPath(event_id):
+    """ Return the absolute path to the result folder of event "event_id". """
+    return path.join(controlParameterList['resultDir'],
+                     controlParameterList['eventResultDirPattern'] % event_id)
+
+
+def getEventResultDir():
+    """
+        Return the result folder of the event being calculated. It is
+        controlParameterList['eventResultDir'], except in the threads of the
+        pipelined mode, which each work on a different event.
+    """
+    return getattr(currentEvent, 'resultDir',
+                   controlParameterList['eventResultDir'])
+
+
+def saveResultFile(aFile, keepSource=False):
+    """
+        Save the given file in the result folder of the current event, by
+        moving it, or by copying it if "keepSource" is True. A file of the same
+        name, left by an interrupted attempt of the stage, is replaced.
+    """
+    transferFile(aFile, getEventResultDir(), keepSource)
+
+
+def getStageBufferDir(event_id, stageName=None):
+    """
+        Return the folder in which the outputs of the stage "stageName" of
+        event "event_id" are kept until the next stage uses them.
+    """
+    bufferDir = path.join(controlParameterList['stageBufferDir'],
+                          controlParameterList['eventResultDirPattern']
+                          % event_id)
+    if stageName:
+        bufferDir = path.join(bufferDir, stageName)
+    return bufferDir
+
+
+def keepStageOutput(fileList, event_id, stageName):
+    """
+        Move the given output files of a stage out of the stage folder into the
+        buffer folder of the event, so that the stage can be performed for the
+        next event while the following stages still need these files. Return
+        the new paths of the files.
+    """
+    bufferDir = getStageBufferDir(event_id, stageName)
+    cleanUpFolder(bufferDir)
+    keptFiles = []
+    for aFile in fileList:
+        keptFile = path.join(bufferDir, path.basename(aFile))
+        if path.exists(aFile):
+            transferFile(aFile, keptFile)
+        keptFiles.append(keptFile)
+    return keptFiles
+
+
+def initialConditionStage(event_id, aInitialConditionFile):
+    """
+        Create the result folder of the event and save the initial condition
+        files in it. Return the initial condition file.
+    """
+    eventResultDir = getEventResultDir()
+    if path.exists(eventResultDir):
+        rmtree(eventResultDir)
+    makedirs(eventResultDir)
+
+    # print current progress to terminal
+    print("Starting event %d..." % event_id)
+
+    initial_type = initial_condition_control['initial_condition_type']
+    if initial_type == 'superMC':    # initial conditions from superMC
+        if superMCControl['saveICFile']:
+            initial_id = int(
+                aInitialConditionFile.split('/')[-1].split('_')[2])
+            superMCDataDirectory = path.join(
+                controlParameterList['rootDir'], 
+                superMCControl['mainDir'], superMCControl['dataDir'])
+            file_list = glob(path.join(superMCDataDirectory,
+                superMCControl['dataFiles'] % initial_id))
+            for aFile in file_list:
+                saveResultFile(aFile, keepSource=True)
+    elif initial_type == 'pre-generated':  
+        # initial conditions from pre-generated files
+        saveResultFile(aInitialConditionFile, keepSource=True)
+
+    return aInitialConditionFile
+
+
+def hydroStage(event_id, aInitialConditionFile):
+    """
+        Perform the hydro calculation of the event, with the pre-equilibrium
+        evolution if the simulation type needs it. Return the result files.
+    """
+    if controlParameterList['simulation_type'] == 'hydroEM_preEquilibrium':
+        # perform hydro calculations with pre-equilibrium evolution 
+        # and get a list of all the result filenames
+        hydroResultFiles = [aFile for aFile in 
+                     hydro_with_pre_equilbirium(aInitialConditionFile)]
+    else:
+        # perform hydro calculations and get a list of all the result 
+        # filenames
+        hydroResultFiles = [aFile for aFile in 
+                      hydroWithInitialCondition(aInitialConditionFile)]
+    return keepStageOutput(hydroResultFiles, event_id, 'hydro')
+
+
+def particlizationStage(event_id, hydroResultFiles):
+    """
+        Perform the calculations that use the hydro results, which depend on
+        the simulation type. For the types with UrQMD, return the osc2u output
+        file.
+    """
+    simulationType = controlParameterList['simulation_type']
+    if simulationType == 'hybrid':
+        # perform iSS calculation and return the path to the OSCAR file
+        OSCARFilePath = iSSWithHydroResultFiles(hydroResultFiles)
+        # perform osc2u
+        osc2uOutputFilePath = osc2uFromOSCARFile(OSCARFilePath)
+        return keepStageOutput([osc2uOutputFilePath], event_id,
+                               'particlization')[0]
+
+    elif simulationType == 'hydro':
+        # perform iS calculation and resonance decays
+        iSWithResonancesWithHydroResultFiles(hydroResultFiles)
+
+    elif simulationType == 'hydroEM':
+        h5file = iSSeventplaneAngleWithHydroResultFiles(hydroResultFiles)
+        # perform EM radiation calculation
+        photonEmissionWithHydroResultFiles(h5file)
+
+    elif simulationType in ('hydroEM_with_decaycocktail',
+                            'hydroEM_preEquilibrium'):
+        # perform iS calculation and resonance decays
+        h5file = iSWithResonancesWithdecayPhotonWithHydroResultFiles(
+                                                      hydroResultFiles)
+        # perform EM radiation calculation
+        photonEmissionWithHydroResultFiles(h5file)
+
+    elif simulationType == 'hydroEM_with_decaycocktail_with_urqmd':
+        h5file = iSWithResonancesWithdecayPhotonWithHydroResultFiles(
+                                                      hydroResultFiles)
+        # perform EM radiation calculation
+        photonEmissionWithHydroResultFiles(h5file)
+
+        # perform iSS calculation and return the path to the OSCAR file
+        OSCARFilePath = iSSWithHydroResultFiles(hydroResultFiles)
+        # perform osc2u
+        osc2uOutputFilePath = osc2uFromOSCARFile(OSCARFilePath)
+        return keepStageOutput([osc2uOutputFilePath], event_id,
+                               'particlization')[0]
+
+
+def urqmdStage(event_id, osc2uOutputFilePath):
+    """ Perform UrQMD for the event. Return the UrQMD output file. """
+    urqmdOutputFilePath = urqmdFromOsc2uOutputFile(osc2uOutputFilePath)
+    return keepStageOutput([urqmdOutputFilePath], event_id, 'urqmd')[0]
+
+
+def getCombinedUrqmdFile():
+    """
+        Return the path to the combined UrQMD file, whose name ends with ".gz"
+        when it is compressed.
+    """
+    combinedUrqmdFile = path.join(controlParameterList['resultDir'], 
+                                  controlParameterList['combinedUrqmdFile'])
+    if controlParameterList['combinedUrqmdCompression'] == 'gzip':
+        combinedUrqmdFile += '.gz'
+    return combinedUrqmdFile
+
+
+def readCombinedUrqmdIndex(indexFile):
+    """
+        Return the entries of the index of the combined UrQMD file, as
+        (event_id, offset, size, uncompressed size) tuples. An incomplete last
+        line, left by an interrupted job, is removed from the file.
+    """
+    if not path.exists(indexFile):
+        return []
+    aFile = open(indexFile, 'r+')
+    content = aFile.read()
+    completeContent = content[:content.rfind('\n')+1]
+    if len(completeContent) < len(content):
+        aFile.truncate(len(completeContent))
+    aFile.close()
+    entries = []
+    for aLine in completeContent.splitlines():
+        if aLine.strip() and not aLine.startswith('#'):
+            entries.append(tuple(int(aField) for aField in aLine.split()))
+    return entries
+
+
+def appendToCombinedUrqmdFile(event_id, urqmdOutputFilePath):
+    """
+        Append the UrQMD output of event "event_id" to the combined UrQMD file,
+        through a buffer of combinedUrqmdBufferSize bytes so that the output is
+        never read into memory as a whole. With combinedUrqmdCompression set to
+        'gzip' each event is written as a gzip member; the members together
+        read as one gzip file. The offset and size of each event in the
+        combined file, and its uncompressed size, are appended to the
+        ".index" file beside it, so that the events can be read one at a time.
+        The index also lets a resumed job skip an event appended before, and
+        remove an appending that was interrupted.
+    """
+    combinedUrqmdFile = getCombinedUrqmdFile()
+    indexFile = combinedUrqmdFile + '.index'
+    entries = readCombinedUrqmdIndex(indexFile)
+    if event_id in [anEntry[0] for anEntry in entries]:
+        return # appended before the job was interrupted
+    offset = 0
+    if entries:
+        offset = entries[-1][1] + entries[-1][2]
+
+    combinedFile = open(combinedUrqmdFile, 'ab')
+    combinedFile.seek(0, 2)
+    if combinedFile.tell() > offset:
+        # the rest of an interrupted appending
+        combinedFile.truncate(offset)
+    sourceFile = open(urqmdOutputFilePath, 'rb')
+    bufferSize = controlParameterList['combinedUrqmdBufferSize']
+    if controlParameterList['combinedUrqmdCompression'] == 'gzip':
+        compressedFile = GzipFile(filename='', mode='wb', fileobj=combinedFile)
+        copyfileobj(sourceFile, compressedFile, bufferSize)
+        compressedFile.close()
+    else:
+        copyfileobj(sourceFile, combinedFile, bufferSize)
+    sourceFile.close()
+    combinedFile.close()
+
+    uncompressedSize = path.getsize(urqmdOutputFilePath)
+    addToStageTelemetry('copiedBytes', uncompressedSize)
+    isNewIndex = not path.exists(indexFile)
+    aFile = open(indexFile, 'a')
+    if isNewIndex:
+        aFile.write("# event_id offset size uncompressed_size\n")
+    aFile.write("%d %d %d %d\n" % (event_id, offset,
+                                    path.getsize(combinedUrqmdFile) - offset,
+                                    uncompressedSize))
+    aFile.close()
+
+
+def binningStage(event_id, urqmdOutputFilePath):
+    """
+        Append the UrQMD output of the event to the combined UrQMD file, then
+        bin it to get flows.
+    """
+    # copy and concatnate final results from all hydro events into one file
+    if combinedUrqmdFileLock: combinedUrqmdFileLock.acquire()
+    try:
+        appendToCombinedUrqmdFile(event_id, urqmdOutputFilePath)
+    finally:
+        if combinedUrqmdFileLock: combinedUrqmdFileLock.release()
+
+    # bin the combined result file to get flows
+    binUrqmdResultFiles(urqmdOutputFilePath)
+
+    # delete the huge final UrQMD combined file
+    remove(urqmdOutputFilePath)
+
+
+def getEventStages(simulationType):
+    """
+        Return the stages of an event for the given simulation type, as a list
+        of (name, function) pairs. Each function takes the event id and the
+        value returned by the previous stage.
+    """
+    stages = [('initialCondition', initialConditionStage),
+              ('hydro', hydroStage),
+              ('particlization', particlizationStage)]
+    if simulationType == 'hybrid':
+        stages.extend([('urqmd', urqmdStage), ('binning', binningStage)])
+    elif simulationType == 'hydroEM_with_decaycocktail_with_urqmd':
+        stages.append(('urqmd', urqmdStage))
+    return stages
+
+
+# parameters of controlParameterList that only change how a job runs, and not
+# its results; they can be changed before resuming from a checkpoint
+runModeParameters = [
+    'niceness', 'rootDir', 'resultDir', 'eventResultDir', 'checkpointFile',
+    'telemetryFile', 'numberOfConcurrentEvents', 'slotsDir',
+    'slotCopySizeLimit', 'pipelineEvents', 'pipelineQueueSize',
+    'stageBufferDir', 'fileTransferMethods', 'combinedUrqmdBufferSize',
+    'buildCMD', 'cleanCMD',
+]
+
+def getParameterFingerprint():
+    """
+        Return a hash of all the parameters except runModeParameters, which
+        identifies the calculation a checkpoint was written for.
+    """
+    parameters = {}
+    for aParameterList in allParameterLists + ['EbeCollectorControl',
+                                               'EbeCollectorParameters']:
+        parameters[aParameterList] = dict(globals()[aParameterList])
+    for aParameter in runModeParameters:
+        parameters['controlParameterList'].pop(aParameter, None)
+    return sha1(dumps(parameters, sort_keys=True, default=str).encode(
+                                                        'utf-8')).hexdigest()
+
+
+def getCheckpointFile():
+    """ Return the path to the checkpoint file, or None if disabled. """
+    if not controlParameterList['checkpointFile']:
+        return None
+    return path.join(controlParameterList['resultDir'],
+                     controlParameterList['checkpointFile'])
+
+
+def loadCheckpoint(fingerprint):
+    """
+        Read the checkpoint left in resultDir by an interrupted job and return
+        it, or None if there is none. ExecutionError is raised when it cannot
+        be read or was written for parameters with another fingerprint, so
+        that the results of that job are not deleted by starting afresh.
+    """
+    checkpointFile = getCheckpointFile()
+    if not checkpointFile or not path.exists(checkpointFile):
+        return None
+    try:
+        aCheckpoint = load(open(checkpointFile))
+    except ValueError:
+        raise ExecutionError("Checkpoint file %s cannot be read; remove it "
+                             "to start afresh!" % checkpointFile)
+    if aCheckpoint.get('parameters') != fingerprint:
+        raise ExecutionError("Checkpoint file %s was written for other "
+                             "parameters; remove it to start afresh!"
+                             % checkpointFile)
+    return aCheckpoint
+
+
+def saveCheckpoint():
+    """
+        Write the checkpoint of the job. It is written to a temporary file
+        that then replaces the checkpoint file, so that an interrupted job
+        always leaves a complete checkpoint.
+    """
+    checkpointFile = getCheckpointFile()
+    with jobCheckpointLock:
+        if jobCheckpoint is None or not checkpointFile:
+            return
+        temporaryFile = checkpointFile + '.tmp'
+        aFile = open(temporaryFile, 'w')
+        aFile.write(dumps(jobCheckpoint, sort_keys=True, indent=1))
+        aFile.close()
+        rename(temporaryFile, checkpointFile)
+
+
+def recordFinishedStage(event_id, stageName, stageOutput):
+    """
+        Record in the checkpoint that the stage "stageName" of event
+        "event_id" is finished, with its output for the next stage.
+    """
+    if jobCheckpoint is None:
+        return
+    with jobCheckpointLock:
+        jobCheckpoint['stages'][str(event_id)] = {'stage': stageName,
+                                                  'output': stageOutput}
+    saveCheckpoint()
+
+
+def recordFinishedEvent(event_id):
+    """ Record in the checkpoint that event "event_id" is finished. """
+    if jobCheckpoint is None:
+        return
+    with jobCheckpointLock:
+        jobCheckpoint['stages'].pop(str(event_id), None)
+        if event_id not in jobCheckpoint['finishedEvents']:
+            jobCheckpoint['finishedEvents'].append(event_id)
+    saveCheckpoint()
+
+
+def getResumePoint(event_id, stages, aInitialConditionFile):
+    """
+        Return the index in "stages" of the stage from which event "event_id"
+        is to be performed, with the input of that stage. An event that was
+        interrupted continues after its last finished stage, as long as the
+        output of that stage is still there; otherwise it starts again.
+    """
+    record = None
+    if jobCheckpoint is not None:
+        record = jobCheckpoint['stages'].get(str(event_id))
+    stageNames = [stageName for stageName, stageFunction in stages]
+    if record and record['stage'] in stageNames:
+        stageOutput = record['output']
+        if isinstance(stageOutput, list):
+            outputFiles = stageOutput
+        elif stageOutput is None:
+            outputFiles = []
+        else:
+            outputFiles = [stageOutput]
+        if all([path.exists(aFile) for aFile in outputFiles]):
+            return stageNames.index(record['stage']) + 1, stageOutput
+    return 0, aInitialConditionFile
+
+
+def runEvent(event_id, aInitialConditionFile):
+    """
+        Perform all the stages of one event with the given absolute path to an
+        initial condition; the results are saved in the event result folder
+        for "event_id". The finished stages are recorded in the checkpoint,
+        and an interrupted event continues after its last finished stage.
+    """
+    controlParameterList['eventResultDir'] = getEventResultDirPath(event_id)
+    stages = getEventStages(controlParameterList['simulation_type'])
+    firstStage, stageOutput = getResumePoint(event_id, stages,
+                                             aInitialConditionFile)
+    if firstStage:
+        print("Resuming event %d after its %s stage..."
+              % (event_id, stages[firstStage-1][0]))
+    for stageName, stageFunction in stages[firstStage:]:
+        stageOutput = performStage(stageName, stageFunction, event_id,
+                                   stageOutput)
+        recordFinishedStage(event_id, stageName, stageOutput)
+    rmtree(getStageBufferDir(event_id), ignore_errors=True)
+    recordFinishedEvent(event_id)
+
+    #tarfile_name = (
+    #             controlParameterList['eventResultDir'].split('/')[-1])
+    #call("tar -cf %s.tar %s" % (tarfile_name, tarfile_name), 
+    #     shell=True, cwd=resultDir)
+    #call("rm -fr %s" % (tarfile_name,), shell=True, cwd=resultDir)
+
+
+def runPipelineStage(stageIndex, stageName, stageFunction, inputQueue,
+                     outputQueue, usage, failedEvents):
+    """
+        Perform the stage with index "stageIndex" for the events taken from
+        "inputQueue" and put them in "outputQueue", until None is taken.
+        Events resumed after this stage are passed on. The times spent in the
+        stage, waiting for an event and waiting for the next stage are added to
+        the "usage" dictionary. After an event has failed, the remaining events
+        are dropped.
+    """
+    while True:
+        waitStart = time()
+        item = inputQueue.get()
+        usage['waiting'] += time() - waitStart
+        if item is None:
+            outputQueue.put(None)
+            return
+        event_id, stageOutput, firstStage = item
+        if failedEvents:
+            continue
+        if stageIndex < firstStage:
+            outputQueue.put(item)
+            continue
+        currentEvent.resultDir = getEventResultDirPath(event_id)
+        stageStart = time()
+        try:
+            stageOutput = performStage(stageName, stageFunction, event_id,
+                                       stageOutput)
+            recordFinishedStage(event_id, stageName, stageOutput)
+        except Exception:
+            print_exc()
+            failedEvents.append(event_id)
+            continue
+        finally:
+            usage['busy'] += time() - stageStart
+        usage['events'] += 1
+        blockStart = time()
+        outputQueue.put((event_id, stageOutput, firstStage))
+        usage['blocked'] += time() - blockStart
+
+
+def feedPipeline(events, stages, firstQueue, failedEvents):
+    """
+        Put the given (event_id, initial condition) pairs into the queue of the
+        first stage, with the stage each event starts from, followed by None;
+        stop early when an event has failed.
+    """
+    for event_id, aInitialConditionFile in events:
+        if failedEvents:
+            break
+        firstStage, stageOutput = getResumePoint(event_id, stages,
+                                                 aInitialConditionFile)
+        firstQueue.put((event_id, stageOutput, firstStage))
+    firstQueue.put(None)
+
+
+def runEventsPipelined(events, nev):
+    """
+        Perform the given (event_id, initial condition) pairs, out of "nev"
+        events in the job, with the stages of
+        consecutive events overlapping: each stage runs in its own thread and
+        starts the next event as soon as it has passed the previous one on,
+        e.g. the hydro of the next event runs while UrQMD runs for this one.
+        At most pipelineQueueSize events wait between two stages; their files
+        are kept in stageBufferDir. The utilization of each stage is printed at
+        the end. When an event fails, no more events are started and
+        ExecutionError is raised once the stages are finished.
+    """
+    stages = getEventStages(controlParameterList['simulation_type'])
+    queueSize = controlParameterList['pipelineQueueSize']
+    queues = [Queue(queueSize) for aStage in stages] + [Queue()]
+    usages = []
+    failedEvents = []
+    threads = []
+    for index, (stageName, stageFunction) in enumerate(stages):
+        usage = {'name': stageName, 'events': 0, 'busy': 0.0,
+                 'waiting': 0.0, 'blocked': 0.0}
+        usages.append(usage)
+        aThread = Thread(target=runPipelineStage,
+                         args=(index, stageName, stageFunction,
+                               queues[index], queues[index+1], usage,
+                               failedEvents))
+        aThread.daemon = True
+        aThread.start()
+        threads.append(aThread)
+
+    startTime = time()
+    feeder = Thread(target=feedPipeline,
+                    args=(events, stages, queues[0], failedEvents))
+    feeder.daemon = True
+    feeder.start()
+    threads.append(feeder)
+
+    numberOfFinishedEvents = nev - len(events)
+    while True:
+        item = queues[-1].get()
+        if item is None:
+            break
+        rmtree(getStageBufferDir(item[0]), ignore_errors=True)
+        recordFinishedEvent(item[0])
+        numberOfFinishedEvents += 1
+        stdout.write("PROGRESS: %d events out of %d finished.\n"
+                     % (numberOfFinishedEvents, nev))
+        stdout.flush()
+    for aThread in threads:
+        aThread.join()
+
+    # print the utilization of the stages
+    wallTime = time() - startTime
+    print("-"*80)
+    print("Pipeline stage utilization in %.1f s:" % wallTime)
+    print("%-18s%8s%12s%10s%14s%14s" % ("stage", "events", "busy (s)",
+                                      "busy %", "waiting (s)", "blocked (s)"))
+    for usage in usages:
+        print("%-18s%8d%12.1f%10.1f%14.1f%14.1f" % (
+            usage['name'], usage['events'], usage['busy'],
+            100.0*usage['busy']/max(wallTime, 1e-9), usage['waiting'],
+            usage['blocked']))
+    print("-"*80)
+    stdout.flush()
+
+    if failedEvents:
+        raise ExecutionError("Event %d failed!" % failedEvents[0])
+
+
+def getStageDirectories():
+    """
+        Return the names of the folders in rootDir in which the stages of an
+        event run.
+    """
+    return [aControl['mainDir'] for aControl in (
+        preEquilibriumControl, hydroControl, iSSControl, iSControl,
+        photonEmissionControl, osc2uControl, urqmdControl, binUtilitiesControl)]
+
+
+def replicateFolder(sourceDir, targetDir):
+    """
+        Create in "targetDir" the same tree of folders as in "sourceDir".
+        Files smaller than slotCopySizeLimit are copied, since the stages may
+        overwrite them, and larger files (tables, executables) are linked.
+    """
+    sizeLimit = controlParameterList['slotCopySizeLimit']
+    for dirPath, dirNames, fileNames in walk(sourceDir):
+        targetPath = path.normpath(
+            path.join(targetDir, path.relpath(dirPath, sourceDir)))
+        makedirs(targetPath)
+        for aDir in list(dirNames):
+            if path.islink(path.join(dirPath, aDir)):
+                dirNames.remove(aDir)
+                fileNames.append(aDir)
+        for aFile in fileNames:
+            source = path.join(dirPath, aFile)
+            if path.isfile(source) and path.getsize(source) < sizeLimit:
+                copy2(source, path.join(targetPath, aFile))
+            else:
+                symlink(path.realpath(source), path.join(targetPath, aFile))
+
+
+def createSlot(slotDir):
+    """
+        Create the working tree of a slot in "slotDir", in which the stages of
+        one event at a time run without touching the folders of other slots.
+        The stage folders are replicated with replicateFolder; everything else
+        in rootDir (superMC, EbeCollector, tables, etc.) is linked. The
+        executables should be compiled before the slots are created.
+    """
+    rootDir = controlParameterList['rootDir']
+    if path.exists(slotDir):
+        rmtree(slotDir)
+    makedirs(slotDir)
+    stageDirectories = getStageDirectories()
+    for anEntry in listdir(rootDir):
+        source = path.join(rootDir, anEntry)
+        if path.realpath(source) == path.realpath(
+                                        controlParameterList['slotsDir']):
+            continue
+        if anEntry in stageDirectories and path.isdir(source):
+            replicateFolder(source, path.join(slotDir, anEntry))
+        else:
+            symlink(path.realpath(source), path.join(slotDir, anEntry))
+
+
+def runEventInSlot(slotDir, event_id, aInitialConditionFile, urqmdLock):
+    """
+        Perform one event in the slot "slotDir"; this is the function run by
+        the processes started by runEventsConcurrently. The output of the
+        event goes to the RunRecord.txt file of the slot.
+    """
+    global combinedUrqmdFileLock, jobCheckpoint
+    record = open(path.join(slotDir, 'RunRecord.txt'), 'a')
+    stdout.flush()
+    stderr.flush()
+    dup2(record.fileno(), stdout.fileno())
+    dup2(record.fileno(), stderr.fileno())
+    combinedUrqmdFileLock = urqmdLock
+    # the checkpoint is kept by the parent process
+    jobCheckpoint = None
+    controlParameterList['rootDir'] = slotDir
+    runEvent(event_id, aInitialConditionFile)
+    stdout.flush()
+
+
+def runEventsConcurrently(events, nev, numberOfSlots):
+    """
+        Perform the given (event_id, initial condition) pairs, out of "nev"
+        events in the job, with up to "numberOfSlots" events at the same time.
+        Each slot has its own working tree in slotsDir (see createSlot) and
+        runs its events in a separate process; an event is started as soon as
+        a slot is free. Finished events are recorded in the checkpoint, and an
+        interrupted event starts again when the job is resumed. When an event
+        fails, no more events are started and ExecutionError is raised once the
+        running ones are finished.
+    """
+    slotDirs = []
+    for slot_id in range(1, numberOfSlots + 1):
+        slotDir = path.join(controlParameterList['slotsDir'], 'slot-%d' % slot_id)
+        print("Creating slot %s..." % slotDir)
+        createSlot(slotDir)
+        slotDirs.append(slotDir)
+
+    # the slot processes are forked so that they inherit the parameters read
+    # in by this one
+    urqmdLock = forkContext.Lock()
+    pendingEvents = list(events)
+    freeSlots = list(slotDirs)
+    runningEvents = {} # slot folder -> (event_id, process)
+    numberOfFinishedEvents = nev - len(events)
+    failedEvents = []
+    while runningEvents or (pendingEvents and not failedEvents):
+        # dispatch events to free slots
+        while freeSlots and pendingEvents and not failedEvents:
+            event_id, aInitialConditionFile = pendingEvents.pop(0)
+            slotDir = freeSlots.pop(0)
+            print("Starting event %d in %s..." % (event_id, slotDir))
+            stdout.flush()
+            process = forkContext.Process(target=runEventInSlot,
+                args=(slotDir, event_id, aInitialConditionFile, urqmdLock))
+            process.start()
+            runningEvents[slotDir] = (event_id, process)
+        # wait for events to finish
+        finishedSlots = [slotDir for slotDir, (event_id, process)
+                         in runningEvents.items() if not process.is_alive()]
+        if not finishedSlots:
+            sleep(1.0)
+            continue
+        for slotDir in finishedSlots:
+            event_id, process = runningEvents.pop(slotDir)
+            process.join()
+            freeSlots.append(slotDir)
+            if process.exitcode != 0:
+                print("Event %d failed; see %s." % (event_id,
+                      path.join(slotDir, 'RunRecord.txt')))
+                failedEvents.append(event_id)
+            else:
+                recordFinishedEvent(event_id)
+                numberOfFinishedEvents += 1
+                stdout.write("PROGRESS: %d events out of %d finished.\n"
+                             % (numberOfFinishedEvents, nev))
+            stdout.flush()
+
+    if failedEvents:
+        raise ExecutionError("Events %s failed!"
+                             % ", ".join(str(item) for item in failedEvents))
 
 
 def sequentialEventDriverShell():
@@ -1046,146 +2027,87 @@ def sequentialEventDriverShell():
         Perform a sequential calculations for a given number of events.
         Parameters are read from dictionaries given by allParameterList.
     """
+    global jobCheckpoint
     try:
         # read parameters
         readInParameters()
         translate_centrality_cut()
+        if (controlParameterList['pipelineEvents']
+            and controlParameterList['numberOfConcurrentEvents'] > 1):
+            raise ExecutionError("pipelineEvents cannot be combined with "
+                                 "numberOfConcurrentEvents > 1!")
 
-        # create result folder
-        resultDir = controlParameterList['resultDir']
-        if path.exists(resultDir):
-            rmtree(resultDir)
-            makedirs(resultDir)
+        fingerprint = getParameterFingerprint()
 
         # get simulation type
         simulationType = controlParameterList['simulation_type']
 
-        event_id = 0
-
-        # generate initial conditions then loop over initial conditions
-        initial_condition_list = get_initial_condition_list()
+        # resume an interrupted job with the same parameters from its
+        # checkpoint, or start afresh when there is none
+        resultDir = controlParameterList['resultDir']
+        jobCheckpoint = loadCheckpoint(fingerprint)
+        if jobCheckpoint:
+            initial_condition_list = jobCheckpoint['initialConditions']
+            print("Resuming from the checkpoint in %s..." % resultDir)
+        else:
+            # create result folder
+            if path.exists(resultDir):
+                rmtree(resultDir)
+            makedirs(resultDir)
+            rmtree(controlParameterList['stageBufferDir'], ignore_errors=True)
+
+            # generate initial conditions
+            initial_condition_list = get_initial_condition_list()
+            if getCheckpointFile():
+                jobCheckpoint = {
+                    'parameters'        :   fingerprint,
+                    'initialConditions' :   initial_condition_list,
+                    'finishedEvents'    :   [],
+                    'stages'            :   {}, # event_id -> last stage
+                    'collected'         :   False,
+                }
+                saveCheckpoint()
         nev = len(initial_condition_list)
+        finishedEvents = []
+        if jobCheckpoint:
+            finishedEvents = jobCheckpoint['finishedEvents']
+        events = [(event_id, aInitialConditionFile) for event_id,
+                  aInitialConditionFile in enumerate(initial_condition_list, 1)
+                  if event_id not in finishedEvents]
+        numberOfFinishedEvents = nev - len(events)
 
         # print current progress to terminal
         stdout.write("PROGRESS: %d events out of %d finished.\n" 
-                     % (event_id, nev))
+                     % (numberOfFinishedEvents, nev))
         stdout.flush()
 
-        # loop over initial conditions
-        for aInitialConditionFile in initial_condition_list:
-            event_id += 1
-            eventResultDir = path.join(resultDir, 
-                controlParameterList['eventResultDirPattern'] % event_id)
-            controlParameterList['eventResultDir'] = eventResultDir
-            if path.exists(eventResultDir):
-                rmtree(eventResultDir)
-            makedirs(eventResultDir)
-
-            # print current progress to terminal
-            print("Starting event %d..." % event_id)
-           
-            initial_type = initial_condition_control['initial_condition_type']
-            if initial_type == 'superMC':    # initial conditions from superMC
-                if superMCControl['saveICFile']:
-                    initial_id = int(
-                        aInitialConditionFile.split('/')[-1].split('_')[2])
-                    superMCDataDirectory = path.join(
-                        controlParameterList['rootDir'], 
-                        superMCControl['mainDir'], superMCControl['dataDir'])
-                    file_list = glob(path.join(superMCDataDirectory,
-                        superMCControl['dataFiles'] % initial_id))
-                    for aFile in file_list:
-                        copy(aFile, controlParameterList['eventResultDir'])
-            elif initial_type == 'pre-generated':  
-                # initial conditions from pre-generated files
-                copy(aInitialConditionFile, 
-                     controlParameterList['eventResultDir'])
-            
-            if simulationType == 'hydroEM_preEquilibrium':
-                # perform hydro calculations with pre-equilibrium evolution 
-                # and get a list of all the result filenames
-                hydroResultFiles = [aFile for aFile in 
-                             hydro_with_pre_equilbirium(aInitialConditionFile)]
-            else:
-                # perform hydro calculations and get a list of all the result 
-                # filenames
-                hydroResultFiles = [aFile for aFile in 
-                              hydroWithInitialCondition(aInitialConditionFile)]
-            
-            # fork simulation type here
-            if simulationType == 'hybrid':
-                # perform iSS calculation and return the path to the OSCAR file
-                OSCARFilePath = iSSWithHydroResultFiles(hydroResultFiles)
-                # perform osc2u
-                osc2uOutputFilePath = osc2uFromOSCARFile(OSCARFilePath)
-                # now urqmd
-                urqmdOutputFilePath = urqmdFromOsc2uOutputFile(
-                                                           osc2uOutputFilePath)
-
-                # copy and concatnate final results from all hydro events 
-                # into one file
-                combinedUrqmdFile = path.join(
-                    controlParameterList['resultDir'], 
-                    controlParameterList['combinedUrqmdFile'])
-                open(combinedUrqmdFile, 'a').writelines(
-                                         open(urqmdOutputFilePath).readlines())
-
-                # bin the combined result file to get flows
-                binUrqmdResultFiles(urqmdOutputFilePath)
-
-                # delete the huge final UrQMD combined file
-                remove(urqmdOutputFilePath)
-
-            elif simulationType == 'hydro':
-                # perform iS calculation and resonance decays
-                iSWithResonancesWithHydroResultFiles(hydroResultFiles)
-            
-            elif simulationType == 'hydroEM':
-                h5file = iSSeventplaneAngleWithHydroResultFiles(
-                                                              hydroResultFiles)
-                # perform EM radiation calculation
-                photonEmissionWithHydroResultFiles(h5file)
-    
-            elif simulationType == 'hydroEM_with_decaycocktail':
-                h5file = iSWithResonancesWithdecayPhotonWithHydroResultFiles(
-                                                              hydroResultFiles)
-                # perform EM radiation calculation
-                photonEmissionWithHydroResultFiles(h5file)
-            
-            elif simulationType == 'hydroEM_preEquilibrium':
-                # perform iS calculation and resonance decays
-                h5file = iSWithResonancesWithdecayPhotonWithHydroResultFiles(
-                                                              hydroResultFiles)
-                # perform EM radiation calculation
-                photonEmissionWithHydroResultFiles(h5file)
-            
-            elif simulationType == 'hydroEM_with_decaycocktail_with_urqmd':
-                h5file = iSWithResonancesWithdecayPhotonWithHydroResultFiles(
-                                                              hydroResultFiles)
-                # perform EM radiation calculation
-                photonEmissionWithHydroResultFiles(h5file)
-                
-                # perform iSS calculation and return the path to the OSCAR file
-                OSCARFilePath = iSSWithHydroResultFiles(hydroResultFiles)
-                # perform osc2u
-                osc2uOutputFilePath = osc2uFromOSCARFile(OSCARFilePath)
-                # now urqmd
-                urqmdOutputFilePath = urqmdFromOsc2uOutputFile(
-                                                           osc2uOutputFilePath)
-
-            #tarfile_name = (
-            #             controlParameterList['eventResultDir'].split('/')[-1])
-            #call("tar -cf %s.tar %s" % (tarfile_name, tarfile_name), 
-            #     shell=True, cwd=resultDir)
-            #call("rm -fr %s" % (tarfile_name,), shell=True, cwd=resultDir)
-
-            # print current progress to terminal
-            stdout.write("PROGRESS: %d events out of %d finished.\n" 
-                         % (event_id, nev))
-            stdout.flush()
+        if controlParameterList['pipelineEvents']:
+            runEventsPipelined(events, nev)
+        elif controlParameterList['numberOfConcurrentEvents'] > 1:
+            runEventsConcurrently(events, nev,
+                                  controlParameterList['numberOfConcurrentEvents'])
+        else:
+            # loop over initial conditions
+            for event_id, aInitialConditionFile in events:
+                runEvent(event_id, aInitialConditionFile)
+
+                # print current progress to terminal
+                numberOfFinishedEvents += 1
+                stdout.write("PROGRESS: %d events out of %d finished.\n" 
+                             % (numberOfFinishedEvents, nev))
+                stdout.flush()
 
         # collect mostly used data into a database
-        collectEbeResultsToDatabaseFrom(resultDir)
+        if not (jobCheckpoint and jobCheckpoint['collected']):
+            # remove the databases of an interrupted collection
+            for aDatabase in (EbeCollectorParameters['databaseFilename'],
+                              'particles.db'):
+                if path.exists(path.join(resultDir, aDatabase)):
+                    remove(path.join(resultDir, aDatabase))
+            collectEbeResultsToDatabaseFrom(resultDir)
+            if jobCheckpoint:
+                jobCheckpoint['collected'] = True
+                saveCheckpoint()
 
     except ExecutionError as e:
         print("Errors encountered during execution, aborting.")
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+"""
+    Summarize the telemetry recorded by SequentialEventDriver.py: for each
+    stage, the distributions over all events of its wall time, CPU time, peak
+    RSS, block I/O and the bytes of the files it moved without copying and
+    copied, and the same for the commands run in each folder. The
+    telemetry.jsonl files are searched in the given folders and their
+    subdirectories, so the results of a whole farm can be summarized at once.
+
+    Usage: telemetryReport.py folder_or_file [folder_or_file ...] [--commands]
+"""
+
+from sys import argv, exit
+from os import path, walk
+import json
+
+telemetryFilename = "telemetry.jsonl"
+
+def findTelemetryFiles(paths):
+    """ Yield the telemetry files given or found in the given folders. """
+    for aPath in paths:
+        if path.isfile(aPath):
+            yield aPath
+            continue
+        for dirPath, dirNames, fileNames in walk(aPath):
+            if telemetryFilename in fileNames:
+                yield path.join(dirPath, telemetryFilename)
+
+
+def readRecords(fileList):
+    """
+        Return all the records in the given files. Lines that cannot be read,
+        like the last one of a job that was killed while writing, are skipped.
+    """
+    records = []
+    for aFile in fileList:
+        for aLine in open(aFile):
+            try:
+                records.append(json.loads(aLine))
+            except ValueError:
+                pass
+    return records
+
+
+def percentile(sortedValues, fraction):
+    """ Return the given percentile of a sorted list, 0 <= fraction <= 1. """
+    return sortedValues[int(round(fraction*(len(sortedValues)-1)))]
+
+
+def summarize(records, groupKey, withTransfers=False):
+    """
+        Print the distributions of the resources used by the given records,
+        grouped by "groupKey"; with "withTransfers" also the bytes of the
+        files moved and copied.
+    """
+    groups = {}
+    for aRecord in records:
+        groups.setdefault(aRecord.get(groupKey) or "-", []).append(aRecord)
+    quantities = [
+        ("wall time (s)", lambda r: r["wallTime"]),
+        ("CPU time (s)", lambda r: r["userTime"] + r["systemTime"]),
+        ("peak RSS (MB)", lambda r: r["peakRSS"]/1024.0),
+        ("I/O (MB)", lambda r: (r["readBytes"] + r["writtenBytes"])/1048576.0),
+    ]
+    if withTransfers:
+        quantities.extend([
+            ("moved (MB)", lambda r: (r.get("movedBytes", 0)
+                                      + r.get("linkedBytes", 0)
+                                      + r.get("clonedBytes", 0))/1048576.0),
+            ("copied (MB)", lambda r: r.get("copiedBytes", 0)/1048576.0),
+        ])
+    print("%-20s%-16s%8s%12s%12s%12s%12s%12s" % (
+          groupKey, "", "count", "mean", "p50", "p90", "max", "total"))
+    for aGroup in sorted(groups):
+        groupRecords = groups[aGroup]
+        for index, (name, value) in enumerate(quantities):
+            values = sorted(value(aRecord) for aRecord in groupRecords)
+            print("%-20s%-16s%8d%12.2f%12.2f%12.2f%12.2f%12.1f" % (
+                  aGroup if index == 0 else "", name, len(values),
+                  sum(values)/len(values), percentile(values, 0.5),
+                  percentile(values, 0.9), values[-1], sum(values)))
+    print("")
+
+
+if __name__ == "__main__":
+    showCommands = "--commands" in argv[1:]
+    paths = [anArg for anArg in argv[1:] if anArg != "--commands"]
+    if not paths:
+        print(__doc__)
+        exit()
+
+    fileList = list(findTelemetryFiles(paths))
+    records = readRecords(fileList)
+    stageRecords = [aRecord for aRecord in records
+                    if aRecord.get("type") == "stage"]
+    commandRecords = [aRecord for aRecord in records
+                      if aRecord.get("type") == "command"]
+    numberOfFailures = len([aRecord for aRecord in stageRecords
+                            if aRecord.get("failed")])
+    print("%d records from %d files, %d hosts; %d stages failed."
+          % (len(records), len(fileList),
+             len(set(aRecord.get("host") for aRecord in records)),
+             numberOfFailures))
+    print("")
+    if stageRecords:
+        summarize(stageRecords, "stage", withTransfers=True)
+    if showCommands and commandRecords:
+        summarize(commandRecords, "folder")
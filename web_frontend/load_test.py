@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+"""
+Load test of the query server.
+
+Generates synthetic collected.db databases of the given numbers of events,
+starts a query server on them (manage.py runserver, with its own settings), and
+replays a weighted mix of uhg expressions at each given concurrency for a
+fixed time. For each database size and concurrency it reports the throughput,
+the error rate and the latency percentiles, overall and per expression.
+
+Results can be saved as a baseline and compared with a saved baseline:
+
+    python load_test.py --events 200,2000 --concurrency 1,4,16 \\
+        --save-baseline baseline.json
+    python load_test.py --events 200,2000 --concurrency 1,4,16 \\
+        --compare-baseline baseline.json
+
+The databases are kept in --work-dir between runs (they are only generated
+when missing), and "python load_test.py --generate-only" only generates them.
+Use --url to test a server that is already running instead; its databases
+must then be the generated ones.
+
+The expression mix is read from --mix, a file with one
+"name weight format expression" per line (see DEFAULT_MIX). The result cache
+of the server is disabled unless --result-cache is given, so that every
+request evaluates its expression.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:  # python 2
+    from urllib import urlencode
+    from urllib2 import urlopen, HTTPError, URLError
+
+import numpy
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EBE_COLLECTOR_PATH = os.path.join(HERE, os.pardir, "EBE-Node", "EbeCollector")
+sys.path.append(EBE_COLLECTOR_PATH)
+
+from DBR import SqliteDB
+from EbeCollector import EbeCollector
+
+
+# name, weight, output format, expression
+DEFAULT_MIX = [
+    ("v2{2}", 4, "plain", "v_2[2](pion)"),
+    ("v2{4}", 1, "plain", "v_2[4](pion)"),
+    ("<e2>", 2, "plain", "<e_2(ed)>"),
+    ("<v2>/<e2>", 2, "plain", "<v_2(pion)>/<e_2(ed)>"),
+    ("<dN/dy>", 2, "plain", "<dN/dy(pion)>"),
+    ("diff v2{2}", 1, "json", "v_2[2](linspace(0.2,2,10))(pion)"),
+    ("<spectrum>", 1, "json", "<dN/dydpT(linspace(0.2,2,10))(pion)>"),
+    ("V2 per event", 1, "npy", "V_2(pion)"),
+]
+
+PARTICLES = ["total", "charged", "pion", "kaon", "nucleon", "charged_hydro"]
+ECC_TYPES = [(1, "sd"), (2, "ed")]
+PT_VALUES = numpy.linspace(0.1, 3.0, 15)
+ORDERS = range(1, 10)
+
+
+def generate_database(database_path, number_of_events, seed=0,
+                      aggregate_tables=False):
+    """Writes a database with the tables of a collected.db, filled with
+    random events whose flows respond linearly to their eccentricities."""
+    random_state = numpy.random.RandomState(seed)
+    collector = EbeCollector()
+    pids = [collector.pidDict[name] for name in PARTICLES]
+    temporary_path = database_path + ".tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    db = SqliteDB(temporary_path)
+    db.createTableIfNotExists("pid_lookup",
+                              (("name", "text"), ("pid", "integer")))
+    db.insertIntoTable("pid_lookup", list(collector.pidDict.items()))
+    db.createTableIfNotExists("ecc_id_lookup",
+                              (("ecc_id", "integer"), ("ecc_type_name", "text")))
+    db.insertIntoTable("ecc_id_lookup", ECC_TYPES)
+    db.createTableIfNotExists("collisionParameters",
+        (("event_id", "integer"), ("Npart", "integer"), ("Ncoll", "integer"),
+         ("b", "real"), ("total_entropy", "real")))
+    db.createTableIfNotExists("eccentricities",
+        (("event_id", "integer"), ("ecc_id", "integer"),
+         ("r_power", "integer"), ("n", "integer"),
+         ("ecc_real", "real"), ("ecc_imag", "real")))
+    db.createTableIfNotExists("r_integrals",
+        (("event_id", "integer"), ("ecc_id", "integer"),
+         ("r_power", "integer"), ("r_inte", "real")))
+    db.createTableIfNotExists("inte_vn",
+        (("event_id", "integer"), ("pid", "integer"), ("n", "integer"),
+         ("vn_real", "real"), ("vn_imag", "real")))
+    db.createTableIfNotExists("diff_vn",
+        (("event_id", "integer"), ("pid", "integer"), ("pT", "real"),
+         ("n", "integer"), ("vn_real", "real"), ("vn_imag", "real")))
+    db.createTableIfNotExists("multiplicities",
+        (("event_id", "integer"), ("pid", "integer"), ("N", "real")))
+    db.createTableIfNotExists("spectra",
+        (("event_id", "integer"), ("pid", "integer"), ("pT", "real"),
+         ("N", "real")))
+
+    for event_id in range(1, number_of_events + 1):
+        b = random_state.uniform(0, 14)
+        npart = int(400 * (1 - b / 14.0)) + 2
+        db.insertIntoTable("collisionParameters",
+                           [(event_id, npart, 3 * npart, b, 20.0 * npart)])
+        eccentricities, r_integrals = [], []
+        for ecc_id, _ in ECC_TYPES:
+            for n in ORDERS:
+                for r_power in sorted(set((n, 2))):
+                    ecc = random_state.normal(0, 0.05 + 0.005 * b, 2)
+                    if n == 2:
+                        ecc[0] += 0.04 * b  # from the collision geometry
+                    eccentricities.append((event_id, ecc_id, r_power, n,
+                                           ecc[0], ecc[1]))
+            r_integrals.extend((event_id, ecc_id, r_power,
+                                random_state.uniform(1, 10))
+                               for r_power in range(10))
+        db.insertIntoTable("eccentricities", eccentricities)
+        db.insertIntoTable("r_integrals", r_integrals)
+        # the flows of the "ed" eccentricities with r^n weight
+        responses = dict(((row[3], row[4] + 1j * row[5])
+                          for row in eccentricities
+                          if row[1] == 2 and row[2] == row[3]))
+        inte_vn, diff_vn, multiplicities, spectra = [], [], [], []
+        for pid in pids:
+            multiplicity = 2.5 * npart + random_state.normal(0, 5)
+            multiplicities.append((event_id, pid, multiplicity))
+            spectra.extend((event_id, pid, pT,
+                            multiplicity * numpy.exp(-pT))
+                           for pT in PT_VALUES)
+            for n in ORDERS:
+                vn = 0.2 * responses[n] + complex(
+                    *random_state.normal(0, 0.02, 2))
+                inte_vn.append((event_id, pid, n, vn.real, vn.imag))
+                diff_vn.extend((event_id, pid, pT, n, vn.real * pT,
+                                vn.imag * pT) for pT in PT_VALUES)
+        db.insertIntoTable("inte_vn", inte_vn)
+        db.insertIntoTable("diff_vn", diff_vn)
+        db.insertIntoTable("multiplicities", multiplicities)
+        db.insertIntoTable("spectra", spectra)
+
+    collector.updateEventCatalog(db)
+    if aggregate_tables:
+        collector.updateAggregateTables(db)
+    db.closeConnection()
+    os.rename(temporary_path, database_path)
+
+
+def read_mix(file_name):
+    mix = []
+    with open(file_name) as mix_file:
+        for line in mix_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, weight, output_format, expression = line.split(None, 3)
+            mix.append((name, float(weight), output_format, expression))
+    return mix
+
+
+def get_free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+class LocalServer(object):
+    """Runs manage.py runserver on the databases in a folder, with settings
+    that import the project settings and override the query server ones."""
+
+    def __init__(self, database_directory, result_cache=False, port=None):
+        self.port = port or get_free_port()
+        self.url = "http://127.0.0.1:%d" % self.port
+        self.settings_directory = tempfile.mkdtemp()
+        with open(os.path.join(self.settings_directory,
+                               "load_test_settings.py"), "w") as settings:
+            settings.write(
+                "from web_frontend.settings import *\n"
+                "DEBUG = False\n"
+                "TEMPLATE_DEBUG = False\n"
+                "ALLOWED_HOSTS = ['127.0.0.1']\n"
+                "QUERY_DATABASE_DIRECTORY = %r\n"
+                "QUERY_CACHE_MEMORY_BYTES = %d\n"
+                "QUERY_CACHE_DISK_BYTES = 0\n"
+                "QUERY_DATABASE_INDEX_FILE = None\n"
+                "QUERY_JOB_DATABASE = %r\n"
+                % (os.path.abspath(database_directory),
+                   64 << 20 if result_cache else 0,
+                   os.path.join(self.settings_directory, "jobs.sqlite3")))
+        environment = dict(os.environ)
+        environment["DJANGO_SETTINGS_MODULE"] = "load_test_settings"
+        environment["PYTHONPATH"] = os.pathsep.join(
+            [self.settings_directory, HERE, EBE_COLLECTOR_PATH] +
+            [item for item in [os.environ.get("PYTHONPATH")] if item])
+        self.log = open(os.path.join(self.settings_directory, "server.log"),
+                        "w")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "manage.py"), "runserver",
+             "--noreload", "127.0.0.1:%d" % self.port],
+            cwd=HERE, env=environment, stdout=self.log,
+            stderr=subprocess.STDOUT)
+
+    def wait_until_ready(self, timeout=60.0):
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            if self.process.poll() is not None:
+                break
+            try:
+                urlopen(self.url + "/status", timeout=5).read()
+                return
+            except (URLError, socket.error):
+                time.sleep(0.2)
+        self.stop(keep_log=True)
+        raise RuntimeError("The server did not start; see %s."
+                           % self.log.name)
+
+    def stop(self, keep_log=False):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.log.close()
+        if not keep_log:
+            shutil.rmtree(self.settings_directory, ignore_errors=True)
+
+
+def get_query_urls(url, database_name, mix):
+    return [url + "/query?" + urlencode({"database": database_name,
+                                         "expr": expression,
+                                         "fmt": output_format})
+            for _, _, output_format, expression in mix]
+
+
+def send_query(query_url):
+    """Returns True when the query succeeds."""
+    try:
+        body = urlopen(query_url, timeout=300).read()
+    except (HTTPError, URLError, socket.error):
+        return False
+    # the error page is returned with status 200
+    return b'class="error"' not in body[:200]
+
+
+def run_load(url, database_name, mix, concurrency, duration, seed=0):
+    """Sends requests from "concurrency" clients, each sending its next
+    request when the previous one is answered, for "duration" seconds.
+    Returns a list of (name, latency, ok) for all requests."""
+    names = [item[0] for item in mix]
+    weights = numpy.array([item[1] for item in mix], dtype=float)
+    cumulative_weights = numpy.cumsum(weights / weights.sum())
+    urls = get_query_urls(url, database_name, mix)
+    records = []
+    records_lock = threading.Lock()
+    end_time = time.time() + duration
+
+    def client(client_seed):
+        random_generator = random.Random(client_seed)
+        client_records = []
+        while time.time() < end_time:
+            index = min(int(numpy.searchsorted(cumulative_weights,
+                                               random_generator.random())),
+                        len(urls) - 1)
+            start_time = time.time()
+            ok = send_query(urls[index])
+            client_records.append((names[index], time.time() - start_time,
+                                   ok))
+        with records_lock:
+            records.extend(client_records)
+
+    clients = [threading.Thread(target=client, args=(seed * 1000 + index,))
+               for index in range(concurrency)]
+    for a_client in clients:
+        a_client.start()
+    for a_client in clients:
+        a_client.join()
+    return records
+
+
+def summarize(records, duration):
+    latencies = numpy.array([latency for _, latency, _ in records])
+    errors = sum(1 for _, _, ok in records if not ok)
+    summary = {"requests": len(records),
+               "throughput": len(records) / float(duration),
+               "error_rate": errors / float(len(records)) if records else 0.0}
+    if len(latencies):
+        for percentile in (50, 90, 99):
+            summary["p%d_ms" % percentile] = 1000 * float(
+                numpy.percentile(latencies, percentile))
+        summary["max_ms"] = 1000 * float(latencies.max())
+    return summary
+
+
+def print_table(results, baseline=None):
+    columns = ("requests", "throughput", "error_rate", "p50_ms", "p90_ms",
+               "p99_ms", "max_ms")
+    print("%8s%6s  %-14s" % ("events", "conc", "expression") +
+          "".join("%12s" % column for column in columns))
+    baseline_results = {}
+    if baseline:
+        baseline_results = dict(((item["events"], item["concurrency"],
+                                  item["expression"]), item)
+                                for item in baseline["results"])
+    for item in results:
+        print("%8d%6d  %-14s" % (item["events"], item["concurrency"],
+                                 item["expression"][:14]) +
+              "".join("%12.3f" % item.get(column, float("nan"))
+                      if column != "requests" else "%12d" % item[column]
+                      for column in columns))
+        reference = baseline_results.get(
+            (item["events"], item["concurrency"], item["expression"]))
+        if reference:
+            print("%8s%6s  %-14s" % ("", "", "vs baseline") +
+                  "".join("%12s" % _format_change(item, reference, column)
+                          for column in columns))
+
+
+def _format_change(item, reference, column):
+    if column == "requests":
+        return ""
+    if column == "error_rate":
+        return "%+.3f" % (item[column] - reference[column])
+    if not reference.get(column):
+        return "-"
+    return "x%.2f" % (item.get(column, 0) / reference[column])
+
+
+def get_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=HERE,
+            stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="200,2000",
+                        help="numbers of events of the generated databases")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="seconds of load for each database and "
+                             "concurrency")
+    parser.add_argument("--mix", help="file with the expression mix")
+    parser.add_argument("--work-dir", default=os.path.join(
+        tempfile.gettempdir(), "iebe_load_test"),
+        help="folder of the generated databases")
+    parser.add_argument("--aggregate-tables", action="store_true",
+                        help="add aggregate tables to the databases")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="keep the result cache of the server enabled")
+    parser.add_argument("--url", help="use the server running at this url")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generate-only", action="store_true")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare-baseline", metavar="FILE")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    event_counts = [int(item) for item in arguments.events.split(",")]
+    concurrencies = [int(item) for item in arguments.concurrency.split(",")]
+    mix = read_mix(arguments.mix) if arguments.mix else DEFAULT_MIX
+
+    if not os.path.isdir(arguments.work_dir):
+        os.makedirs(arguments.work_dir)
+    suffix = "_aggregates" if arguments.aggregate_tables else ""
+    database_names = {}
+    for number_of_events in event_counts:
+        database_names[number_of_events] = "load_test_%d%s" % (
+            number_of_events, suffix)
+        database_path = os.path.join(
+            arguments.work_dir, database_names[number_of_events] + ".db")
+        if not os.path.exists(database_path):
+            print("Generating %s" % database_path)
+            start_time = time.time()
+            generate_database(database_path, number_of_events,
+                              arguments.seed, arguments.aggregate_tables)
+            print("    %.1f seconds, %.1f MB" % (
+                time.time() - start_time,
+                os.path.getsize(database_path) / 1048576.0))
+    if arguments.generate_only:
+        return
+
+    server = None
+    if arguments.url:
+        url = arguments.url.rstrip("/")
+    else:
+        server = LocalServer(arguments.work_dir, arguments.result_cache)
+        server.wait_until_ready()
+        url = server.url
+    results = []
+    try:
+        for number_of_events in event_counts:
+            database_name = database_names[number_of_events]
+            # the first query of a database opens it
+            for query_url in get_query_urls(url, database_name, mix):
+                if not send_query(query_url):
+                    print("Warning: query failed: %s" % query_url)
+            for concurrency in concurrencies:
+                print("Running %d events, %d clients for %g seconds" % (
+                    number_of_events, concurrency, arguments.duration))
+                records = run_load(url, database_name, mix, concurrency,
+                                   arguments.duration, arguments.seed)
+                scenario = {"events": number_of_events,
+                            "concurrency": concurrency}
+                overall = dict(scenario, expression="all")
+                overall.update(summarize(records, arguments.duration))
+                results.append(overall)
+                for name, _, _, _ in mix:
+                    by_name = dict(scenario, expression=name)
+                    by_name.update(summarize(
+                        [record for record in records if record[0] == name],
+                        arguments.duration))
+                    results.append(by_name)
+    finally:
+        if server:
+            server.stop()
+
+    baseline = None
+    if arguments.compare_baseline:
+        with open(arguments.compare_baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("Compared with the baseline of version %s from %s" % (
+            baseline.get("version"), baseline.get("date")))
+    print_table(results, baseline)
+    if arguments.save_baseline:
+        with open(arguments.save_baseline, "w") as baseline_file:
+            json.dump({"version": get_version(),
+                       "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "duration": arguments.duration,
+                       "mix": mix,
+                       "results": results}, baseline_file, indent=1)
+        print("Baseline saved to %s" % arguments.save_baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from os import path, listdir
-from EbeCollector import EbeDBReader
+from os import path, listdir, stat
+
+from django.conf import settings
+from ReaderPool import ReaderPool
 
 
 # The following strings are used as query parameters.
@@ -7,30 +9,65 @@ EXPR_PARAM = "expr"
 DATABASE_PARAM = "database"
 FORMAT = "fmt"
 
-DATABASE_RELATIVE_PATH = "databases"
+DATABASE_RELATIVE_PATH = getattr(settings, "QUERY_DATABASE_DIRECTORY",
+                                 "databases")
+
+# Readers are shared by all requests served by this process, so a database is
+# opened (and its lookup tables and expression rules built) only once, and
+# again when the database file is replaced. Requests are served by several
+# threads, so each reader is used by one thread at a time.
+READER_POOL = ReaderPool(
+    maximumNumberOfReaders=getattr(settings, "QUERY_READER_POOL_SIZE", 8),
+    shareBetweenThreads=True)
 
 
 class QueryBridge(object):
-    def __init__(self):
+    def __init__(self, reader_pool=READER_POOL):
         self.database_name = ""
-        self.reader = None
+        self.reader_pool = reader_pool
 
     def set_database(self, database_name):
-        if not database_name.endswith(".db"):
-            database_name += ".db"
-
-        if database_name != self.database_name:
-            # "str" is used to convert type from unicode to str.
-            self.database_name = str(database_name)
-            self.reader = EbeDBReader(path.join(DATABASE_RELATIVE_PATH,
-                                                self.database_name))
+        database_name = get_database_file_name(database_name)
+        # Opens the database now so that a missing one is reported here.
+        self.reader_pool.getReader(
+            path.join(DATABASE_RELATIVE_PATH, database_name))
+        self.database_name = database_name
 
     def evaluate_expression(self, expr):
-        if self.reader:
-            return self.reader.evaluateExpressionOnly(expr)
+        if self.database_name:
+            with self.reader_pool.useReader(
+                    path.join(DATABASE_RELATIVE_PATH,
+                              self.database_name)) as reader:
+                return reader.evaluateExpressionOnly(expr)
         else:
             raise Exception("Invalid database.")
 
 
+def get_database_file_name(database_name):
+    if not database_name.endswith(".db"):
+        database_name += ".db"
+    # "str" is used to convert type from unicode to str.
+    return str(database_name)
+
+
+def get_database_path(database_name):
+    """Returns the absolute path of an existing database file."""
+    database_path = path.abspath(path.join(
+        DATABASE_RELATIVE_PATH, get_database_file_name(database_name)))
+    if not path.isfile(database_path):
+        raise ValueError("Database %s does not exist." % database_name)
+    return database_path
+
+
+def get_database_identity(database_name):
+    """Returns the (modification time, size) of the database file."""
+    try:
+        status = stat(path.join(DATABASE_RELATIVE_PATH,
+                                get_database_file_name(database_name)))
+    except OSError:
+        raise ValueError("Database %s does not exist." % database_name)
+    return status.st_mtime, status.st_size
+
+
 def get_available_database_names(path=DATABASE_RELATIVE_PATH):
     return [db_name for db_name in listdir(path) if db_name.endswith(".db")]
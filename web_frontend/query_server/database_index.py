@@ -0,0 +1,111 @@
+"""
+Index of the databases served by the query server, with their metadata.
+
+Reading the metadata of a database needs opening it, so the metadata is kept
+in an index, saved to a file so that it survives restarts. The index is
+refreshed at most every "refresh_seconds": the database folder is listed and
+only the databases that are new, modified or replaced (by size and
+modification time) are opened again. Between refreshes the listing is served
+from memory.
+"""
+import json
+import os
+import threading
+import time
+
+from DBR import SqliteDB
+from EbeCollector import EbeDBReader
+
+
+def read_metadata(database_path):
+    """Opens the database and returns its number of events, particles and
+    tables."""
+    reader = EbeDBReader(SqliteDB(database_path))
+    try:
+        db = reader.db
+        if reader.hasEventCatalog:
+            pids = db.selectFromTable("pid_catalog", "distinct pid")
+        else:
+            pids = db.selectFromTable("multiplicities", "distinct pid")
+        pids = sorted(item[0] for item in pids)
+        return {
+            "number_of_events": reader.getNumberOfEvents(),
+            "pids": pids,
+            "particles": sorted(name for name, pid in reader.pid_lookup.items()
+                                if pid in pids),
+            "tables": sorted(db.getAllTableNames()),
+        }
+    finally:
+        reader.db.closeConnection()
+
+
+class DatabaseIndex(object):
+    def __init__(self, directory, index_file=None, refresh_seconds=10.0):
+        self.directory = directory
+        self.index_file = index_file
+        self.refresh_seconds = refresh_seconds
+        self._entries = {}  # file name -> metadata
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        if index_file and os.path.exists(index_file):
+            try:
+                with open(index_file) as index:
+                    self._entries = dict(
+                        (entry["name"], entry) for entry in json.load(index))
+            except (IOError, ValueError, KeyError, TypeError):
+                self._entries = {}
+
+    def refresh(self, force=False):
+        """Updates the index when it is older than refresh_seconds. Only one
+        thread refreshes; the others keep using the current listing."""
+        if not force and time.time() - self._last_refresh < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(False):
+            return
+        try:
+            self._last_refresh = time.time()
+            entries = {}
+            changed = False
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith(".db"):
+                    continue
+                database_path = os.path.join(self.directory, file_name)
+                try:
+                    status = os.stat(database_path)
+                except OSError:
+                    continue  # removed meanwhile
+                entry = self._entries.get(file_name)
+                if (entry is None or entry["size"] != status.st_size or
+                        entry["mtime"] != status.st_mtime):
+                    entry = {"name": file_name, "size": status.st_size,
+                             "mtime": status.st_mtime}
+                    try:
+                        entry.update(read_metadata(database_path))
+                    except Exception as error:
+                        entry["error"] = "%s: %s" % (type(error).__name__,
+                                                     error)
+                    changed = True
+                entries[file_name] = entry
+            changed = changed or len(entries) != len(self._entries)
+            # Replaced at once so that readers never see a partial index.
+            self._entries = entries
+            if changed and self.index_file:
+                self._save()
+        finally:
+            self._refresh_lock.release()
+
+    def _save(self):
+        temporary_file = "%s.%d.tmp" % (self.index_file, os.getpid())
+        try:
+            with open(temporary_file, "w") as index:
+                json.dump(self.get_databases(refresh=False), index, indent=1)
+            os.rename(temporary_file, self.index_file)
+        except (IOError, OSError):
+            pass
+
+    def get_databases(self, refresh=True):
+        """Returns the metadata of all databases, sorted by name."""
+        if refresh:
+            self.refresh()
+        entries = self._entries
+        return [dict(entries[name]) for name in sorted(entries)]
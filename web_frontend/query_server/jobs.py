@@ -0,0 +1,256 @@
+"""
+Asynchronous evaluation of expressions that take too long for a request.
+
+Jobs are recorded in a SQLite job table and evaluated by a local process pool,
+so no external broker is needed. Submitting a job returns its id at once; the
+status and the result are then read from the job table, which can be shared by
+several server processes on the same machine. A job goes through the states
+
+    queued -> running -> done | failed
+    queued | running -> cancelled
+
+Results are kept as .npy bytes in the table. Finished jobs are removed after
+the retention time, and only the most recent ones are kept.
+"""
+import os
+import signal
+import sqlite3
+import time
+import uuid
+from io import BytesIO
+from multiprocessing import Pool
+
+import numpy
+
+from ReaderPool import ReaderPool
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_CREATE_TABLE = """
+create table if not exists jobs (
+    id text primary key,
+    database text,
+    expression text,
+    status text,
+    submitted real,
+    started real,
+    finished real,
+    owner_pid integer,
+    worker_pid integer,
+    error text,
+    result blob)
+"""
+
+_STATUS_FIELDS = ("id", "database", "expression", "status", "submitted",
+                  "started", "finished", "error")
+
+
+def _connect(job_database):
+    connection = sqlite3.connect(job_database, timeout=30.0)
+    connection.execute(_CREATE_TABLE)
+    return connection
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+# Set in each worker process, which keeps its own readers open between jobs;
+# the readers of the server process cannot be used after forking.
+_worker_reader_pool = None
+
+
+def _initialize_worker(maximum_number_of_readers):
+    global _worker_reader_pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_reader_pool = ReaderPool(maximum_number_of_readers)
+
+
+def _run_job(job_database, job_id, database_path, expression,
+             max_result_bytes):
+    connection = _connect(job_database)
+    try:
+        with connection:
+            claimed = connection.execute(
+                "update jobs set status=?, started=?, worker_pid=? "
+                "where id=? and status=?",
+                (RUNNING, time.time(), os.getpid(), job_id, QUEUED)).rowcount
+        if not claimed:
+            return  # cancelled while queued
+        result, error = None, None
+        try:
+            reader = _worker_reader_pool.getReader(database_path)
+            value = reader.evaluateExpressionOnly(expression)
+            if value is None or isinstance(value, str):
+                error = "The expression cannot be evaluated."
+            else:
+                buffer = BytesIO()
+                numpy.save(buffer, numpy.asarray(value))
+                result = buffer.getvalue()
+                if len(result) > max_result_bytes:
+                    result, error = None, (
+                        "The result (%d bytes) is larger than the limit "
+                        "(%d bytes)." % (len(result), max_result_bytes))
+        except Exception as an_error:
+            error = "%s: %s" % (type(an_error).__name__, an_error)
+        with connection:
+            connection.execute(
+                "update jobs set status=?, finished=?, error=?, result=? "
+                "where id=? and status=?",
+                (FAILED if error else DONE, time.time(), error,
+                 sqlite3.Binary(result) if result is not None else None,
+                 job_id, RUNNING))
+    finally:
+        connection.close()
+
+
+class JobQueue(object):
+    def __init__(self, job_database, number_of_workers=2,
+                 retention_seconds=86400, max_finished_jobs=1000,
+                 max_result_bytes=256 << 20, readers_per_worker=4):
+        self.job_database = job_database
+        self.number_of_workers = number_of_workers
+        self.retention_seconds = retention_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self.max_result_bytes = max_result_bytes
+        self.readers_per_worker = readers_per_worker
+        self._pool = None  # started with the first job
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = Pool(self.number_of_workers, _initialize_worker,
+                              (self.readers_per_worker,))
+        return self._pool
+
+    def submit(self, database_path, expression):
+        """Queues the evaluation of the expression and returns the job id."""
+        job_id = uuid.uuid4().hex
+        connection = _connect(self.job_database)
+        try:
+            with connection:
+                connection.execute(
+                    "insert into jobs (id, database, expression, status, "
+                    "submitted, owner_pid) values (?, ?, ?, ?, ?, ?)",
+                    (job_id, database_path, expression, QUEUED, time.time(),
+                     os.getpid()))
+        finally:
+            connection.close()
+        self._get_pool().apply_async(
+            _run_job, (self.job_database, job_id, database_path, expression,
+                       self.max_result_bytes))
+        self.remove_old_jobs()
+        return job_id
+
+    def get_status(self, job_id):
+        """Returns the job as a dictionary without the result, or None."""
+        connection = _connect(self.job_database)
+        try:
+            row = connection.execute(
+                "select %s from jobs where id=?" % ", ".join(_STATUS_FIELDS),
+                (job_id,)).fetchone()
+        finally:
+            connection.close()
+        return dict(zip(_STATUS_FIELDS, row)) if row else None
+
+    def wait(self, job_id, timeout, poll_interval=0.2):
+        """Returns the status once the job is finished or after timeout."""
+        end_time = time.time() + timeout
+        while True:
+            status = self.get_status(job_id)
+            if (status is None or status["status"] in FINISHED_STATES or
+                    time.time() >= end_time):
+                return status
+            time.sleep(poll_interval)
+
+    def get_result(self, job_id):
+        """Returns the result of a finished job as an array, or None."""
+        connection = _connect(self.job_database)
+        try:
+            row = connection.execute(
+                "select result from jobs where id=? and status=?",
+                (job_id, DONE)).fetchone()
+        finally:
+            connection.close()
+        if row is None or row[0] is None:
+            return None
+        # object arrays (e.g. of lists of different lengths) are pickled by
+        # numpy.save; the results are only written by the workers above
+        return numpy.load(BytesIO(bytes(row[0])), allow_pickle=True)
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job; returns False if it is finished.
+
+        A running job is stopped by terminating its worker process, which
+        the pool replaces. The job table is locked for writing while this is
+        done: a worker has to write to it to finish its job before moving on
+        to another one, so a job still running holds its worker.
+        """
+        connection = _connect(self.job_database)
+        try:
+            with connection:
+                connection.execute("begin immediate")
+                row = connection.execute(
+                    "select status, worker_pid from jobs where id=?",
+                    (job_id,)).fetchone()
+                if row is None or row[0] in FINISHED_STATES:
+                    return False
+                if row[0] == RUNNING and row[1]:
+                    try:
+                        os.kill(row[1], signal.SIGTERM)
+                    except OSError:
+                        pass
+                connection.execute(
+                    "update jobs set status=?, finished=? where id=?",
+                    (CANCELLED, time.time(), job_id))
+        finally:
+            connection.close()
+        return True
+
+    def remove_old_jobs(self):
+        """Applies the retention limits, and fails the jobs whose server or
+        worker process has died."""
+        now = time.time()
+        connection = _connect(self.job_database)
+        try:
+            with connection:
+                for job_id, status, owner_pid, worker_pid in (
+                        connection.execute(
+                            "select id, status, owner_pid, worker_pid from "
+                            "jobs where status in (?, ?)",
+                            (QUEUED, RUNNING)).fetchall()):
+                    pid = worker_pid if status == RUNNING else owner_pid
+                    if not _is_process_alive(pid):
+                        connection.execute(
+                            "update jobs set status=?, finished=?, error=? "
+                            "where id=? and status=?",
+                            (FAILED, now, "The job was interrupted.",
+                             job_id, status))
+                connection.execute(
+                    "delete from jobs where finished < ?",
+                    (now - self.retention_seconds,))
+                connection.execute(
+                    "delete from jobs where id in (select id from jobs "
+                    "where finished is not null order by finished desc "
+                    "limit -1 offset ?)", (self.max_finished_jobs,))
+        finally:
+            connection.close()
+
+    def get_counts(self):
+        """Returns the number of jobs in each state."""
+        connection = _connect(self.job_database)
+        try:
+            return dict(connection.execute(
+                "select status, count(*) from jobs group by status"))
+        finally:
+            connection.close()
@@ -0,0 +1,161 @@
+"""
+Cache of rendered query results, shared by all requests served by a process.
+
+Entries are kept in memory up to a total size, and optionally also written to
+a folder on disk up to another total size, so that they survive restarts and
+can be shared by several server processes. The least recently used entries are
+dropped first. Keys are made by make_key from everything the result depends
+on, including the modification time and size of the database file, so entries
+of a database that has been replaced are never used again and simply age out.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def normalize_expression(expression):
+    """Returns the expression without spaces, which do not change its value."""
+    return "".join(expression.split())
+
+
+def make_key(database_name, mtime, size, expression, output_format):
+    """Returns the cache key, also used as ETag, of a query result."""
+    parts = [database_name, repr(mtime), str(size),
+             normalize_expression(expression), output_format]
+    return hashlib.sha1(
+        "\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, max_memory_bytes, max_disk_bytes=0, directory=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes if directory else 0
+        self.directory = directory
+        self._memory = OrderedDict()  # key -> body
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size of the file
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.statistics = {"hits": 0, "disk_hits": 0, "misses": 0,
+                           "not_modified": 0, "stores": 0, "evictions": 0}
+        if self.max_disk_bytes:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entries = []
+        for file_name in os.listdir(self.directory):
+            file_path = os.path.join(self.directory, file_name)
+            if file_name.endswith(".tmp") or not os.path.isfile(file_path):
+                continue
+            status = os.stat(file_path)
+            entries.append((status.st_mtime, file_name, status.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._shrink_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Returns the cached body for the key, or None."""
+        with self._lock:
+            body = self._memory.pop(key, None)
+            if body is not None:
+                self._memory[key] = body
+                self.statistics["hits"] += 1
+                return body
+            if key in self._disk:
+                try:
+                    with open(self._disk_path(key), "rb") as cache_file:
+                        body = cache_file.read()
+                except (IOError, OSError):
+                    # Removed by another process sharing the folder.
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk[key] = self._disk.pop(key)
+                    self.statistics["disk_hits"] += 1
+                    self._store_in_memory(key, body)
+                    return body
+            self.statistics["misses"] += 1
+            return None
+
+    def put(self, key, body):
+        """Stores the body (a byte string) under the key."""
+        with self._lock:
+            self.statistics["stores"] += 1
+            self._store_in_memory(key, body)
+            if self.max_disk_bytes and len(body) <= self.max_disk_bytes:
+                self._store_on_disk(key, body)
+
+    def record_not_modified(self):
+        """Counts a conditional request answered with 304."""
+        with self._lock:
+            self.statistics["not_modified"] += 1
+
+    def _store_in_memory(self, key, body):
+        if len(body) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = body
+        self._memory_bytes += len(body)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, dropped = self._memory.popitem(last=False)
+            self._memory_bytes -= len(dropped)
+            self.statistics["evictions"] += 1
+
+    def _store_on_disk(self, key, body):
+        if key in self._disk:
+            return
+        temporary_path = "%s.%d.tmp" % (self._disk_path(key), os.getpid())
+        try:
+            with open(temporary_path, "wb") as cache_file:
+                cache_file.write(body)
+            os.rename(temporary_path, self._disk_path(key))
+        except (IOError, OSError):
+            return
+        self._disk[key] = len(body)
+        self._disk_bytes += len(body)
+        self._shrink_disk()
+
+    def _shrink_disk(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for key in self._disk:
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._disk_bytes = 0
+
+    def get_status(self):
+        """Returns a dictionary with the sizes and the hit counters."""
+        with self._lock:
+            status = dict(self.statistics)
+            lookups = status["hits"] + status["disk_hits"] + status["misses"]
+            status["hit_rate"] = (
+                float(status["hits"] + status["disk_hits"]) / lookups
+                if lookups else 0.0)
+            status.update({
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes})
+            return status
@@ -0,0 +1,86 @@
+"""
+Streaming output formats for query results.
+
+Each format is a generator of byte strings writing a numpy array a chunk at a
+time, so that large results are sent while they are being formatted instead
+of being formatted in memory first.
+
+json: {"dtype": "float64", "shape": [n, m], "data": [...]}, where "data" lists
+      the elements in C order; complex elements are [real, imag] pairs and
+      values that are not finite are null.
+npy:  the numpy .npy file format, which can be read with numpy.load.
+"""
+import json
+from io import BytesIO
+
+import numpy
+from numpy.lib import format as npy_format
+
+
+CHUNK_SIZE = 65536  # elements per chunk
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "npy": "application/octet-stream",
+}
+
+
+def _as_array(results):
+    return numpy.require(numpy.asarray(results), requirements="C")
+
+
+def _json_values(chunk):
+    if numpy.iscomplexobj(chunk):
+        values = numpy.column_stack((chunk.real, chunk.imag))
+    else:
+        values = chunk
+    if values.dtype.kind == "f" and not numpy.isfinite(values).all():
+        values = numpy.where(numpy.isfinite(values), values, None)
+    return json.dumps(values.tolist())[1:-1]
+
+
+def iterate_json(results, chunk_size=CHUNK_SIZE):
+    array = _as_array(results)
+    yield ('{"dtype": %s, "shape": %s, "data": ['
+           % (json.dumps(array.dtype.name),
+              json.dumps(list(array.shape)))).encode("utf-8")
+    flat = array.reshape(-1)
+    for start in range(0, flat.size, chunk_size):
+        separator = "," if start else ""
+        yield (separator +
+               _json_values(flat[start:start + chunk_size])).encode("utf-8")
+    yield b"]}"
+
+
+def check_results(results, output_format):
+    """Raises ValueError if the results cannot be written in the format.
+
+    It is called before the response is started, since an error raised by a
+    generator arrives after the status and headers have been sent.
+    """
+    if output_format == "npy" and numpy.asarray(results).dtype.hasobject:
+        raise ValueError("Results of type object cannot be written as npy.")
+
+
+def iterate_npy(results, chunk_size=CHUNK_SIZE):
+    array = _as_array(results)
+    header = BytesIO()
+    npy_format.write_array_header_1_0(
+        header, npy_format.header_data_from_array_1_0(array))
+    yield header.getvalue()
+    flat = array.reshape(-1)
+    for start in range(0, flat.size, chunk_size):
+        yield flat[start:start + chunk_size].tobytes()
+
+
+ITERATORS = {
+    "json": iterate_json,
+    "npy": iterate_npy,
+}
+
+
+def get_metadata_headers(results):
+    """Returns the HTTP headers giving the dtype and shape of the results."""
+    array = numpy.asarray(results)
+    return {"X-Array-Dtype": array.dtype.str,
+            "X-Array-Shape": ",".join(str(n) for n in array.shape)}
@@ -1,3 +1,148 @@
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+from io import BytesIO
+from os import path
+
+import numpy
 from django.test import TestCase
 
-# Create your tests here.
+from query_server import bridge
+from query_server import database_index
+from query_server import jobs
+from query_server import result_cache
+from query_server import views
+
+
+def _create_database(database_path):
+    """Creates a small database of three events with pion multiplicities."""
+    connection = sqlite3.connect(database_path)
+    connection.executescript(
+        "create table ecc_id_lookup (ecc_id integer, ecc_type_name text);"
+        "create table pid_lookup (name text, pid integer);"
+        "insert into pid_lookup values ('pion', 1);"
+        "create table multiplicities (event_id integer, pid integer, "
+        "N real);"
+        "insert into multiplicities values (1, 1, 100.0);"
+        "insert into multiplicities values (2, 1, 200.0);"
+        "insert into multiplicities values (3, 1, 300.0);")
+    connection.commit()
+    connection.close()
+
+
+class QueryServerTestCase(TestCase):
+    """Serves the views from a temporary database folder, with their own
+    result cache, job queue and database index."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        _create_database(path.join(self.directory, "test.db"))
+        self.saved = (bridge.DATABASE_RELATIVE_PATH, views.RESULT_CACHE,
+                      views.JOB_QUEUE, views.DATABASE_INDEX)
+        bridge.DATABASE_RELATIVE_PATH = self.directory
+        views.RESULT_CACHE = result_cache.ResultCache(
+            max_memory_bytes=1 << 20)
+        views.JOB_QUEUE = jobs.JobQueue(
+            path.join(self.directory, "jobs.sqlite3"), number_of_workers=1)
+        views.DATABASE_INDEX = database_index.DatabaseIndex(self.directory)
+
+    def tearDown(self):
+        if views.JOB_QUEUE._pool is not None:
+            views.JOB_QUEUE._pool.terminate()
+            views.JOB_QUEUE._pool.join()
+        (bridge.DATABASE_RELATIVE_PATH, views.RESULT_CACHE,
+         views.JOB_QUEUE, views.DATABASE_INDEX) = self.saved
+        bridge.READER_POOL.clear()
+        shutil.rmtree(self.directory)
+
+    def _query(self, expression, output_format, **headers):
+        return self.client.get("/query", {bridge.DATABASE_PARAM: "test",
+                                          bridge.EXPR_PARAM: expression,
+                                          bridge.FORMAT: output_format},
+                               **headers)
+
+
+class QueryTests(QueryServerTestCase):
+    def test_conditional_get(self):
+        response = self._query("<N(pion)>", "plain")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("200", response.content.decode("utf-8"))
+        etag = response["ETag"]
+        response = self._query("<N(pion)>", "plain", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self._query("<N(pion)>", "table", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(views.RESULT_CACHE.get_status()["not_modified"], 1)
+
+    def test_streaming_formats(self):
+        response = self._query("linspace(0, 1, 5)", "json")
+        self.assertTrue(response.streaming)
+        content = json.loads(
+            b"".join(response.streaming_content).decode("utf-8"))
+        self.assertEqual(content["shape"], [5])
+        self.assertEqual(content["data"], [0.0, 0.25, 0.5, 0.75, 1.0])
+
+        response = self._query("linspace(0, 1, 5)", "npy")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["X-Array-Shape"], "5")
+        array = numpy.load(BytesIO(b"".join(response.streaming_content)))
+        self.assertTrue(numpy.allclose(array, numpy.linspace(0, 1, 5)))
+
+    def test_object_results_as_npy(self):
+        # Rejected before the response is started, so that the error page
+        # is sent instead of a truncated file.
+        response = self._query("[[1], [1, 2]]", "npy")
+        self.assertFalse(response.streaming)
+        self.assertTemplateUsed(response, "query_error.tmpl")
+
+    def test_status_and_databases(self):
+        self._query("<N(pion)>", "plain")
+        content = json.loads(self.client.get("/status").content.decode(
+            "utf-8"))
+        self.assertEqual(set(content), set(["result_cache", "reader_pool",
+                                            "jobs"]))
+        content = json.loads(self.client.get("/databases").content.decode(
+            "utf-8"))
+        self.assertEqual([entry["name"] for entry in content], ["test.db"])
+        self.assertEqual(content[0]["particles"], ["pion"])
+
+
+class JobTests(QueryServerTestCase):
+    def _submit(self, expression):
+        response = self.client.post("/jobs", {bridge.DATABASE_PARAM: "test",
+                                              bridge.EXPR_PARAM: expression})
+        self.assertEqual(response.status_code, 202)
+        return json.loads(response.content.decode("utf-8"))["id"]
+
+    def _get_status(self, job_id, wait=0):
+        response = self.client.get("/jobs/%s" % job_id, {"wait": wait})
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_job(self):
+        job_id = self._submit("<N(pion)>")
+        self.assertEqual(self._get_status(job_id, wait=30)["status"],
+                         jobs.DONE)
+        response = self.client.get("/jobs/%s/result" % job_id,
+                                   {bridge.FORMAT: "json"})
+        content = json.loads(
+            b"".join(response.streaming_content).decode("utf-8"))
+        self.assertEqual(content["data"], [200.0])
+        response = self.client.post("/jobs/%s/cancel" % job_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get("/jobs/0123").status_code, 404)
+
+    def test_cancel_running_job(self):
+        job_id = self._submit("time.sleep(30)")
+        end_time = time.time() + 30
+        while (self._get_status(job_id)["status"] != jobs.RUNNING and
+               time.time() < end_time):
+            time.sleep(0.1)
+        response = self.client.post("/jobs/%s/cancel" % job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._get_status(job_id)["status"], jobs.CANCELLED)
+        # The pool replaces the terminated worker.
+        job_id = self._submit("<N(pion)>")
+        self.assertEqual(self._get_status(job_id, wait=30)["status"],
+                         jobs.DONE)
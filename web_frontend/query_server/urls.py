@@ -7,5 +7,13 @@ urlpatterns = patterns(
     '',
     url(r'^home/$', views.home, name='query'),
     url(r'^query$', views.query, name='query'),
+    url(r'^status$', views.status, name='status'),
+    url(r'^databases$', views.databases, name='databases'),
+    url(r'^jobs$', views.submit_job, name='submit_job'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]+)$', views.job_status, name='job_status'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]+)/result$', views.job_result,
+        name='job_result'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]+)/cancel$', views.cancel_job,
+        name='cancel_job'),
     url(r'^$', views.home, name='query'),
 )
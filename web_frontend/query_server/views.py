@@ -1,11 +1,102 @@
+import json
 import logging
 from numpy import ndarray
 import os
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 from django.template import RequestContext, loader
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 import bridge
+import database_index
+import jobs
+import result_cache
+import streaming
+
+
+RESULT_CACHE = result_cache.ResultCache(
+    max_memory_bytes=getattr(settings, "QUERY_CACHE_MEMORY_BYTES", 64 << 20),
+    max_disk_bytes=getattr(settings, "QUERY_CACHE_DISK_BYTES", 0),
+    directory=getattr(settings, "QUERY_CACHE_DIRECTORY", None))
+
+JOB_QUEUE = jobs.JobQueue(
+    getattr(settings, "QUERY_JOB_DATABASE", "query_jobs.sqlite3"),
+    number_of_workers=getattr(settings, "QUERY_JOB_WORKERS", 2),
+    retention_seconds=getattr(settings, "QUERY_JOB_RETENTION_SECONDS", 86400),
+    max_finished_jobs=getattr(settings, "QUERY_JOB_MAX_FINISHED", 1000),
+    max_result_bytes=getattr(settings, "QUERY_JOB_MAX_RESULT_BYTES",
+                             256 << 20))
+
+DATABASE_INDEX = database_index.DatabaseIndex(
+    bridge.DATABASE_RELATIVE_PATH,
+    index_file=getattr(settings, "QUERY_DATABASE_INDEX_FILE", None),
+    refresh_seconds=getattr(settings, "QUERY_DATABASE_INDEX_REFRESH_SECONDS",
+                            10.0))
+
+# Longest time a status request waits for its job to finish (long polling).
+MAX_JOB_WAIT_SECONDS = 30.0
+
+
+def _is_not_modified(request, etag, last_modified):
+    """Checks the conditional headers of the request; ETags take priority."""
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or "*" in etags
+    if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return (if_modified_since is not None and
+                int(last_modified) <= if_modified_since)
+    return False
+
+
+def _evaluate(database_name, expression):
+    query_bridge = bridge.QueryBridge()
+    query_bridge.set_database(database_name)
+    results = query_bridge.evaluate_expression(expression)
+
+    # None is returned when the expression cannot be evaluated.
+    if results is None or type(results) == str:
+        raise ValueError()
+    return results
+
+
+def _stream_results(database_name, expression, output_format):
+    return _make_streaming_response(_evaluate(database_name, expression),
+                                    output_format)
+
+
+def _make_streaming_response(results, output_format):
+    streaming.check_results(results, output_format)
+    response = StreamingHttpResponse(
+        streaming.ITERATORS[output_format](results),
+        content_type=streaming.CONTENT_TYPES[output_format])
+    for header, value in streaming.get_metadata_headers(results).items():
+        response[header] = value
+    if output_format == "npy":
+        response["Content-Disposition"] = "attachment; filename=result.npy"
+    return response
+
+
+def _render_results(request, database_name, expression, output_format):
+    results = _evaluate(database_name, expression)
+
+    # Make results iterable.
+    if type(results) != ndarray:
+        results = [results]
+
+    template = loader.get_template("query_%s.tmpl" % output_format)
+    context = RequestContext(request, {
+        "query_content": expression,
+        "query_result": results})
+    return template.render(context).encode("utf-8")
 
 
 def query(request):
@@ -20,24 +111,32 @@ def query(request):
         if not expression:
             raise ValueError()
 
-        query_bridge = bridge.QueryBridge()
-        query_bridge.set_database(database_name)
-        results = query_bridge.evaluate_expression(expression)
-
-        if not results:
-            raise ValueError()
-
-        # Make results iterable; special case when it is a string.
-        if type(results) == str:
-            raise ValueError()
-        elif type(results) != ndarray:
-            results = [results]
-
-        template = loader.get_template("query_%s.tmpl" % output_format)
-        context = RequestContext(request, {
-            "query_content": expression,
-            "query_result": results})
-        return HttpResponse(template.render(context))
+        # The result only changes when the database file does, so the
+        # response can be validated without evaluating the expression.
+        mtime, size = bridge.get_database_identity(database_name)
+        etag = result_cache.make_key(
+            bridge.get_database_file_name(database_name), mtime, size,
+            expression, output_format)
+        if _is_not_modified(request, etag, mtime):
+            RESULT_CACHE.record_not_modified()
+            response = HttpResponseNotModified()
+        elif output_format in streaming.ITERATORS:
+            # Streamed results are sent while being written, not cached.
+            response = _stream_results(database_name, expression,
+                                       output_format)
+        else:
+            body = RESULT_CACHE.get(etag)
+            if body is None:
+                body = _render_results(request, database_name, expression,
+                                       output_format)
+                # Not stored when the database was replaced meanwhile.
+                if bridge.get_database_identity(database_name) == (mtime,
+                                                                   size):
+                    RESULT_CACHE.put(etag, body)
+            response = HttpResponse(body)
+        response["ETag"] = quote_etag(etag)
+        response["Last-Modified"] = http_date(mtime)
+        return response
 
     except ValueError:
         template = loader.get_template("query_error.tmpl")
@@ -46,14 +145,99 @@ def query(request):
             "database_param": bridge.DATABASE_PARAM,
             "expr_param": bridge.EXPR_PARAM,
             "fmt_plain": "plain",
-            "fmt_table": "table"})
+            "fmt_table": "table",
+            "fmt_json": "json",
+            "fmt_npy": "npy"})
         return HttpResponse(template.render(context))
 
 
+def status(request):
+    pool = bridge.READER_POOL
+    reader_pool_status = dict(pool.statistics)
+    reader_pool_status["databases"] = pool.getDatabaseFilenames()
+    content = {"result_cache": RESULT_CACHE.get_status(),
+               "reader_pool": reader_pool_status,
+               "jobs": JOB_QUEUE.get_counts()}
+    return HttpResponse(json.dumps(content, indent=2, sort_keys=True),
+                        content_type="application/json")
+
+
+def _json_response(content, status=200):
+    return HttpResponse(json.dumps(content, indent=2, sort_keys=True),
+                        content_type="application/json", status=status)
+
+
+@csrf_exempt
+@require_POST
+def submit_job(request):
+    database_name = request.POST.get(bridge.DATABASE_PARAM, "")
+    expression = request.POST.get(bridge.EXPR_PARAM, "")
+    if not expression:
+        return _json_response({"error": "No expression given."}, 400)
+    try:
+        database_path = bridge.get_database_path(database_name)
+    except ValueError as error:
+        return _json_response({"error": str(error)}, 400)
+
+    job_id = JOB_QUEUE.submit(database_path, expression)
+    logging.info("Job %s with expr=%s, database=%s",
+                 job_id, expression, database_name)
+    response = _json_response({"id": job_id, "status": jobs.QUEUED}, 202)
+    response["Location"] = reverse("job_status", args=[job_id])
+    return response
+
+
+def job_status(request, job_id):
+    """Returns the job status; with "wait" (in seconds), waits until the job
+    is finished, for at most MAX_JOB_WAIT_SECONDS."""
+    try:
+        wait = min(float(request.GET.get("wait", 0)), MAX_JOB_WAIT_SECONDS)
+    except ValueError:
+        return _json_response({"error": "Invalid wait time."}, 400)
+    status = JOB_QUEUE.wait(job_id, wait)
+    if status is None:
+        return _json_response({"error": "Unknown job."}, 404)
+    return _json_response(status)
+
+
+def job_result(request, job_id):
+    output_format = request.GET.get(bridge.FORMAT, "json")
+    if output_format not in streaming.ITERATORS:
+        return _json_response({"error": "Unknown format %s." % output_format},
+                              400)
+    status = JOB_QUEUE.get_status(job_id)
+    if status is None:
+        return _json_response({"error": "Unknown job."}, 404)
+    if status["status"] != jobs.DONE:
+        return _json_response(status, 409)
+    results = JOB_QUEUE.get_result(job_id)
+    if results is None:
+        # Removed by the retention limits since the status was read.
+        return _json_response({"error": "Unknown job."}, 404)
+    try:
+        return _make_streaming_response(results, output_format)
+    except ValueError as error:
+        return _json_response({"error": str(error)}, 400)
+
+
+@csrf_exempt
+@require_POST
+def cancel_job(request, job_id):
+    if not JOB_QUEUE.cancel(job_id):
+        status = JOB_QUEUE.get_status(job_id)
+        if status is None:
+            return _json_response({"error": "Unknown job."}, 404)
+        return _json_response(status, 409)
+    return _json_response(JOB_QUEUE.get_status(job_id))
+
+
+def databases(request):
+    return _json_response(DATABASE_INDEX.get_databases())
+
+
 def home(request):
-    print bridge.get_available_database_names()
     template = loader.get_template("query_homepage.tmpl")
     context = RequestContext(request, {
-        "database_names": bridge.get_available_database_names(),
-        "formats": ["table", "plain"]})
+        "databases": DATABASE_INDEX.get_databases(),
+        "formats": ["table", "plain", "json", "npy"]})
     return HttpResponse(template.render(context))
@@ -81,3 +81,33 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.6/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Query server
+
+# Folder of the databases served, relative to the working directory.
+QUERY_DATABASE_DIRECTORY = 'databases'
+
+# Number of database readers kept open between queries.
+QUERY_READER_POOL_SIZE = 8
+
+# Bounds of the cache of query results, in bytes; results are also kept on
+# disk in QUERY_CACHE_DIRECTORY when QUERY_CACHE_DISK_BYTES is not 0.
+QUERY_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+QUERY_CACHE_DISK_BYTES = 0
+QUERY_CACHE_DIRECTORY = os.path.join(BASE_DIR, 'query_cache')
+
+# Jobs submitted to /jobs are evaluated by QUERY_JOB_WORKERS processes and
+# recorded in QUERY_JOB_DATABASE; finished jobs are removed after
+# QUERY_JOB_RETENTION_SECONDS, and at most QUERY_JOB_MAX_FINISHED are kept.
+QUERY_JOB_DATABASE = os.path.join(BASE_DIR, 'query_jobs.sqlite3')
+QUERY_JOB_WORKERS = 2
+QUERY_JOB_RETENTION_SECONDS = 24 * 3600
+QUERY_JOB_MAX_FINISHED = 1000
+QUERY_JOB_MAX_RESULT_BYTES = 256 * 1024 * 1024
+
+# Metadata of the databases listed on the home page and at /databases; the
+# database folder is checked for changes at most every
+# QUERY_DATABASE_INDEX_REFRESH_SECONDS.
+QUERY_DATABASE_INDEX_FILE = os.path.join(BASE_DIR, 'query_database_index.json')
+QUERY_DATABASE_INDEX_REFRESH_SECONDS = 10